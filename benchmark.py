@@ -0,0 +1,264 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+# Benchmarks run against throw-away libraries and render Qt widgets without a display.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ.setdefault("PAPERFLUX_DB", ":memory:")
+
+import database
+import fuzzy_search
+from database import Database, Folder, Paper
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+WORDS = (
+    "attention", "transformer", "learning", "deep", "neural", "network", "graph", "diffusion", "model",
+    "language", "vision", "reinforcement", "policy", "optimization", "gradient", "sparse", "efficient",
+    "retrieval", "generative", "adversarial", "contrastive", "representation", "bayesian", "inference",
+    "kernel", "convolutional", "recurrent", "memory", "scaling", "benchmark", "robust", "federated",
+    "quantization", "distillation", "embedding", "multimodal", "causal", "probabilistic", "survey", "theory",
+)
+SEARCH_TERM = "transformer"
+FUZZY_SEARCH_TERM = "transfromer atention"
+
+
+# ==============================
+# SYNTHETIC LIBRARY
+# ==============================
+def folder_count(n_papers: int):
+    return max(10, min(1000, n_papers // 100))
+
+
+def synthetic_papers(n_papers: int, seed: int = 0):
+    rng = random.Random(seed)
+    n_folders = folder_count(n_papers)
+    start = datetime.datetime(2020, 1, 1)
+    for i in range(n_papers):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))).title() + f" {i}"
+        added_at = start + datetime.timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60))
+        last_view = added_at + datetime.timedelta(days=rng.randint(0, 300)) if rng.random() < 0.3 else None
+        local = rng.random() < 0.7
+        file_path = f"/library/{i}.pdf" if local else f"https://example.org/papers/{i}"
+        yield (
+            f"synthetic-{i}",
+            title,
+            None,
+            None,
+            file_path,
+            None if local else file_path,
+            added_at,
+            last_view,
+            3 + rng.randrange(n_folders),
+        )
+
+
+def create_library(db_name: str, n_papers: int, seed: int = 0):
+    """Point database.DATABASE at a fresh library with n_papers rows, returns the insert time in seconds."""
+    database.DATABASE = Database(db_name)
+    Folder.default_entries()
+    Paper.default_entries()
+
+    conn = database.DATABASE.conn
+    with conn:
+        conn.executemany(
+            "INSERT INTO folders (folder_name, parent_folder_id) VALUES (?, 0)",
+            ((f"Folder {i}",) for i in range(folder_count(n_papers)))
+        )
+
+    started = time.perf_counter()
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO papers (arxiv_id, title, authors, abstract, file_path, website_url, added_at, last_view, folder_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            synthetic_papers(n_papers, seed)
+        )
+    return time.perf_counter() - started
+
+
+# ==============================
+# MEASUREMENTS
+# ==============================
+def measure(func, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "runs": repeat,
+    }
+
+
+def bench_database(results: dict, repeat: int):
+    results["get_all_papers"] = measure(Paper.get_all_papers, repeat)
+    results["search_paper"] = measure(lambda: Paper.search_paper(SEARCH_TERM), repeat)
+    results["fuzzy_search"] = measure(lambda: fuzzy_search.search(FUZZY_SEARCH_TERM), repeat)
+    results["get_last_n_viewed_papers"] = measure(Paper.get_last_n_viewed_papers, repeat)
+    results["get_last_viewed_paper"] = measure(Paper.get_last_viewed_paper, repeat)
+
+
+def bench_ui(results: dict, repeat: int):
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    from details import Details
+    from main import PaperFlux
+
+    started = time.perf_counter()
+    window = PaperFlux()
+    results["window_init"] = {"min_ms": round((time.perf_counter() - started) * 1000, 3), "runs": 1}
+
+    papers = Paper.get_all_papers()
+
+    def populate():
+        window.load_library(papers)
+        app.processEvents()
+
+    results["load_library"] = measure(populate, repeat)
+
+    from tree_widget import FOLDER_ROLE
+
+    # The tree is lazy, load_library only creates the folder items. Populating every folder is the work
+    # load_library did before, so that number stays comparable with older results.
+    def folder_items():
+        return [item for i in range(window.tree_widget.topLevelItemCount())
+                if (item := window.tree_widget.topLevelItem(i)).data(0, FOLDER_ROLE) is not None]
+
+    def populate_all():
+        window.load_library(papers)
+        for item in folder_items():
+            window.populate_folder(item)
+        app.processEvents()
+
+    results["load_library_populated"] = measure(populate_all, repeat)
+
+    def load_full_library():
+        window.load_full_library()
+        app.processEvents()
+
+    results["load_full_library"] = measure(load_full_library, repeat)
+
+    # Expanding the largest category, what a click on it costs
+    largest_folder_id = max(window.library_papers, key=lambda folder_id: len(window.library_papers[folder_id]))
+
+    def expand_category():
+        window.load_library(papers)
+        item = next(item for item in folder_items() if item.data(0, FOLDER_ROLE) == largest_folder_id)
+        started = time.perf_counter()
+        window.populate_folder(item)
+        app.processEvents()
+        return time.perf_counter() - started
+
+    timings = [expand_category() * 1000 for _ in range(repeat)]
+    results["expand_category"] = {"min_ms": round(min(timings), 3), "median_ms": round(statistics.median(timings), 3),
+                                  "runs": repeat}
+
+    details = Details()
+    paper_ids = iter([paper[0] for paper in papers[:repeat]] or [1] * repeat)
+    results["details_update_display"] = measure(lambda: details.update_display(next(paper_ids)), repeat)
+
+    window.close()
+    window.deleteLater()
+    details.deleteLater()
+    app.processEvents()
+
+
+def run(sizes, repeat: int, ui_max: int, seed: int):
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeat": repeat,
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": {},
+    }
+    workdir = tempfile.mkdtemp(prefix="paperflux-bench-")
+    try:
+        for n_papers in sizes:
+            print(f"{n_papers} papers ...", file=sys.stderr, flush=True)
+            results = {}
+            insert_seconds = create_library(os.path.join(workdir, f"library_{n_papers}.db"), n_papers, seed)
+            results["bulk_insert"] = {
+                "min_ms": round(insert_seconds * 1000, 3),
+                "rows_per_second": round(n_papers / insert_seconds),
+                "runs": 1,
+            }
+            bench_database(results, repeat)
+            if n_papers <= ui_max:
+                bench_ui(results, repeat)
+            database.DATABASE.close()
+            report["results"][str(n_papers)] = results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+# ==============================
+# COMPARISON
+# ==============================
+def compare(baseline: dict, current: dict, threshold: float):
+    """Print the ratio current/baseline of every benchmark, returns the number of regressions."""
+    regressions = 0
+    print(f"{'size':>9}  {'benchmark':<26} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for size, results in current["results"].items():
+        for name, result in results.items():
+            before = baseline["results"].get(size, {}).get(name)
+            if before is None:
+                continue
+            ratio = result["min_ms"] / before["min_ms"] if before["min_ms"] else float("inf")
+            flag = ""
+            if ratio > threshold:
+                regressions += 1
+                flag = "  REGRESSION"
+            print(f"{size:>9}  {name:<26} {before['min_ms']:>12.3f} {result['min_ms']:>12.3f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PaperFlux database and UI hot paths on synthetic libraries.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ui-max", type=int, default=100_000,
+                        help="skip the Qt benchmarks for libraries larger than this")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against an earlier JSON result")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="ratio above which --compare reports a regression")
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat, args.ui_max, args.seed)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        return 1 if compare(baseline, report, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,615 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import unicodedata
+from functools import lru_cache
+from uuid import uuid4
+
+import database
+from database import Folder
+from utils import FILE_PATH
+
+# Streaming BibTeX, RIS and CSL-JSON import and export. Readers yield one record at a time from an open
+# file and writers emit one entry at a time from a database cursor, so memory does not grow with the
+# file. Imports are committed in batches and skip papers already in the library: same arXiv id, DOI,
+# file or content key (normalized title and first author). Reading needs no database, so the window
+# reads on the job pool and stores each batch on the GUI thread.
+
+FORMATS = ("bibtex", "ris", "csl-json")
+EXTENSIONS = {".bib": "bibtex", ".bibtex": "bibtex", ".ris": "ris", ".json": "csl-json"}
+BATCH_SIZE = 1000
+# Rows the window stores at a time, a short enough pause for the GUI thread
+GUI_BATCH_SIZE = 100
+READ_SIZE = 1 << 16
+
+ARXIV_ID = re.compile(r"(?:arxiv[:./\s]*|arxiv\.org/(?:abs|pdf)/)(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?",
+                      re.IGNORECASE)
+ACCENTS = {"'": "\u0301", '"': "\u0308", "`": "\u0300", "^": "\u0302", "~": "\u0303", "=": "\u0304",
+           ".": "\u0307", "u": "\u0306", "v": "\u030c", "H": "\u030b", "c": "\u0327"}
+LATEX_ACCENT = re.compile(r"\\([\'\"`^~=.uvHc])\s*\{?\\?([A-Za-z])\}?")
+LATEX_ESCAPE = re.compile(r"\\([&%$#_{}])")
+LATEX_COMMAND = re.compile(r"\\([A-Za-z]+)\s*")
+# Commands that stand for a word; the others (\emph, \textit, ...) only format their argument
+LATEX_WORDS = {"LaTeX": "LaTeX", "TeX": "TeX", "BibTeX": "BibTeX", "ss": "ß", "o": "ø", "O": "Ø", "ae": "æ",
+               "aa": "å", "l": "ł", "i": "ı"}
+
+
+def detect_format(path: str):
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), "bibtex")
+
+
+def plain(text: str):
+    """text without case, accents, spaces or punctuation."""
+    text = "".join(char for char in unicodedata.normalize("NFKD", text or "") if not unicodedata.combining(char))
+    return re.sub(r"[\W_]+", "", text.casefold())
+
+
+def content_key(title: str, authors):
+    """
+    Hash of the title and the first author's surname, ignoring what plain() drops, so re-exported copies
+    still match. authors is a list of "First Last" names or the library's comma-separated column.
+    """
+    names = (authors or "").split(",") if isinstance(authors, str) or authors is None else authors
+    first_author = next((name.split() for name in names if name.strip()), [""])
+    return hashlib.sha1(f"{plain(title)}|{plain(first_author[-1])}".encode()).hexdigest()
+
+
+def find_arxiv_id(*values):
+    for value in values:
+        if value and (match := ARXIV_ID.search(value)):
+            return match.group(1)
+    return None
+
+
+def normalize_doi(doi):
+    if not doi:
+        return None
+    return re.sub(r"^(https?://(dx\.)?doi\.org/|doi:\s*)", "", doi.strip(), flags=re.IGNORECASE).lower() or None
+
+
+# ==================================================================================================
+# BibTeX
+
+BRACE = re.compile(r"\\.|[{}]")
+ENTRY_START = re.compile(r"\n(?=[ \t]*@)")
+# A field whose value needs no brace matching, macro expansion or concatenation
+SIMPLE_FIELD = re.compile(r'\s*,?\s*([\w\-:.]+)\s*=\s*(?:\{([^{}\\]*)\}|"([^"{}\\]*)"|(\d+))(?=\s*[,}])')
+QUOTE_OR_BRACE = re.compile(r'\\.|[{}"]')
+FIELD_NAME = re.compile(r"\s*,?\s*([\w\-:.]+)\s*=\s*")
+BARE_VALUE = re.compile(r"[^,#}\s]*")
+CONCATENATION = re.compile(r"\s*#\s*")
+
+
+def latex_to_text(value: str):
+    if "\\" not in value and "~" not in value and "--" not in value:
+        return " ".join(value.replace("{", "").replace("}", "").split())
+    value = LATEX_ACCENT.sub(lambda m: unicodedata.normalize("NFC", m.group(2) + ACCENTS[m.group(1)]), value)
+    value = LATEX_ESCAPE.sub(r"\1", value)
+    value = LATEX_COMMAND.sub(lambda m: LATEX_WORDS.get(m.group(1), ""), value.replace("~", " ").replace("--", "–"))
+    return " ".join(value.replace("{", "").replace("}", "").split())
+
+
+def brace_depth_change(line: str):
+    # An escaped backslash right before a brace is rare enough to ignore
+    return line.count("{") - line.count("}") - line.count("\\{") + line.count("\\}")
+
+
+def iter_bibtex_entries(f):
+    """Yield the raw text of each @entry{...}, reading the file in chunks."""
+    pending = ""
+    while True:
+        chunk = f.read(READ_SIZE)
+        pieces = ENTRY_START.split(pending + chunk)
+        # The last piece may continue in the next chunk
+        pending = pieces.pop() if chunk else ""
+        carry = ""
+        for piece in pieces:
+            text = carry + piece
+            start = text.find("@")
+            if start < 0:
+                carry = ""
+                continue
+            entry = text[start:]
+            if "{" in entry and brace_depth_change(entry) == 0:
+                carry = ""
+                yield entry
+                continue
+            # Either a stray brace in the comments after the entry, or a line starting with @ inside a field
+            # value and the entry goes on in the next piece
+            end = entry_end(entry)
+            if end < 0:
+                carry = text + "\n"
+                continue
+            carry = ""
+            yield entry[:end]
+        pending = carry + pending
+        if not chunk:
+            return
+
+
+def entry_end(entry: str):
+    """Index just past the brace closing the entry, -1 if it is not closed yet."""
+    depth = 0
+    for match in BRACE.finditer(entry):
+        token = match.group()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return -1
+
+
+def read_braced(text: str, start: int):
+    """Return (value, end) for the {...} group starting at text[start]."""
+    depth = 0
+    for match in BRACE.finditer(text, start):
+        token = match.group()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start + 1:match.start()], match.end()
+    return text[start + 1:], len(text)
+
+
+def read_quoted(text: str, start: int):
+    depth = 0
+    for match in QUOTE_OR_BRACE.finditer(text, start + 1):
+        token = match.group()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+        elif token == '"' and depth == 0:
+            return text[start + 1:match.start()], match.end()
+    return text[start + 1:], len(text)
+
+
+def parse_bibtex_entry(text: str, macros: dict):
+    """Return (entry_type, key, {field: raw value}) for one entry."""
+    header = re.match(r"@\s*(\w+)\s*\{\s*([^,\s]*)\s*,?", text)
+    if header is None:
+        return None, None, {}
+    entry_type, key = header.group(1).lower(), header.group(2)
+    if entry_type in ("comment", "preamble"):
+        return entry_type, key, {}
+    if entry_type == "string":
+        # @string{name = "value"}, parsed like a field list without a key
+        _, _, fields = parse_bibtex_entry("@s{," + text[text.index("{") + 1:], macros)
+        macros.update(fields)
+        return entry_type, key, {}
+
+    fields, position = {}, header.end()
+    while True:
+        if (simple := SIMPLE_FIELD.match(text, position)) is not None:
+            fields[simple.group(1).lower()] = simple.group(simple.lastindex)
+            position = simple.end()
+            continue
+        if (match := FIELD_NAME.match(text, position)) is None:
+            break
+        name, position, parts = match.group(1).lower(), match.end(), []
+        while position < len(text):
+            char = text[position]
+            if char == "{":
+                value, position = read_braced(text, position)
+            elif char == '"':
+                value, position = read_quoted(text, position)
+            else:
+                value = BARE_VALUE.match(text, position).group()
+                position += len(value)
+                value = macros.get(value.lower(), value)
+            parts.append(value)
+            concatenation = CONCATENATION.match(text, position)
+            if not concatenation:
+                break
+            position = concatenation.end()
+        fields[name] = "".join(parts)
+    return entry_type, key, fields
+
+
+def split_bibtex_authors(value: str):
+    """Split on "and" outside braces, turning "Last, First" into "First Last"."""
+    names, depth, start = [], 0, 0
+    for match in re.finditer(r"[{}]|\s+and\s+", value):
+        token = match.group()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+        elif depth == 0:
+            names.append(value[start:match.start()])
+            start = match.end()
+    names.append(value[start:])
+    return [bibtex_name(name) for name in names if name.strip()]
+
+
+@lru_cache(maxsize=4096)
+def bibtex_name(name: str):
+    # The same authors come back entry after entry
+    return display_name(latex_to_text(name))
+
+
+def display_name(name: str):
+    parts = [part.strip() for part in name.split(",")]
+    if len(parts) == 2:
+        return f"{parts[1]} {parts[0]}".strip()
+    if len(parts) == 3:
+        return f"{parts[2]} {parts[0]} {parts[1]}".strip()
+    return name.strip()
+
+
+def bibtex_file_path(value: str):
+    # Zotero and JabRef write "description:path:mime type", several attachments separated by ";"
+    for attachment in value.split(";"):
+        match = re.match(r"^(?:[^:]*:)?(.+?)(?::[\w.+-]+/[\w.+-]+)?$", attachment.strip())
+        if match and match.group(1).lower().endswith(".pdf"):
+            return match.group(1).replace("\\:", ":").replace("\\\\", "\\")
+    return None
+
+
+def read_bibtex(f):
+    macros = {}
+    for text in iter_bibtex_entries(f):
+        entry_type, key, fields = parse_bibtex_entry(text, macros)
+        if not fields:
+            continue
+        # URLs, DOIs and file paths are verbatim in BibTeX, LaTeX escapes do not apply
+        url = fields.get("url", "").strip() or None
+        yield {
+            "title": latex_to_text(fields.get("title", "")),
+            "authors": split_bibtex_authors(fields.get("author", "")),
+            "abstract": latex_to_text(fields.get("abstract", "")) or None,
+            "doi": normalize_doi(fields.get("doi")),
+            "arxiv_id": find_arxiv_id(
+                fields.get("eprint") and "arXiv:" + fields["eprint"], url, fields.get("journal"), fields.get("doi")),
+            "url": url,
+            "file_path": bibtex_file_path(fields["file"]) if "file" in fields else None,
+            "folder": latex_to_text(fields.get("groups", "")).split(",")[0].strip() or None,
+        }
+
+
+VERBATIM_FIELDS = ("url", "doi", "eprint", "file")
+
+
+def bibtex_value(value: str, verbatim: bool = False):
+    if verbatim:
+        return "{" + value.replace("{", "").replace("}", "") + "}"
+    value = value.replace("\\", "\\textbackslash ")
+    for char in "&%$#_":
+        value = value.replace(char, "\\" + char)
+    # Unbalanced braces would end the field early
+    if brace_depth_change(value) != 0:
+        value = value.replace("{", "").replace("}", "")
+    return "{" + value + "}"
+
+
+def bibtex_key(paper: dict):
+    first_author = (paper["authors"] or "").split(",")[0].split()
+    first_word = re.findall(r"[A-Za-z0-9]+", paper["title"] or "")
+    return (first_author[-1] if first_author else "paper") + (first_word[0].lower() if first_word else "") + \
+        str(paper["id"])
+
+
+def write_bibtex(papers):
+    for paper in papers:
+        fields = [("title", paper["title"])]
+        if paper["authors"]:
+            names = [name.strip() for name in paper["authors"].split(",") if name.strip()]
+            # Braces keep "Barnes and Noble" one name
+            fields.append(("author", " and ".join("{" + name + "}" if " and " in name else name for name in names)))
+        fields += [("abstract", paper["abstract"]), ("doi", paper["doi"]), ("url", paper["website_url"])]
+        if paper["arxiv"]:
+            fields += [("eprint", paper["arxiv"]), ("archiveprefix", "arXiv")]
+        if paper["local_file"]:
+            fields.append(("file", f":{paper['local_file'].replace(':', chr(92) + ':')}:application/pdf"))
+        fields.append(("groups", paper["folder_name"]))
+
+        entry_type = "article" if paper["doi"] or paper["arxiv"] else "misc"
+        body = ",\n".join(f"  {name} = {bibtex_value(value, name in VERBATIM_FIELDS)}" for name, value in fields if value)
+        yield f"@{entry_type}{{{bibtex_key(paper)},\n{body}\n}}\n\n"
+
+
+# ==================================================================================================
+# RIS
+
+RIS_LINE = re.compile(r"^([A-Z][A-Z0-9])  -\s?(.*)$")
+
+
+def read_ris(f):
+    tags = {}
+    for line in f:
+        match = RIS_LINE.match(line.rstrip("\r\n"))
+        if match is None:
+            continue
+        tag, value = match.groups()
+        if tag == "ER":
+            if tags:
+                yield ris_record(tags)
+            tags = {}
+        elif tag == "TY":
+            tags = {}
+        else:
+            tags.setdefault(tag, []).append(value.strip())
+    if tags:
+        yield ris_record(tags)
+
+
+def ris_record(tags: dict):
+    first = lambda *names: next((tags[name][0] for name in names if tags.get(name)), None)
+    url = first("UR")
+    file_path = None
+    for link in tags.get("L1", []):
+        if link.lower().endswith(".pdf"):
+            file_path = re.sub(r"^file://", "", link)
+            break
+    return {
+        "title": first("TI", "T1", "CT") or "",
+        "authors": [display_name(name) for name in tags.get("AU", []) + tags.get("A1", [])],
+        "abstract": first("AB", "N2"),
+        "doi": normalize_doi(first("DO")),
+        "arxiv_id": find_arxiv_id(url, first("DO"), first("JO", "T2"), *tags.get("N1", [])),
+        "url": url,
+        "file_path": file_path,
+        "folder": None,
+    }
+
+
+def write_ris(papers):
+    for paper in papers:
+        lines = [("TY", "JOUR" if paper["doi"] or paper["arxiv"] else "ELEC"), ("TI", paper["title"])]
+        lines += [("AU", name.strip()) for name in (paper["authors"] or "").split(",") if name.strip()]
+        lines += [("AB", paper["abstract"]), ("DO", paper["doi"]), ("UR", paper["website_url"]),
+                  ("L1", paper["local_file"] and "file://" + paper["local_file"])]
+        yield "".join(f"{tag}  - {' '.join(str(value).split())}\n" for tag, value in lines if value) + "ER  - \n\n"
+
+
+# ==================================================================================================
+# CSL-JSON
+
+
+def iter_json_array(f):
+    """Yield the objects of a top-level JSON array one at a time, holding at most one object in memory."""
+    decoder = json.JSONDecoder()
+    buffer, started = "", False
+    while True:
+        chunk = f.read(READ_SIZE)
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != "[":
+                    raise ValueError("CSL-JSON must be an array of items")
+                buffer, started = buffer[1:], True
+                continue
+            buffer = buffer.lstrip(",").lstrip()
+            if not buffer or buffer[0] == "]":
+                break
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                # The object continues in the next chunk
+                break
+            buffer = buffer[end:]
+            yield item
+        if not chunk:
+            return
+
+
+def csl_author(author: dict):
+    if "literal" in author:
+        return author["literal"]
+    return " ".join(part for part in (author.get("given"), author.get("family")) if part)
+
+
+def read_csl_json(f):
+    for item in iter_json_array(f):
+        url = item.get("URL")
+        yield {
+            "title": item.get("title") or "",
+            "authors": [csl_author(author) for author in item.get("author", [])],
+            "abstract": item.get("abstract"),
+            "doi": normalize_doi(item.get("DOI")),
+            "arxiv_id": find_arxiv_id(url, item.get("number"), item.get("DOI"), item.get("container-title")),
+            "url": url,
+            "file_path": None,
+            "folder": None,
+        }
+
+
+def write_csl_json(papers):
+    yield "[\n"
+    separator = ""
+    for paper in papers:
+        item = {"id": str(paper["id"]), "type": "article" if paper["arxiv"] else
+                "article-journal" if paper["doi"] else "webpage", "title": paper["title"]}
+        if paper["authors"]:
+            item["author"] = [{"literal": name.strip()} for name in paper["authors"].split(",") if name.strip()]
+        for key, column in (("abstract", "abstract"), ("DOI", "doi"), ("URL", "website_url")):
+            if paper[column]:
+                item[key] = paper[column]
+        if paper["arxiv"]:
+            item["number"] = f"arXiv:{paper['arxiv']}"
+        yield separator + json.dumps(item, ensure_ascii=False)
+        separator = ",\n"
+    yield "\n]\n"
+
+
+READERS = {"bibtex": read_bibtex, "ris": read_ris, "csl-json": read_csl_json}
+WRITERS = {"bibtex": write_bibtex, "ris": write_ris, "csl-json": write_csl_json}
+
+
+# ==================================================================================================
+# Library side
+
+
+class Bibliography:
+
+    @staticmethod
+    def get_dedupe_keys():
+        """Sets of arXiv ids, DOIs, file paths and content keys already in the library, removed papers included."""
+        arxiv_ids, dois, file_paths, content_keys = set(), set(), set(), set()
+        for arxiv_id, doi, file_path, title, authors in database.DATABASE.iterate(
+                "SELECT arxiv_id, doi, file_path, title, authors FROM papers"):
+            arxiv_ids.add(re.sub(r"v\d+$", "", arxiv_id))
+            if doi:
+                dois.add(doi)
+            file_paths.add(file_path)
+            content_keys.add(content_key(title, authors))
+        return arxiv_ids, dois, file_paths, content_keys
+
+    @staticmethod
+    def insert_batch(rows: list):
+        """Insert rows in one transaction; returns whether each row went in."""
+        query = """
+        INSERT INTO papers (arxiv_id, title, authors, abstract, file_path, website_url, folder_id, doi)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        try:
+            database.DATABASE.execute_in_transaction(*((query, row) for row in rows))
+            return [True] * len(rows)
+        except sqlite3.IntegrityError:
+            # Exact titles are unique too; fall back to one row at a time to keep the rest of the batch
+            inserted = []
+            for row in rows:
+                try:
+                    database.DATABASE.execute_in_transaction((query, row))
+                    inserted.append(True)
+                except sqlite3.IntegrityError:
+                    inserted.append(False)
+            return inserted
+
+    @staticmethod
+    def iterate_papers(folder_id: int = None, connection=None):
+        """
+        Papers with a "local_file" only when that file exists. connection, opened with Database.open_reader,
+        reads them from a job instead of the GUI thread.
+        """
+        query = """
+        SELECT p.id, p.arxiv_id, p.title, p.authors, p.abstract, p.file_path, p.website_url, p.doi, f.folder_name
+        FROM papers p
+        INNER JOIN folders f ON p.folder_id = f.id
+        WHERE p.is_active = TRUE
+        """
+        args = ()
+        if folder_id is not None:
+            query += " AND p.folder_id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = ?)"
+            args = (folder_id,)
+        columns = ("id", "arxiv_id", "title", "authors", "abstract", "file_path", "website_url", "doi", "folder_name")
+        rows = database.DATABASE.iterate(query + " ORDER BY p.id", args) if connection is None else \
+            connection.execute(query + " ORDER BY p.id", args)
+        for row in rows:
+            paper = dict(zip(columns, row))
+            paper["arxiv"] = find_arxiv_id("arXiv:" + paper["arxiv_id"])
+            # Papers downloaded on first open have a path before they have a file
+            file_path = paper["file_path"]
+            paper["local_file"] = None if file_path.startswith(("http://", "https://")) or \
+                not os.path.exists(file_path) else file_path
+            yield paper
+
+
+def folder_id_for(name: str, cache: dict):
+    if name not in cache:
+        folder_id = Folder.get_folder_id_for_title(name)
+        if folder_id is None:
+            Folder.insert_row(name, 0)
+            folder_id = Folder.get_folder_id_for_title(name)
+        cache[name] = folder_id[0]
+    return cache[name]
+
+
+def read_new_records(path: str, keys: tuple, fmt: str = None, folder_name: str = None,
+                     batch_size: int = BATCH_SIZE):
+    """
+    Read a bibliography file without touching the database. keys are Bibliography.get_dedupe_keys(), extended
+    as records are read. Yields (statuses, rows) per batch_size new papers: (exists or skipped, title) for the
+    records left out and rows for store_rows, whose category is folder_name (default: the file name) or the
+    one named in a BibTeX "groups" field.
+    """
+    fmt = fmt or detect_format(path)
+    folder_name = folder_name or os.path.splitext(os.path.basename(path))[0]
+    arxiv_ids, dois, file_paths, content_keys = keys
+    statuses, rows = [], []
+
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for record in READERS[fmt](f):
+            title = record["title"]
+            arxiv_id, doi, file_path = record["arxiv_id"], record["doi"], record["file_path"]
+            if not title:
+                statuses.append(("skipped", None))
+                continue
+            key = content_key(title, record["authors"])
+            if (arxiv_id and arxiv_id in arxiv_ids) or (doi and doi in dois) or \
+                    (file_path and file_path in file_paths) or key in content_keys:
+                statuses.append(("exists", title))
+                continue
+
+            # arXiv papers without a local copy are downloaded on first open, like save_arxiv_research_paper
+            website_url = f"https://arxiv.org/pdf/{arxiv_id}" if arxiv_id else \
+                record["url"] or (doi and f"https://doi.org/{doi}")
+            if file_path is None:
+                file_path = os.path.join(FILE_PATH, arxiv_id.replace("/", "_") + ".pdf") if arxiv_id else website_url
+            if file_path is None or file_path in file_paths:
+                statuses.append(("skipped", title))
+                continue
+
+            if arxiv_id:
+                arxiv_ids.add(arxiv_id)
+            if doi:
+                dois.add(doi)
+            file_paths.add(file_path)
+            content_keys.add(key)
+            rows.append((arxiv_id or str(uuid4()), title, ", ".join(record["authors"]) or None, record["abstract"],
+                         file_path, website_url, record["folder"] or folder_name, doi))
+            if len(rows) >= batch_size:
+                yield statuses, rows
+                statuses, rows = [], []
+    if statuses or rows:
+        yield statuses, rows
+
+
+def store_rows(rows: list, folders: dict):
+    """Insert rows from read_new_records, creating their categories. Yields (added or exists, title) per row."""
+    rows = [(*row[:6], folder_id_for(row[6], folders), row[7]) for row in rows]
+    for row, inserted in zip(rows, Bibliography.insert_batch(rows) if rows else []):
+        yield "added" if inserted else "exists", row[1]
+
+
+def import_file(path: str, fmt: str = None, folder_name: str = None):
+    """
+    Import a bibliography file, see read_new_records. Yields (status, title) per record: added, exists or
+    skipped (no way to open it).
+    """
+    folders = {}
+    for statuses, rows in read_new_records(path, Bibliography.get_dedupe_keys(), fmt, folder_name):
+        yield from statuses
+        yield from store_rows(rows, folders)
+
+
+def export_file(out, fmt: str, folder_id: int = None, connection=None, progress=None):
+    """
+    Write the library, or one category with its subcategories, to the open text file out; returns the count.
+    connection is passed on to Bibliography.iterate_papers, progress(count) is called every BATCH_SIZE papers.
+    """
+    papers = Bibliography.iterate_papers(folder_id, connection)
+    count = 0
+
+    def counted():
+        nonlocal count
+        for paper in papers:
+            count += 1
+            if progress is not None and count % BATCH_SIZE == 0:
+                progress(count)
+            yield paper
+
+    for chunk in WRITERS[fmt](counted()):
+        out.write(chunk)
+    return count
@@ -0,0 +1,131 @@
+import datetime
+import os
+import re
+
+import database
+
+# Citation graph: arXiv ids are read from the reference section of local PDFs in worker processes and
+# stored as (citing paper, cited arXiv id) edges. Both directions of a lookup are index seeks, and
+# citation_edges resolves the arXiv ids to papers that are in the library.
+
+NEW_STYLE_ID = r"\d{4}\.\d{4,5}"
+OLD_STYLE_ID = r"[a-z\-]+(?:\.[A-Z]{2})?/\d{7}"
+ARXIV_ID = re.compile(
+    rf"(?:arxiv\s*:\s*|arxiv\.org/(?:abs|pdf)/)({NEW_STYLE_ID}|{OLD_STYLE_ID})(?:v\d+)?", re.IGNORECASE)
+REFERENCES_HEADING = re.compile(r"^\s*(?:\d+\.?\s*)?(references|bibliography)\s*$", re.IGNORECASE | re.MULTILINE)
+MAX_HOPS = 3
+# PDFs read per background job, each in a worker process
+SCAN_CHUNK = 8
+
+
+def base_arxiv_id(arxiv_id: str):
+    return re.sub(r"v\d+$", "", arxiv_id or "")
+
+
+def reference_section(text: str):
+    headings = list(REFERENCES_HEADING.finditer(text))
+    return text[headings[-1].end():] if headings else text
+
+
+def extract_arxiv_ids(file_path: str):
+    """Return the arXiv ids cited in the reference section of a PDF, without versions."""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(file_path)
+    text = "\n".join(page.extract_text() or "" for page in reader.pages)
+    # Line-broken ids such as "arXiv:2301.\n12345" are common in two-column layouts
+    section = re.sub(r"(?<=[.:/])\s*\n\s*", "", reference_section(text))
+    return sorted({match.group(1) for match in ARXIV_ID.finditer(section)})
+
+
+def read_references(file_path: str):
+    """extract_arxiv_ids for a worker process: None while the file is not there, [] for unreadable PDFs."""
+    # arXiv PDFs are downloaded when first opened, they are scanned on a later run
+    if not os.path.exists(file_path):
+        return None
+    try:
+        return extract_arxiv_ids(file_path)
+    except Exception as e:
+        print(f"Could not read references from {file_path}: {e}")
+        return []
+
+
+class CitationGraph:
+
+    @staticmethod
+    def get_pending_scans():
+        query = """
+        SELECT p.id, p.arxiv_id, p.file_path
+        FROM papers p
+        LEFT JOIN citation_scans s ON s.paper_id = p.id
+        WHERE s.paper_id IS NULL AND p.is_active = TRUE
+              AND p.file_path NOT LIKE 'http://%' AND p.file_path NOT LIKE 'https://%'
+        """
+        return database.DATABASE.fetchall(query)
+
+    @staticmethod
+    def store(paper_id: int, own_arxiv_id: str, cited_arxiv_ids: list):
+        own_arxiv_id = base_arxiv_id(own_arxiv_id)
+        statements = [("DELETE FROM citations WHERE citing_id = ?", (paper_id,))]
+        statements += [("INSERT OR IGNORE INTO citations (citing_id, cited_arxiv_id) VALUES (?, ?)",
+                        (paper_id, cited)) for cited in cited_arxiv_ids if cited != own_arxiv_id]
+        statements.append(("INSERT OR REPLACE INTO citation_scans (paper_id, scanned_at) VALUES (?, ?)",
+                           (paper_id, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))))
+        database.DATABASE.execute_in_transaction(*statements)
+
+    @staticmethod
+    def get_references(paper_id: int):
+        """Papers in the library that paper_id cites."""
+        query = """
+        SELECT p.id, p.title
+        FROM citation_edges e
+        INNER JOIN papers p ON p.id = e.cited_id
+        WHERE e.citing_id = ? AND p.is_active = TRUE
+        ORDER BY p.title
+        """
+        return database.DATABASE.fetchall(query, (paper_id,))
+
+    @staticmethod
+    def get_cited_by(paper_id: int):
+        """Papers in the library that cite paper_id."""
+        query = """
+        SELECT p.id, p.title
+        FROM citation_edges e
+        INNER JOIN papers p ON p.id = e.citing_id
+        WHERE e.cited_id = ? AND p.is_active = TRUE
+        ORDER BY p.title
+        """
+        return database.DATABASE.fetchall(query, (paper_id,))
+
+    @staticmethod
+    def get_neighbourhood(paper_id: int, hops: int = 2, direction: str = "both"):
+        """
+        Return [(paper_id, title, distance)] for the papers within hops citations of paper_id, following
+        references ("out"), citing papers ("in") or both. Each paper is reported at its shortest distance.
+        """
+        hops = max(1, min(hops, MAX_HOPS))
+        steps = {
+            "out": "SELECT e.cited_id, n.distance + 1 FROM citation_edges e "
+                   "INNER JOIN neighbourhood n ON e.citing_id = n.paper_id WHERE n.distance < ?",
+            "in": "SELECT e.citing_id, n.distance + 1 FROM citation_edges e "
+                  "INNER JOIN neighbourhood n ON e.cited_id = n.paper_id WHERE n.distance < ?",
+        }
+        if direction not in (*steps, "both"):
+            raise ValueError(f"Unknown citation direction: {direction}")
+        selected = list(steps) if direction == "both" else [direction]
+
+        query = f"""
+        WITH RECURSIVE neighbourhood (paper_id, distance) AS (
+            SELECT ?, 0
+            UNION
+            {" UNION ".join(steps[key] for key in selected)}
+        )
+        SELECT p.id, p.title, MIN(n.distance)
+        FROM neighbourhood n
+        INNER JOIN papers p ON p.id = n.paper_id
+        WHERE n.paper_id != ? AND p.is_active = TRUE
+        GROUP BY p.id
+        ORDER BY MIN(n.distance), p.title
+        """
+        return database.DATABASE.fetchall(query, (paper_id, *[hops] * len(selected), paper_id))
+
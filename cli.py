@@ -0,0 +1,428 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+# Qt-free command line interface. Only database, utils and the non-dialog parts of save_article are imported.
+
+# Kept in step with bibliography.FORMATS, which cannot be imported before --db is applied
+FORMATS = ("bibtex", "ris", "csl-json")
+EXPORT_COLUMNS = ("id", "arxiv_id", "title", "authors", "abstract", "file_path", "website_url",
+                  "added_at", "last_view", "folder_name")
+
+
+def emit(args, record: dict):
+    if args.json:
+        print(json.dumps(record, default=str), flush=True)
+    else:
+        print("\t".join("" if value is None else str(value) for value in record.values()), flush=True)
+
+
+def read_values(values):
+    """Expand "-" into the non-empty lines of stdin so commands can be fed in batch."""
+    for value in values:
+        if value == "-":
+            for line in sys.stdin:
+                if line := line.strip():
+                    yield line
+        else:
+            yield value
+
+
+def resolve_folder_id(name, create: bool = False):
+    from database import Folder
+
+    if name is None:
+        return None
+    folder_id = Folder.get_folder_id_for_title(name)
+    if folder_id is None and create:
+        Folder.insert_row(name, 0)
+        folder_id = Folder.get_folder_id_for_title(name)
+    if folder_id is None:
+        raise SystemExit(f"Unknown category: {name}")
+    return folder_id[0]
+
+
+def cmd_import_dir(args):
+    from save_article import save_local_directory
+
+    folder_id = resolve_folder_id(args.category, create=True)
+    for directory in read_values(args.paths):
+        if not os.path.isdir(directory):
+            emit(args, {"status": "error", "title": None, "file_path": directory})
+            continue
+        for status, title, file_path in save_local_directory(os.path.abspath(directory), folder_id=folder_id):
+            emit(args, {"status": status, "title": title, "file_path": file_path})
+    return 0
+
+
+def cmd_add_url(args):
+    from database import Paper
+    from save_article import save_url
+
+    folder_id = resolve_folder_id(args.category, create=True)
+    if folder_id is None:
+        folder_id = Paper.get_selected_folder_id()[0]
+
+    failed = 0
+    for url in read_values(args.urls):
+        try:
+            title = save_url(url, folder_id=folder_id)
+        except sqlite3.IntegrityError:
+            emit(args, {"status": "exists", "title": None, "url": url})
+            continue
+        except Exception as e:
+            title = None
+            print(f"Error: {e}", file=sys.stderr)
+
+        if title is None:
+            failed += 1
+        emit(args, {"status": "error" if title is None else "added", "title": title, "url": url})
+
+    from storage import Storage
+
+    for paper_id, file_path, size in Storage.evict():
+        emit(args, {"status": "evicted", "id": paper_id, "file_path": file_path, "bytes": size})
+    return 1 if failed else 0
+
+
+def cmd_search(args):
+    from database import Paper
+
+    if args.fuzzy:
+        import fuzzy_search
+
+        papers = fuzzy_search.search(args.text)
+    else:
+        papers = Paper.iter_papers(title=args.text)
+
+    for paper_id, title, folder_name, file_path in papers:
+        emit(args, {"id": paper_id, "title": title, "folder_name": folder_name, "file_path": file_path})
+    return 0
+
+
+def cmd_list(args):
+    """Stream the library most recently viewed first; with --limit, print one page and the cursor of the next."""
+    from database import Paper
+
+    folder_id = resolve_folder_id(args.category)
+    if args.limit is None:
+        papers, cursor = Paper.iter_papers(folder_id=folder_id), None
+    else:
+        papers, cursor = Paper.get_papers_page(decode_cursor(args.after), args.limit, folder_id=folder_id)
+
+    for paper_id, title, folder_name, file_path in papers:
+        emit(args, {"id": paper_id, "title": title, "folder_name": folder_name, "file_path": file_path})
+    if cursor is not None:
+        emit(args, {"status": "more", "after": encode_cursor(cursor)})
+    return 0
+
+
+def encode_cursor(cursor):
+    last_view, added_at, paper_id = cursor
+    return f"{last_view or ''}|{added_at}|{paper_id}"
+
+
+def decode_cursor(token):
+    if token is None:
+        return None
+    last_view, added_at, paper_id = token.split("|")
+    return last_view or None, added_at, int(paper_id)
+
+
+def cmd_open(args):
+    """Show paths and URLs in the running window, starting one when there is none."""
+    from single_instance import forward, parse_requests
+
+    targets = [target for target in args.targets if target.startswith(("https://", "http://", "file://"))
+               or os.path.isfile(target)]
+    for target in args.targets:
+        if target not in targets:
+            emit(args, {"status": "missing", "target": target})
+    if not targets:
+        return 1
+    requests = parse_requests(targets, add=args.add)
+    if forward(requests):
+        for request in requests:
+            emit(args, {"status": "forwarded", "target": request["target"]})
+        return 0
+
+    from main import run
+
+    return run([sys.argv[0], *(["--add"] if args.add else []), *targets])
+
+
+def cmd_move(args):
+    from database import Paper
+
+    folder_id = resolve_folder_id(args.category, create=args.create)
+    for paper_id in read_values(args.paper_ids):
+        if Paper.get_paper_using_id(paper_id) is None:
+            emit(args, {"status": "missing", "id": paper_id, "folder_name": args.category})
+            continue
+        Paper.update_folder_id(paper_id, folder_id)
+        emit(args, {"status": "moved", "id": paper_id, "folder_name": args.category})
+    return 0
+
+
+def cmd_export(args):
+    from database import Paper
+
+    for row in Paper.get_all_paper_details():
+        record = dict(zip(EXPORT_COLUMNS, row))
+        if args.category is None or record["folder_name"] == args.category:
+            emit(args, record)
+    return 0
+
+
+def cmd_import_bib(args):
+    from bibliography import import_file
+
+    for path in read_values(args.paths):
+        if not os.path.isfile(path):
+            emit(args, {"status": "error", "title": None, "file_path": path})
+            continue
+        for status, title in import_file(path, args.format, args.category):
+            emit(args, {"status": status, "title": title, "file_path": path})
+    return 0
+
+
+def cmd_export_bib(args):
+    from bibliography import export_file
+
+    folder_id = resolve_folder_id(args.category)
+    if args.output is None:
+        export_file(sys.stdout, args.format, folder_id)
+        return 0
+    with open(args.output, "w", encoding="utf-8") as out:
+        count = export_file(out, args.format, folder_id)
+    emit(args, {"status": "exported", "papers": count, "file_path": args.output})
+    return 0
+
+
+def cmd_sync(args):
+    from sync import Sync, get_target, sync
+
+    if args.target:
+        Sync.set_state("target", args.target)
+    if get_target() is None:
+        raise SystemExit("No sync target: pass a shared directory or server URL, or set $PAPERFLUX_SYNC")
+    for result in sync(args.target):
+        emit(args, result)
+    return 0
+
+
+def cmd_sync_server(args):
+    from sync import serve
+
+    serve(args.directory, args.host, args.port)
+    return 0
+
+
+def cmd_verify(args):
+    from cold_storage import ColdStorage
+    from database import Paper
+
+    broken = 0
+    archived = ColdStorage.get_archived_ids()
+    for row in Paper.get_all_paper_details():
+        record = dict(zip(EXPORT_COLUMNS, row))
+        file_path = record["file_path"]
+        if file_path.startswith(("https://", "http://")) or os.path.exists(file_path) or record["id"] in archived:
+            continue
+
+        broken += 1
+        status = "missing" if record["website_url"] is None else "missing-downloadable"
+        emit(args, {"status": status, "id": record["id"], "title": record["title"], "file_path": file_path})
+    return 1 if broken else 0
+
+
+def cmd_storage(args):
+    from storage import Storage
+
+    if args.evict:
+        quota = None if args.quota_mb is None else int(args.quota_mb * 1024 * 1024)
+        for paper_id, file_path, size in Storage.evict(quota):
+            emit(args, {"status": "evicted", "id": paper_id, "file_path": file_path, "bytes": size})
+    for folder in Storage.usage():
+        emit(args, {"status": "usage", **folder})
+    return 0
+
+
+def cmd_cold(args):
+    from cold_storage import DEFAULT_COLD_DAYS, ColdStorage, cold_days
+
+    failed = 0
+    for paper_id in args.restore or ():
+        if ColdStorage.get(paper_id) is None:
+            emit(args, {"status": "not-archived", "id": paper_id, "file_path": None})
+            continue
+        try:
+            emit(args, {"status": "restored", "id": paper_id, "file_path": ColdStorage.restore(paper_id)})
+        except Exception as e:
+            failed += 1
+            emit(args, {"status": "error", "id": paper_id, "file_path": str(e)})
+    if args.archive:
+        days = args.days or cold_days() or DEFAULT_COLD_DAYS
+        for paper_id, file_path, size, archived_size in ColdStorage.archive(days):
+            emit(args, {"status": "archived", "id": paper_id, "file_path": file_path, "bytes": size,
+                        "archived_bytes": archived_size})
+    for folder in ColdStorage.usage():
+        emit(args, {"status": "usage", **folder})
+    return 1 if failed else 0
+
+
+def hot_queries():
+    """(name, callable) pairs running the Paper queries behind the library view, for check-plans and its test."""
+    from database import Paper
+
+    return (
+        ("get_all_papers", Paper.get_all_papers),
+        ("get_papers_page", lambda: Paper.get_papers_page(("", "", 0))),
+        ("get_papers_page", lambda: Paper.get_papers_page((None, "", 0))),
+        ("get_last_n_viewed_papers", Paper.get_last_n_viewed_papers),
+        ("get_last_viewed_paper", Paper.get_last_viewed_paper),
+        ("get_selected_folder_id", Paper.get_selected_folder_id),
+        ("get_folder_id_for_title", lambda: Paper.get_folder_id_for_title("")),
+        ("get_file_path_of_last_local_pdf", Paper.get_file_path_of_last_local_pdf),
+        ("change_folder_id", lambda: Paper.change_folder_id(-1, -1)),
+    )
+
+
+def cmd_check_plans(args):
+    """Run the hot Paper queries and fail if any plan scans the table or sorts through a temporary B-tree."""
+    import database
+    from query_log import QueryLog, is_full_scan
+
+    failed = 0
+    conn = database.DATABASE.conn
+    for name, run_query in hot_queries():
+        database.DATABASE.query_log.reset()
+        run_query()
+        for statement in database.DATABASE.query_log.statements.values():
+            plan = QueryLog.explain(conn, statement.query, [None] * statement.query.count("?"))
+            uses_index = not is_full_scan(plan)
+            failed += not uses_index
+            emit(args, {"status": "ok" if uses_index else "full-scan", "query": name, "plan": "; ".join(plan)})
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="paperflux", description="PaperFlux library maintenance without the GUI.")
+    parser.add_argument("--db", help="path of the library database (default: ./research_library.db)")
+    parser.add_argument("--json", action="store_true", help="write one JSON object per line")
+    parser.add_argument("--query-stats", action="store_true",
+                        help="print per-statement query statistics and plans to stderr when done")
+
+    # --json is accepted before or after the subcommand
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--json", action="store_true", default=argparse.SUPPRESS,
+                        help="write one JSON object per line")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_dir = subparsers.add_parser("import-dir", parents=[output], help="import every PDF under the given directories")
+    import_dir.add_argument("paths", nargs="+", help="directories, or - to read them from stdin")
+    import_dir.add_argument("--category", help="category for all imported papers (default: directory name)")
+    import_dir.set_defaults(func=cmd_import_dir)
+
+    add_url = subparsers.add_parser("add-url", parents=[output], help="save arXiv, Medium or PDF URLs")
+    add_url.add_argument("urls", nargs="+", help="URLs, or - to read them from stdin")
+    add_url.add_argument("--category", help="category for the saved papers")
+    add_url.set_defaults(func=cmd_add_url)
+
+    search = subparsers.add_parser("search", parents=[output], help="search paper titles")
+    search.add_argument("text")
+    search.add_argument("--fuzzy", action="store_true",
+                        help="typo-tolerant search over titles and authors, best match first")
+    search.set_defaults(func=cmd_search)
+
+    list_papers = subparsers.add_parser("list", parents=[output], help="list papers, most recently viewed first")
+    list_papers.add_argument("--category", help="only list this category and its subcategories")
+    list_papers.add_argument("--limit", type=int, help="print one page of this many papers and the cursor of the next")
+    list_papers.add_argument("--after", help="cursor printed with the previous page")
+    list_papers.set_defaults(func=cmd_list)
+
+    open_targets = subparsers.add_parser("open", parents=[output],
+                                         help="show PDFs or URLs in the PaperFlux window, starting it if needed")
+    open_targets.add_argument("targets", nargs="+", help="paths or URLs")
+    open_targets.add_argument("--add", action="store_true", help="also add them to the library")
+    open_targets.set_defaults(func=cmd_open)
+
+    move = subparsers.add_parser("move", parents=[output], help="move papers to another category")
+    move.add_argument("paper_ids", nargs="+", help="paper ids, or - to read them from stdin")
+    move.add_argument("--category", required=True)
+    move.add_argument("--create", action="store_true", help="create the category if it does not exist")
+    move.set_defaults(func=cmd_move)
+
+    export = subparsers.add_parser("export", parents=[output], help="dump the library")
+    export.add_argument("--category", help="only export this category")
+    export.set_defaults(func=cmd_export)
+
+    import_bib = subparsers.add_parser("import-bib", parents=[output],
+                                       help="import BibTeX, RIS or CSL-JSON files, skipping papers already present")
+    import_bib.add_argument("paths", nargs="+", help="files, or - to read them from stdin")
+    import_bib.add_argument("--format", choices=FORMATS, help="file format (default: from the extension)")
+    import_bib.add_argument("--category", help="category for imported papers (default: file name)")
+    import_bib.set_defaults(func=cmd_import_bib)
+
+    export_bib = subparsers.add_parser("export-bib", parents=[output], help="write the library as BibTeX, RIS or CSL-JSON")
+    export_bib.add_argument("--format", choices=FORMATS, default="bibtex")
+    export_bib.add_argument("--category", help="only export this category and its subcategories")
+    export_bib.add_argument("-o", "--output", help="output file (default: stdout)")
+    export_bib.set_defaults(func=cmd_export_bib)
+
+    sync = subparsers.add_parser("sync", parents=[output], help="exchange changes with other machines")
+    sync.add_argument("target", nargs="?",
+                      help="shared directory or sync server URL, remembered for later syncs (default: $PAPERFLUX_SYNC)")
+    sync.set_defaults(func=cmd_sync)
+
+    sync_server = subparsers.add_parser("sync-server", parents=[output], help="serve a sync directory over HTTP")
+    sync_server.add_argument("directory")
+    sync_server.add_argument("--host", default="127.0.0.1")
+    sync_server.add_argument("--port", type=int, default=8765)
+    sync_server.set_defaults(func=cmd_sync_server)
+
+    verify = subparsers.add_parser("verify", parents=[output], help="list papers whose local file is missing")
+    verify.set_defaults(func=cmd_verify)
+
+    storage = subparsers.add_parser("storage", parents=[output], help="report download usage per category")
+    storage.add_argument("--evict", action="store_true",
+                         help="delete least recently viewed re-downloadable files until under the quota")
+    storage.add_argument("--quota-mb", type=float, help="quota for --evict (default: $PAPERFLUX_STORAGE_QUOTA_MB or 2048)")
+    storage.set_defaults(func=cmd_storage)
+
+    cold = subparsers.add_parser("cold", parents=[output],
+                                 help="report the compressed archive of rarely opened PDFs and the space it reclaimed")
+    cold.add_argument("--archive", action="store_true", help="compress PDFs not opened for --days into the archive")
+    cold.add_argument("--days", type=float, help="for --archive (default: $PAPERFLUX_COLD_DAYS or 365)")
+    cold.add_argument("--restore", type=int, nargs="+", metavar="ID", help="put archived papers back in place")
+    cold.set_defaults(func=cmd_cold)
+
+    check_plans = subparsers.add_parser("check-plans", parents=[output],
+                                        help="check that the hot queries are served by indexes")
+    check_plans.set_defaults(func=cmd_check_plans)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.db:
+        # database.py opens the library on import, so the path has to be set first
+        os.environ["PAPERFLUX_DB"] = args.db
+    try:
+        return args.func(args)
+    finally:
+        import database
+
+        database.DATABASE.flush()
+        if args.query_stats:
+
+            database.DATABASE.query_log.explain_all(database.DATABASE.conn)
+            database.DATABASE.query_log.dump()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
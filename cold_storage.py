@@ -0,0 +1,315 @@
+import datetime
+import getpass
+import hashlib
+import lzma
+import os
+import tempfile
+from uuid import uuid4
+
+import database
+from smart_collection import local_cutoff, utc_cutoff
+from storage import Storage
+from tracing import TRACER
+
+# Optional cold tier for local PDFs. Files not opened for PAPERFLUX_COLD_DAYS are compressed into
+# PAPERFLUX_COLD_DIR, named by the SHA-256 of their contents, read back and checked before the original is
+# deleted. Opening one streams it out into a per-user cache in the temp directory, checking the hash again,
+# and the cache keeps the most recently opened copies up to PAPERFLUX_COLD_CACHE_MB. Archives are zstd when
+# a binding is installed (Python 3.14's compression.zstd or the zstandard package) and xz otherwise.
+
+COLD_DAYS_ENV = "PAPERFLUX_COLD_DAYS"
+COLD_DIR_ENV = "PAPERFLUX_COLD_DIR"
+CACHE_ENV = "PAPERFLUX_COLD_CACHE_MB"
+DEFAULT_COLD_DAYS = 365
+DEFAULT_COLD_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cold")
+DEFAULT_CACHE_MB = 1024
+
+CHUNK = 1024 * 1024
+LZMA_PRESET = 6
+ZSTD_LEVEL = 19
+
+
+def cold_days():
+    """Days without a view before a PDF is archived at startup, None when the cold tier is off."""
+    days = float(os.environ.get(COLD_DAYS_ENV) or 0)
+    return days if days > 0 else None
+
+
+def archive_directory():
+    return os.environ.get(COLD_DIR_ENV) or DEFAULT_COLD_DIR
+
+
+def cache_directory():
+    return os.path.join(tempfile.gettempdir(), f"paperflux-cold-{getpass.getuser()}")
+
+
+def cache_quota_bytes():
+    return int(float(os.environ.get(CACHE_ENV, DEFAULT_CACHE_MB)) * 1024 * 1024)
+
+
+def zstd_open():
+    """open() of the installed zstd binding, None without one."""
+    try:
+        from compression import zstd
+
+        return lambda file_path, mode: zstd.open(file_path, mode, level=ZSTD_LEVEL if "w" in mode else None)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return lambda file_path, mode: zstandard.open(file_path, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL))
+
+
+def archive_suffix():
+    return ".zst" if zstd_open() is not None else ".xz"
+
+
+def open_compressed(file_path: str, mode: str, suffix: str = None):
+    """Compressed file object; the codec comes from suffix, or from the file name's extension."""
+    suffix = suffix or os.path.splitext(file_path)[1]
+    if suffix == ".zst":
+        if (opener := zstd_open()) is None:
+            raise OSError(f"{file_path} needs zstd: pip install zstandard")
+        return opener(file_path, mode)
+    if "w" in mode:
+        return lzma.open(file_path, mode, preset=LZMA_PRESET)
+    return lzma.open(file_path, mode)
+
+
+def copy_stream(source, target, progress=None, done: int = 0, total: int = None):
+    """Copy in CHUNK blocks; returns the SHA-256 and the length of what was copied."""
+    digest = hashlib.sha256()
+    copied = 0
+    while chunk := source.read(CHUNK):
+        digest.update(chunk)
+        if target is not None:
+            target.write(chunk)
+        copied += len(chunk)
+        if progress is not None:
+            progress(done + copied, total)
+    return digest.hexdigest(), copied
+
+
+def compress(file_path: str, progress=None):
+    """
+    Compress file_path into the archive directory and read the archive back to check it. The original is left
+    alone. Returns (archive_path, sha256, size, archived_size, mtime); mtime lets the caller tell whether the
+    original changed before deleting it.
+    """
+    stat = os.stat(file_path)
+    directory, suffix = archive_directory(), archive_suffix()
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = os.path.join(directory, f"{uuid4().hex}.part")
+    try:
+        with TRACER.span("compress", "fs", {"file_path": file_path}):
+            with open(file_path, "rb") as source, open_compressed(temporary_path, "wb", suffix) as target:
+                sha256, size = copy_stream(source, target, progress, 0, 2 * stat.st_size)
+            with open_compressed(temporary_path, "rb", suffix) as source:
+                if copy_stream(source, None, progress, size, 2 * stat.st_size) != (sha256, size):
+                    raise ValueError(f"The compressed copy of {file_path} does not read back the same")
+            with open(temporary_path, "rb+") as f:
+                os.fsync(f.fileno())
+
+        archive_path = os.path.join(directory, sha256[:2], f"{sha256}{os.path.splitext(file_path)[1]}{suffix}")
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        # An identical file archived for another paper is already there
+        if not os.path.exists(archive_path):
+            os.replace(temporary_path, archive_path)
+        return archive_path, sha256, size, os.path.getsize(archive_path), stat.st_mtime
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def decompress(archive_path: str, sha256: str, size: int, file_path: str, progress=None):
+    """Stream an archive out to file_path, which only appears once its contents match sha256."""
+    temporary_path = f"{file_path}.{uuid4().hex}.part"
+    try:
+        with TRACER.span("decompress", "fs", {"archive_path": archive_path}):
+            with open_compressed(archive_path, "rb") as source, open(temporary_path, "wb") as target:
+                if copy_stream(source, target, progress, 0, size) != (sha256, size):
+                    raise ValueError(f"{archive_path} is damaged, it no longer matches the file that was archived")
+        os.replace(temporary_path, file_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def cache_path_for(archive_path: str):
+    return os.path.join(cache_directory(), os.path.splitext(os.path.basename(archive_path))[0])
+
+
+def cached_copy(archive_path: str, size: int):
+    """The decompressed copy in the cache, None if it has to be extracted."""
+    cache_path = cache_path_for(archive_path)
+    try:
+        if os.path.getsize(cache_path) != size:
+            return None
+        # Least recently opened copies are trimmed first
+        os.utime(cache_path)
+    except OSError:
+        return None
+    return cache_path
+
+
+def extract(archive_path: str, sha256: str, size: int, progress=None):
+    """Decompress into the cache and return the path of the copy there."""
+    if (cache_path := cached_copy(archive_path, size)) is not None:
+        return cache_path
+    cache_path = cache_path_for(archive_path)
+    # Private to the user, the temp directory is shared
+    os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+    decompress(archive_path, sha256, size, cache_path, progress)
+    trim_cache(keep=cache_path)
+    return cache_path
+
+
+def trim_cache(quota: int = None, keep: str = None):
+    """Delete the least recently opened copies until the cache fits in quota bytes."""
+    quota = cache_quota_bytes() if quota is None else quota
+    files = []
+    with os.scandir(cache_directory()) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith(".part"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, file_path in sorted(files):
+        if total <= quota:
+            break
+        if file_path == keep:
+            continue
+        try:
+            os.remove(file_path)
+        except OSError:
+            continue
+        total -= size
+
+
+class ColdStorage:
+
+    @staticmethod
+    def get_candidates(days: float):
+        """Local PDFs not opened for days that are neither archived nor pinned, least recently viewed first."""
+        query = """
+        SELECT p.id, p.file_path, p.last_view
+        FROM papers p
+        LEFT JOIN cold_files c ON c.paper_id = p.id
+        LEFT JOIN pinned_papers pp ON pp.paper_id = p.id
+        WHERE p.is_active = TRUE AND c.paper_id IS NULL AND pp.paper_id IS NULL
+              AND p.file_path LIKE '%.pdf' AND p.file_path NOT LIKE 'http://%' AND p.file_path NOT LIKE 'https://%'
+              AND (p.last_view < ? OR (p.last_view IS NULL AND p.added_at < ?))
+        ORDER BY COALESCE(p.last_view, p.added_at) ASC
+        """
+        # last_view is local time, added_at UTC
+        now = datetime.datetime.now().astimezone()
+        return database.DATABASE.fetchall(query, (local_cutoff(now, days), utc_cutoff(now, days)))
+
+    @staticmethod
+    def get(paper_id: int):
+        """(archive_path, sha256, original_size) of an archived paper, None if its file is not archived."""
+        query = """
+        SELECT archive_path, sha256, original_size FROM cold_files WHERE paper_id = ?
+        """
+        return database.DATABASE.fetchone(query, (paper_id,))
+
+    @staticmethod
+    def get_archived_ids():
+        query = """
+        SELECT paper_id FROM cold_files
+        """
+        return {paper_id for (paper_id,) in database.DATABASE.fetchall(query)}
+
+    @staticmethod
+    def store(paper_id: int, file_path: str, last_view, archived):
+        """
+        Record a file compress() has archived and delete the original. False, and nothing deleted, when the
+        paper was opened or the file changed since it was listed, or the archive has gone meanwhile.
+        """
+        archive_path, sha256, size, archived_size, mtime = archived
+        try:
+            stat = os.stat(file_path)
+            unchanged = stat.st_size == size and stat.st_mtime == mtime
+            archive_intact = os.path.getsize(archive_path) == archived_size
+        except OSError:
+            unchanged = archive_intact = False
+        if not unchanged or not archive_intact or Storage.get_last_view(paper_id) != last_view:
+            ColdStorage.discard(archive_path)
+            return False
+
+        query = """
+        INSERT OR REPLACE INTO cold_files (paper_id, archive_path, sha256, original_size, archived_size)
+        VALUES (?, ?, ?, ?, ?)
+        """
+        database.DATABASE.execute_with_args(query, (paper_id, archive_path, sha256, size, archived_size))
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            print(f"Could not delete {file_path} after archiving it: {e}")
+            ColdStorage.forget(paper_id)
+            return False
+        return True
+
+    @staticmethod
+    def forget(paper_id: int):
+        """Drop the archive record of a paper, and the archive once no other paper shares it."""
+        if (archived := ColdStorage.get(paper_id)) is None:
+            return
+        database.DATABASE.execute_with_args("DELETE FROM cold_files WHERE paper_id = ?", (paper_id,))
+        ColdStorage.discard(archived[0])
+
+    @staticmethod
+    def discard(archive_path: str):
+        query = """
+        SELECT 1 FROM cold_files WHERE archive_path = ? LIMIT 1
+        """
+        if database.DATABASE.fetchone(query, (archive_path,)) is None and os.path.exists(archive_path):
+            os.remove(archive_path)
+
+    @staticmethod
+    def archive(days: float, keep=()):
+        """Archive every candidate in turn; yields (paper_id, file_path, size, archived_size) of archived files."""
+        for paper_id, file_path, last_view in ColdStorage.get_candidates(days):
+            if paper_id in keep:
+                continue
+            try:
+                archived = compress(file_path)
+            except Exception as e:
+                print(f"Could not archive {file_path}: {e}")
+                continue
+            if ColdStorage.store(paper_id, file_path, last_view, archived):
+                yield paper_id, file_path, archived[2], archived[3]
+
+    @staticmethod
+    def restore(paper_id: int, progress=None):
+        """Put an archived file back at its original path."""
+        archive_path, sha256, size = ColdStorage.get(paper_id)
+        file_path = database.Paper.get_paper_path(paper_id)[0]
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        decompress(archive_path, sha256, size, file_path, progress)
+        ColdStorage.forget(paper_id)
+        return file_path
+
+    @staticmethod
+    def usage():
+        """Per folder: archived files, their original and archived bytes and the bytes reclaimed."""
+        query = """
+        SELECT f.folder_name, c.archive_path, c.original_size, c.archived_size
+        FROM cold_files c
+        INNER JOIN papers p ON p.id = c.paper_id
+        INNER JOIN folders f ON f.id = p.folder_id
+        """
+        folders, counted = {}, set()
+        for folder_name, archive_path, original_size, archived_size in database.DATABASE.fetchall(query):
+            folder = folders.setdefault(folder_name, {"folder_name": folder_name, "files": 0, "bytes": 0,
+                                                      "archived_bytes": 0, "reclaimed_bytes": 0})
+            # Identical files share one archive, which only takes space once
+            archived_size = 0 if archive_path in counted else archived_size
+            counted.add(archive_path)
+            folder["files"] += 1
+            folder["bytes"] += original_size
+            folder["archived_bytes"] += archived_size
+            folder["reclaimed_bytes"] += original_size - archived_size
+        return sorted(folders.values(), key=lambda folder: folder["reclaimed_bytes"], reverse=True)
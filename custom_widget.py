@@ -1,8 +1,12 @@
-from PyQt6.QtCore import pyqtSignal
+from PyQt6.QtCore import pyqtSignal, QTimer
+from PyQt6.QtGui import QFontDatabase
 from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QComboBox,
-                             QPushButton, QHBoxLayout, QLabel)
+                             QPushButton, QHBoxLayout, QLabel, QPlainTextEdit, QLineEdit, QDockWidget, QWidget,
+                             QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView)
 
+import database
 from database import Folder
+from smart_collection import PRESETS, RULE_KINDS
 
 
 class CategoryDialog(QDialog):
@@ -52,3 +56,292 @@ class WarningDialog(QDialog):
         layout.addWidget(label)
         self.setLayout(layout)
 
+
+class QueryStatsDialog(QDialog):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Query Statistics")
+        self.resize(900, 500)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(10, 10, 10, 10)
+        layout.setSpacing(10)
+
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        layout.addWidget(self.text)
+
+        h_layout = QHBoxLayout()
+
+        btn_refresh = QPushButton("Refresh")
+        btn_refresh.clicked.connect(self.refresh)
+        h_layout.addWidget(btn_refresh)
+
+        btn_explain = QPushButton("Explain All")
+        btn_explain.clicked.connect(self.explain_all)
+        h_layout.addWidget(btn_explain)
+
+        btn_reset = QPushButton("Reset")
+        btn_reset.clicked.connect(self.reset)
+        h_layout.addWidget(btn_reset)
+
+        layout.addLayout(h_layout)
+        self.setLayout(layout)
+        self.refresh()
+
+    def refresh(self):
+        self.text.setPlainText(database.DATABASE.query_log.format())
+
+    def explain_all(self):
+        database.DATABASE.query_log.explain_all(database.DATABASE.conn)
+        self.refresh()
+
+    def reset(self):
+        database.DATABASE.query_log.reset()
+        self.refresh()
+
+
+class StorageDialog(QDialog):
+    def __init__(self, keep=()):
+        super().__init__()
+        self.setWindowTitle("Storage Usage")
+        self.resize(700, 400)
+        self.keep = keep
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(10, 10, 10, 10)
+        layout.setSpacing(10)
+
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        layout.addWidget(self.text)
+
+        h_layout = QHBoxLayout()
+
+        btn_refresh = QPushButton("Refresh")
+        btn_refresh.clicked.connect(self.refresh)
+        h_layout.addWidget(btn_refresh)
+
+        btn_evict = QPushButton("Free Space Now")
+        btn_evict.clicked.connect(self.evict)
+        h_layout.addWidget(btn_evict)
+
+        layout.addLayout(h_layout)
+        self.setLayout(layout)
+        self.refresh()
+
+    def refresh(self, evicted=None):
+        from storage import Storage, quota_bytes
+
+        usage = Storage.usage()
+        megabytes = lambda n: f"{n / 1024 / 1024:10.1f} MB"
+        lines = [f"{'Category':<30} {'Files':>6} {'On disk':>13} {'Evictable':>13}"]
+        for folder in usage:
+            lines.append(f"{folder['folder_name'][:30]:<30} {folder['files']:>6} {megabytes(folder['bytes'])} "
+                         f"{megabytes(folder['evictable_bytes'])}")
+        total = sum(folder["bytes"] for folder in usage)
+        lines.append("")
+        lines.append(f"Total {megabytes(total)} of {megabytes(quota_bytes()).strip()} quota")
+        if evicted is not None:
+            lines.append(f"Evicted {len(evicted)} files, {megabytes(sum(size for *_, size in evicted)).strip()}")
+        lines += self.cold_storage_lines(megabytes)
+        self.text.setPlainText("\n".join(lines))
+
+    def cold_storage_lines(self, megabytes):
+        from cold_storage import ColdStorage, archive_directory
+
+        usage = ColdStorage.usage()
+        if not usage:
+            return []
+        lines = ["", f"Cold archive ({archive_directory()})",
+                 f"{'Category':<30} {'Files':>6} {'Original':>13} {'Archived':>13} {'Reclaimed':>13}"]
+        for folder in usage:
+            lines.append(f"{folder['folder_name'][:30]:<30} {folder['files']:>6} {megabytes(folder['bytes'])} "
+                         f"{megabytes(folder['archived_bytes'])} {megabytes(folder['reclaimed_bytes'])}")
+        lines.append("")
+        lines.append(f"Reclaimed {megabytes(sum(folder['reclaimed_bytes'] for folder in usage)).strip()} "
+                     f"from {sum(folder['files'] for folder in usage)} archived files")
+        return lines
+
+    def evict(self):
+        from storage import Storage
+
+        self.refresh(Storage.evict(keep=self.keep))
+
+
+class HealthDialog(QDialog):
+    scan_requested = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Library Health")
+        self.setFixedWidth(400)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(10, 10, 10, 10)
+        layout.setSpacing(10)
+
+        self.label = QLabel()
+        self.label.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        layout.addWidget(self.label)
+
+        h_layout = QHBoxLayout()
+
+        btn_refresh = QPushButton("Refresh")
+        btn_refresh.clicked.connect(self.refresh)
+        h_layout.addWidget(btn_refresh)
+
+        btn_scan = QPushButton("Scan Now")
+        btn_scan.clicked.connect(self.scan_requested.emit)
+        h_layout.addWidget(btn_scan)
+
+        layout.addLayout(h_layout)
+        self.setLayout(layout)
+        self.refresh()
+
+    def refresh(self):
+        from integrity import Integrity
+
+        labels = {"ok": "Present", "changed": "Changed since last scan", "missing": "Missing",
+                  "missing-downloadable": "Missing, downloadable", "unchecked": "Not scanned yet"}
+        summary = Integrity.summary()
+        self.label.setText("\n".join(f"{labels[status]:<24} {count:>7}" for status, count in summary.items()))
+
+
+class SmartCollectionDialog(QDialog):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Add Smart Collection")
+        self.setFixedWidth(400)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(10, 10, 10, 10)
+        layout.setSpacing(10)
+
+        self.name = QLineEdit()
+        self.name.setPlaceholderText("Collection name")
+        layout.addWidget(self.name)
+
+        self.rule = QComboBox()
+        for preset in PRESETS:
+            self.rule.addItem(preset, ("preset", preset))
+        for kind, description in RULE_KINDS.items():
+            self.rule.addItem(description, ("rule", kind))
+        self.rule.currentIndexChanged.connect(self.update_value_field)
+        layout.addWidget(self.rule)
+
+        self.value = QLineEdit()
+        self.value.setPlaceholderText("Value")
+        layout.addWidget(self.value)
+
+        btn_save = QPushButton("Save")
+        btn_save.clicked.connect(self.accept)
+        layout.addWidget(btn_save)
+
+        self.setLayout(layout)
+        self.update_value_field()
+
+    def update_value_field(self):
+        source, key = self.rule.currentData()
+        self.value.setEnabled(source == "rule" and key != "unread")
+        if not self.name.text() or self.name.text() in PRESETS:
+            self.name.setText(key if source == "preset" else "")
+
+    def rules(self):
+        source, key = self.rule.currentData()
+        if source == "preset":
+            return PRESETS[key]
+        value = self.value.text()
+        if key == "in_folder":
+            folder_id = Folder.get_folder_id_for_title(value)
+            value = folder_id[0] if folder_id else -1
+        elif key in ("added_within_days", "not_opened_for_days"):
+            value = float(value or 0)
+        return [[key, value]]
+
+
+def format_amount(amount: float, unit: str):
+    if unit != "B":
+        return f"{amount:.0f} {unit}"
+    for prefix in ("", "K", "M", "G"):
+        if amount < 1024 or prefix == "G":
+            return f"{amount:.1f} {prefix}B"
+        amount /= 1024
+
+
+class JobsPanel(QDockWidget):
+    COLUMNS = ("Job", "Priority", "State", "Progress", "Elapsed", "Throughput")
+
+    def __init__(self, scheduler, parent=None):
+        super().__init__("Jobs", parent)
+        self.scheduler = scheduler
+        self.setObjectName("JobsPanel")
+
+        widget = QWidget()
+        layout = QVBoxLayout()
+        layout.setContentsMargins(10, 10, 10, 10)
+        layout.setSpacing(10)
+
+        self.label = QLabel()
+        layout.addWidget(self.label)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        layout.addWidget(self.table)
+
+        h_layout = QHBoxLayout()
+
+        btn_cancel = QPushButton("Cancel")
+        btn_cancel.clicked.connect(self.cancel_selected)
+        h_layout.addWidget(btn_cancel)
+
+        layout.addLayout(h_layout)
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        # Progress changes on the workers without signals, so the panel polls while it is shown
+        self.timer = QTimer(self)
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(lambda visible: self.timer.start() if visible else self.timer.stop())
+        self.jobs = []
+
+    def refresh(self):
+        from jobs import PRIORITY_NAMES
+
+        running, queued, done = self.scheduler.counts()
+        self.label.setText(f"{running} running, {queued} queued, {done} done in the last minute")
+
+        # Newest first
+        self.jobs = list(reversed(self.scheduler.jobs))
+        self.table.setRowCount(len(self.jobs))
+        for row, job in enumerate(self.jobs):
+            progress = job.progress()
+            cells = (
+                job.title,
+                PRIORITY_NAMES[job.priority],
+                job.state if job.attempts <= 1 else f"{job.state} ({job.attempts})",
+                format_amount(job.done_items, job.unit) if progress is None else f"{progress:.0%}",
+                f"{job.elapsed():.1f} s",
+                f"{format_amount(job.throughput(), job.unit)}/s" if job.done_items else "",
+            )
+            for column, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if column == 0 and job.error is not None:
+                    item.setToolTip(str(job.error))
+                self.table.setItem(row, column, item)
+
+    def cancel_selected(self):
+        for row in {index.row() for index in self.table.selectedIndexes()}:
+            if row < len(self.jobs):
+                self.scheduler.cancel(self.jobs[row])
+        self.refresh()
@@ -1,25 +1,488 @@
+import atexit
 import datetime
+import functools
 import os
 import shutil
 import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
 from typing import Optional
 
-DB_NAME = "research_library.db"
+from query_log import QueryLog
+from tracing import TRACER
+
+DB_NAME = os.environ.get("PAPERFLUX_DB", "research_library.db")
+# sqlite3 keeps this many prepared statements per connection, keyed by the SQL text
+STATEMENT_CACHE_SIZE = 256
+PAGE_SIZE = 500
+
+# Library listing rows, unpacked like the (id, title, folder_name, file_path) tuples they replace
+PaperRow = namedtuple("PaperRow", ("id", "title", "folder_name", "file_path"))
 
 # ==============================
 # DATABASE
 # ==============================
-def backup():
-    if os.path.exists(DB_NAME):
-        shutil.copy(DB_NAME, "backup_" + DB_NAME)
+# Versioned schema changes applied on top of create_tables, tracked with PRAGMA user_version.
+# Append new (version, script) pairs; never edit a migration that has shipped.
+MIGRATIONS = [
+    (1, """
+    -- get_all_papers, get_last_n_viewed_papers, get_last_viewed_paper, get_selected_folder_id, search_paper
+    CREATE INDEX IF NOT EXISTS idx_papers_active_recent
+        ON papers (last_view DESC, added_at DESC, folder_id, title, file_path, is_active)
+        WHERE is_active = TRUE;
+
+    -- change_folder_id, Folder.remove_folder foreign key check
+    CREATE INDEX IF NOT EXISTS idx_papers_folder_id ON papers (folder_id);
+
+    -- get_file_path_of_last_local_pdf
+    CREATE INDEX IF NOT EXISTS idx_papers_local_added
+        ON papers (added_at DESC, file_path, website_url, is_active)
+        WHERE is_active = TRUE AND website_url IS NULL;
+    """),
+    (2, """
+    -- Nested folders: one row per (ancestor, descendant) pair, including each folder with itself at depth 0
+    UPDATE folders SET parent_folder_id = 0 WHERE parent_folder_id IS NULL;
+
+    CREATE TABLE IF NOT EXISTS folder_closure (
+        ancestor_id INTEGER NOT NULL REFERENCES folders (id) ON DELETE CASCADE,
+        descendant_id INTEGER NOT NULL REFERENCES folders (id) ON DELETE CASCADE,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_folder_closure_descendant ON folder_closure (descendant_id, ancestor_id, depth);
+    CREATE INDEX IF NOT EXISTS idx_folders_parent ON folders (parent_folder_id);
+
+    WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+        SELECT id, id, 0 FROM folders
+        UNION ALL
+        SELECT t.ancestor_id, f.id, t.depth + 1 FROM tree t JOIN folders f ON f.parent_folder_id = t.descendant_id
+    )
+    INSERT OR IGNORE INTO folder_closure (ancestor_id, descendant_id, depth)
+    SELECT ancestor_id, descendant_id, depth FROM tree;
+
+    CREATE TRIGGER IF NOT EXISTS folders_closure_insert AFTER INSERT ON folders
+    BEGIN
+        INSERT INTO folder_closure (ancestor_id, descendant_id, depth) VALUES (NEW.id, NEW.id, 0);
+        INSERT INTO folder_closure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, NEW.id, depth + 1 FROM folder_closure WHERE descendant_id = NEW.parent_folder_id;
+    END;
+    """),
+    (3, """
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tag_name TEXT NOT NULL UNIQUE
+    );
+
+    CREATE TABLE IF NOT EXISTS paper_tags (
+        paper_id INTEGER NOT NULL REFERENCES papers (id) ON DELETE CASCADE,
+        tag_id INTEGER NOT NULL REFERENCES tags (id) ON DELETE CASCADE,
+        PRIMARY KEY (paper_id, tag_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_paper_tags_tag ON paper_tags (tag_id, paper_id);
+    """),
+    (4, """
+    -- Smart collections: rule definitions with a materialized member list, see smart_collection.py
+    CREATE TABLE IF NOT EXISTS collections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        collection_name TEXT NOT NULL UNIQUE,
+        rules TEXT NOT NULL,
+        evaluated_at TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS collection_members (
+        collection_id INTEGER NOT NULL REFERENCES collections (id) ON DELETE CASCADE,
+        paper_id INTEGER NOT NULL REFERENCES papers (id) ON DELETE CASCADE,
+        PRIMARY KEY (collection_id, paper_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_collection_members_paper ON collection_members (paper_id);
+    CREATE INDEX IF NOT EXISTS idx_papers_added_at ON papers (added_at);
+
+    -- Papers written since the collections were last brought up to date
+    CREATE TABLE IF NOT EXISTS collection_dirty (paper_id INTEGER PRIMARY KEY);
+
+    CREATE TRIGGER IF NOT EXISTS papers_collection_insert AFTER INSERT ON papers
+    WHEN EXISTS (SELECT 1 FROM collections)
+    BEGIN
+        INSERT OR IGNORE INTO collection_dirty (paper_id) VALUES (NEW.id);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS papers_collection_update AFTER UPDATE ON papers
+    WHEN EXISTS (SELECT 1 FROM collections)
+    BEGIN
+        INSERT OR IGNORE INTO collection_dirty (paper_id) VALUES (NEW.id);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS paper_tags_collection_insert AFTER INSERT ON paper_tags
+    WHEN EXISTS (SELECT 1 FROM collections)
+    BEGIN
+        INSERT OR IGNORE INTO collection_dirty (paper_id) VALUES (NEW.paper_id);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS paper_tags_collection_delete AFTER DELETE ON paper_tags
+    WHEN EXISTS (SELECT 1 FROM collections)
+    BEGIN
+        INSERT OR IGNORE INTO collection_dirty (paper_id) VALUES (OLD.paper_id);
+    END;
+    """),
+    (5, """
+    -- Trigram index over titles and authors for typo-tolerant search, see fuzzy_search.py. Titles made from
+    -- file names and URL slugs are indexed with '_', '-' and '.' read as spaces.
+    CREATE VIRTUAL TABLE IF NOT EXISTS paper_search USING fts5 (title, authors, tokenize='trigram');
+    CREATE VIRTUAL TABLE IF NOT EXISTS paper_search_vocab USING fts5vocab (paper_search, 'row');
+
+    CREATE TRIGGER IF NOT EXISTS papers_search_insert AFTER INSERT ON papers
+    BEGIN
+        INSERT INTO paper_search (rowid, title, authors) VALUES (
+            NEW.id,
+            replace(replace(replace(NEW.title, '_', ' '), '-', ' '), '.', ' '),
+            replace(replace(replace(NEW.authors, '_', ' '), '-', ' '), '.', ' ')
+        );
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS papers_search_delete AFTER DELETE ON papers
+    BEGIN
+        DELETE FROM paper_search WHERE rowid = OLD.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS papers_search_update AFTER UPDATE OF title, authors ON papers
+    BEGIN
+        UPDATE paper_search SET
+            title = replace(replace(replace(NEW.title, '_', ' '), '-', ' '), '.', ' '),
+            authors = replace(replace(replace(NEW.authors, '_', ' '), '-', ' '), '.', ' ')
+        WHERE rowid = NEW.id;
+    END;
+
+    INSERT INTO paper_search (rowid, title, authors)
+    SELECT id,
+           replace(replace(replace(title, '_', ' '), '-', ' '), '.', ' '),
+           replace(replace(replace(authors, '_', ' '), '-', ' '), '.', ' ')
+    FROM papers;
+    """),
+    (6, """
+    -- Hashed bag-of-words vectors and cached nearest neighbours, see related_papers.py
+    CREATE TABLE IF NOT EXISTS paper_vectors (
+        paper_id INTEGER PRIMARY KEY REFERENCES papers (id) ON DELETE CASCADE,
+        vector BLOB NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS related_cache (
+        paper_id INTEGER PRIMARY KEY REFERENCES papers (id) ON DELETE CASCADE,
+        related_ids BLOB NOT NULL,
+        scores BLOB NOT NULL
+    );
+
+    -- Papers still to be (re)vectorized, filled by triggers so that checking for new papers costs nothing
+    CREATE TABLE IF NOT EXISTS vector_dirty (
+        paper_id INTEGER PRIMARY KEY
+    );
+
+    INSERT OR IGNORE INTO vector_dirty (paper_id) SELECT id FROM papers;
+
+    CREATE TRIGGER IF NOT EXISTS papers_vector_insert AFTER INSERT ON papers
+    BEGIN
+        INSERT OR IGNORE INTO vector_dirty (paper_id) VALUES (NEW.id);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS papers_vector_update AFTER UPDATE OF title, authors, abstract ON papers
+    BEGIN
+        INSERT OR IGNORE INTO vector_dirty (paper_id) VALUES (NEW.id);
+        DELETE FROM related_cache WHERE paper_id = NEW.id;
+    END;
+    """),
+    (7, """
+    -- Citation edges found in local PDFs, see citations.py. The cited side is an arXiv id, so a
+    -- reference starts resolving the moment that paper is added to the library.
+    CREATE TABLE IF NOT EXISTS citations (
+        citing_id INTEGER NOT NULL REFERENCES papers (id) ON DELETE CASCADE,
+        cited_arxiv_id TEXT NOT NULL,
+        PRIMARY KEY (citing_id, cited_arxiv_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_citations_cited ON citations (cited_arxiv_id, citing_id);
+
+    CREATE TABLE IF NOT EXISTS citation_scans (
+        paper_id INTEGER PRIMARY KEY REFERENCES papers (id) ON DELETE CASCADE,
+        scanned_at TEXT NOT NULL
+    );
+
+    -- A paper saved from a versioned URL (2101.00001v2) resolves references to 2101.00001. The range
+    -- lets the join seek papers by arxiv_id, the IN lets it seek citations by cited_arxiv_id.
+    CREATE VIEW IF NOT EXISTS citation_edges AS
+    SELECT c.citing_id, p.id AS cited_id
+    FROM citations c
+    INNER JOIN papers p ON p.arxiv_id >= c.cited_arxiv_id AND p.arxiv_id < c.cited_arxiv_id || 'w'
+        AND c.cited_arxiv_id IN (p.arxiv_id, CASE WHEN p.arxiv_id GLOB '*[0-9]v[0-9]*'
+                                                  THEN rtrim(rtrim(p.arxiv_id, '0123456789'), 'v') END);
+    """),
+    (8, """
+    -- Papers whose downloaded file is never evicted by the storage quota, see storage.py
+    CREATE TABLE IF NOT EXISTS pinned_papers (
+        paper_id INTEGER PRIMARY KEY REFERENCES papers (id) ON DELETE CASCADE
+    );
+    """),
+    (9, """
+    -- Last known state of every local file, written by the integrity scanner, see integrity.py
+    CREATE TABLE IF NOT EXISTS file_checks (
+        paper_id INTEGER PRIMARY KEY REFERENCES papers (id) ON DELETE CASCADE,
+        size INTEGER,
+        mtime REAL,
+        content_hash TEXT,
+        status TEXT NOT NULL,
+        checked_at TEXT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_file_checks_status ON file_checks (status);
+    """),
+    (10, """
+    -- Readable text of saved web articles, see snapshot.py. Word tokens, the trigram index stays on titles
+    CREATE VIRTUAL TABLE IF NOT EXISTS article_text USING fts5 (body, tokenize='porter unicode61');
+
+    CREATE TRIGGER IF NOT EXISTS papers_article_text_delete AFTER DELETE ON papers
+    BEGIN
+        DELETE FROM article_text WHERE rowid = OLD.id;
+    END;
+    """),
+    (11, """
+    -- DOIs of imported references, used to recognise a paper that is already in the library
+    ALTER TABLE papers ADD COLUMN doi TEXT;
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_papers_doi ON papers (doi) WHERE doi IS NOT NULL;
+    """),
+    (12, """
+    -- Change log for syncing between machines, see sync.py. Every paper and folder write made outside of a sync
+    -- is logged with the changed columns and a Lamport clock; papers are keyed by arxiv_id, folders by name.
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value
+    ) WITHOUT ROWID;
+
+    INSERT OR IGNORE INTO sync_state (key, value) VALUES
+        ('replica', lower(hex(randomblob(16)))), ('clock', 1), ('applying', 0), ('pushed_seq', 0);
+
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        entity_key TEXT NOT NULL,
+        fields TEXT NOT NULL,
+        clock INTEGER NOT NULL,
+        replica TEXT NOT NULL,
+        -- seq on the replica that made the change, NULL for local changes
+        origin_seq INTEGER
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_change_log_entity ON change_log (entity, entity_key, clock, replica);
+
+    -- Per remote replica: last of its changes applied here
+    CREATE TABLE IF NOT EXISTS sync_peers (
+        replica TEXT PRIMARY KEY,
+        pulled_seq INTEGER NOT NULL
+    ) WITHOUT ROWID;
+
+    INSERT INTO change_log (entity, entity_key, fields, clock, replica)
+    SELECT 'folder', f.folder_name,
+           json_object('parent', (SELECT folder_name FROM folders WHERE id = f.parent_folder_id), '_deleted', 0),
+           1, (SELECT value FROM sync_state WHERE key = 'replica')
+    FROM folders f ORDER BY f.id;
+
+    INSERT INTO change_log (entity, entity_key, fields, clock, replica)
+    SELECT 'paper', p.arxiv_id,
+           json_object('title', p.title, 'authors', p.authors, 'abstract', p.abstract, 'file_path', p.file_path,
+                       'website_url', p.website_url, 'added_at', p.added_at, 'last_view', p.last_view,
+                       'folder', (SELECT folder_name FROM folders WHERE id = p.folder_id), 'is_active', p.is_active,
+                       'doi', p.doi, '_deleted', 0),
+           1, (SELECT value FROM sync_state WHERE key = 'replica')
+    FROM papers p ORDER BY p.id;
+
+    CREATE TRIGGER IF NOT EXISTS papers_sync_insert AFTER INSERT ON papers
+    WHEN (SELECT value FROM sync_state WHERE key = 'applying') = 0
+    BEGIN
+        UPDATE sync_state SET value = value + 1 WHERE key = 'clock';
+        INSERT INTO change_log (entity, entity_key, fields, clock, replica) VALUES (
+            'paper', NEW.arxiv_id,
+            json_object('title', NEW.title, 'authors', NEW.authors, 'abstract', NEW.abstract,
+                        'file_path', NEW.file_path, 'website_url', NEW.website_url, 'added_at', NEW.added_at,
+                        'last_view', NEW.last_view, 'folder', (SELECT folder_name FROM folders WHERE id = NEW.folder_id),
+                        'is_active', NEW.is_active, 'doi', NEW.doi, '_deleted', 0),
+            (SELECT value FROM sync_state WHERE key = 'clock'), (SELECT value FROM sync_state WHERE key = 'replica')
+        );
+    END;
+
+    -- Only the columns that changed are logged, so concurrent edits to different columns both survive
+    CREATE TRIGGER IF NOT EXISTS papers_sync_update AFTER UPDATE ON papers
+    WHEN (SELECT value FROM sync_state WHERE key = 'applying') = 0 AND OLD.arxiv_id IS NEW.arxiv_id
+        AND (OLD.title IS NOT NEW.title OR OLD.authors IS NOT NEW.authors OR OLD.abstract IS NOT NEW.abstract
+             OR OLD.file_path IS NOT NEW.file_path OR OLD.website_url IS NOT NEW.website_url
+             OR OLD.added_at IS NOT NEW.added_at OR OLD.last_view IS NOT NEW.last_view
+             OR OLD.folder_id IS NOT NEW.folder_id OR OLD.is_active IS NOT NEW.is_active OR OLD.doi IS NOT NEW.doi)
+    BEGIN
+        UPDATE sync_state SET value = value + 1 WHERE key = 'clock';
+        INSERT INTO change_log (entity, entity_key, fields, clock, replica) VALUES (
+            'paper', NEW.arxiv_id,
+            json_remove(
+                json_object('title', NEW.title, 'authors', NEW.authors, 'abstract', NEW.abstract,
+                            'file_path', NEW.file_path, 'website_url', NEW.website_url, 'added_at', NEW.added_at,
+                            'last_view', NEW.last_view,
+                            'folder', (SELECT folder_name FROM folders WHERE id = NEW.folder_id),
+                            'is_active', NEW.is_active, 'doi', NEW.doi),
+                CASE WHEN OLD.title IS NEW.title THEN '$.title' ELSE '$._' END,
+                CASE WHEN OLD.authors IS NEW.authors THEN '$.authors' ELSE '$._' END,
+                CASE WHEN OLD.abstract IS NEW.abstract THEN '$.abstract' ELSE '$._' END,
+                CASE WHEN OLD.file_path IS NEW.file_path THEN '$.file_path' ELSE '$._' END,
+                CASE WHEN OLD.website_url IS NEW.website_url THEN '$.website_url' ELSE '$._' END,
+                CASE WHEN OLD.added_at IS NEW.added_at THEN '$.added_at' ELSE '$._' END,
+                CASE WHEN OLD.last_view IS NEW.last_view THEN '$.last_view' ELSE '$._' END,
+                CASE WHEN OLD.folder_id IS NEW.folder_id THEN '$.folder' ELSE '$._' END,
+                CASE WHEN OLD.is_active IS NEW.is_active THEN '$.is_active' ELSE '$._' END,
+                CASE WHEN OLD.doi IS NEW.doi THEN '$.doi' ELSE '$._' END
+            ),
+            (SELECT value FROM sync_state WHERE key = 'clock'), (SELECT value FROM sync_state WHERE key = 'replica')
+        );
+    END;
+
+    -- A new arxiv_id is a new key: log the old one as deleted and the row again under the new one
+    CREATE TRIGGER IF NOT EXISTS papers_sync_rekey AFTER UPDATE OF arxiv_id ON papers
+    WHEN (SELECT value FROM sync_state WHERE key = 'applying') = 0 AND OLD.arxiv_id IS NOT NEW.arxiv_id
+    BEGIN
+        UPDATE sync_state SET value = value + 1 WHERE key = 'clock';
+        INSERT INTO change_log (entity, entity_key, fields, clock, replica) VALUES (
+            'paper', OLD.arxiv_id, json_object('_deleted', 1),
+            (SELECT value FROM sync_state WHERE key = 'clock'), (SELECT value FROM sync_state WHERE key = 'replica')
+        );
+        INSERT INTO change_log (entity, entity_key, fields, clock, replica) VALUES (
+            'paper', NEW.arxiv_id,
+            json_object('title', NEW.title, 'authors', NEW.authors, 'abstract', NEW.abstract,
+                        'file_path', NEW.file_path, 'website_url', NEW.website_url, 'added_at', NEW.added_at,
+                        'last_view', NEW.last_view, 'folder', (SELECT folder_name FROM folders WHERE id = NEW.folder_id),
+                        'is_active', NEW.is_active, 'doi', NEW.doi, '_deleted', 0),
+            (SELECT value FROM sync_state WHERE key = 'clock'), (SELECT value FROM sync_state WHERE key = 'replica')
+        );
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS papers_sync_delete AFTER DELETE ON papers
+    WHEN (SELECT value FROM sync_state WHERE key = 'applying') = 0
+    BEGIN
+        UPDATE sync_state SET value = value + 1 WHERE key = 'clock';
+        INSERT INTO change_log (entity, entity_key, fields, clock, replica) VALUES (
+            'paper', OLD.arxiv_id, json_object('_deleted', 1),
+            (SELECT value FROM sync_state WHERE key = 'clock'), (SELECT value FROM sync_state WHERE key = 'replica')
+        );
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS folders_sync_insert AFTER INSERT ON folders
+    WHEN (SELECT value FROM sync_state WHERE key = 'applying') = 0
+    BEGIN
+        UPDATE sync_state SET value = value + 1 WHERE key = 'clock';
+        INSERT INTO change_log (entity, entity_key, fields, clock, replica) VALUES (
+            'folder', NEW.folder_name,
+            json_object('parent', (SELECT folder_name FROM folders WHERE id = NEW.parent_folder_id), '_deleted', 0),
+            (SELECT value FROM sync_state WHERE key = 'clock'), (SELECT value FROM sync_state WHERE key = 'replica')
+        );
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS folders_sync_update AFTER UPDATE OF parent_folder_id ON folders
+    WHEN (SELECT value FROM sync_state WHERE key = 'applying') = 0 AND OLD.parent_folder_id IS NOT NEW.parent_folder_id
+    BEGIN
+        UPDATE sync_state SET value = value + 1 WHERE key = 'clock';
+        INSERT INTO change_log (entity, entity_key, fields, clock, replica) VALUES (
+            'folder', NEW.folder_name,
+            json_object('parent', (SELECT folder_name FROM folders WHERE id = NEW.parent_folder_id)),
+            (SELECT value FROM sync_state WHERE key = 'clock'), (SELECT value FROM sync_state WHERE key = 'replica')
+        );
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS folders_sync_delete AFTER DELETE ON folders
+    WHEN (SELECT value FROM sync_state WHERE key = 'applying') = 0
+    BEGIN
+        UPDATE sync_state SET value = value + 1 WHERE key = 'clock';
+        INSERT INTO change_log (entity, entity_key, fields, clock, replica) VALUES (
+            'folder', OLD.folder_name, json_object('_deleted', 1),
+            (SELECT value FROM sync_state WHERE key = 'clock'), (SELECT value FROM sync_state WHERE key = 'replica')
+        );
+    END;
+    """),
+    (13, """
+    -- Keyset pagination (get_papers_page) orders by (last_view, added_at, id); the same index still serves
+    -- get_all_papers, get_last_n_viewed_papers, get_last_viewed_paper, get_selected_folder_id and search_paper
+    CREATE INDEX IF NOT EXISTS idx_papers_active_keyset
+        ON papers (last_view DESC, added_at DESC, id DESC, folder_id, title, file_path)
+        WHERE is_active = TRUE;
+
+    DROP INDEX IF EXISTS idx_papers_active_recent;
+    """),
+    (14, """
+    -- Where each paper was left: page, how far down that page and the zoom (NULL fits the page width)
+    CREATE TABLE IF NOT EXISTS reading_state (
+        paper_id INTEGER PRIMARY KEY REFERENCES papers (id) ON DELETE CASCADE,
+        page INTEGER NOT NULL DEFAULT 0,
+        page_offset REAL NOT NULL DEFAULT 0,
+        zoom REAL,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """),
+    (15, """
+    -- PDFs moved to the compressed cold archive, see cold_storage.py. papers.file_path keeps the original
+    -- path, where the file is put back when it is restored. Identical files share one archive.
+    CREATE TABLE IF NOT EXISTS cold_files (
+        paper_id INTEGER PRIMARY KEY REFERENCES papers (id) ON DELETE CASCADE,
+        archive_path TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        original_size INTEGER NOT NULL,
+        archived_size INTEGER NOT NULL,
+        archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_cold_files_archive ON cold_files (archive_path);
+    """),
+    (16, """
+    -- Moving a folder rewrites folder_closure without touching its papers; in_folder rules read folder_closure,
+    -- so the papers of every folder whose ancestors changed are re-evaluated, see smart_collection.py
+    CREATE TRIGGER IF NOT EXISTS folder_closure_collection_insert AFTER INSERT ON folder_closure
+    WHEN EXISTS (SELECT 1 FROM collections WHERE rules LIKE '%"in_folder"%')
+    BEGIN
+        INSERT OR IGNORE INTO collection_dirty (paper_id) SELECT id FROM papers WHERE folder_id = NEW.descendant_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS folder_closure_collection_delete AFTER DELETE ON folder_closure
+    WHEN EXISTS (SELECT 1 FROM collections WHERE rules LIKE '%"in_folder"%')
+    BEGIN
+        INSERT OR IGNORE INTO collection_dirty (paper_id) SELECT id FROM papers WHERE folder_id = OLD.descendant_id;
+    END;
+    """),
+    (17, """
+    -- Related-paper vectors include the article text and the cited papers, so storing either re-vectorizes
+    -- the paper. article_text is an FTS table, which takes no triggers: Paper.set_article_text queues it.
+    CREATE TRIGGER IF NOT EXISTS citation_scans_vector_insert AFTER INSERT ON citation_scans
+    BEGIN
+        INSERT OR IGNORE INTO vector_dirty (paper_id) VALUES (NEW.paper_id);
+    END;
+
+    INSERT OR IGNORE INTO vector_dirty (paper_id) SELECT rowid FROM article_text;
+    INSERT OR IGNORE INTO vector_dirty (paper_id) SELECT DISTINCT citing_id FROM citations;
+    """),
+]
+
+
+def backup(db_name: str = DB_NAME):
+    if os.path.exists(db_name):
+        directory, name = os.path.split(db_name)
+        shutil.copy(db_name, os.path.join(directory, "backup_" + name))
 
 
 class Database:
-    def __init__(self):
-        backup()
-        self.conn = sqlite3.connect(DB_NAME)
+    def __init__(self, db_name: str = DB_NAME):
+        self.db_name = db_name
+        self.conn = sqlite3.connect(db_name, cached_statements=STATEMENT_CACHE_SIZE)
+        self.query_log = QueryLog()
+        # row key -> (query, args) of the last write to that row since the last flush
+        self.pending_writes = {}
         self.conn.execute("PRAGMA foreign_keys = ON")
         self.create_tables()
+        self.migrate()
+        atexit.register(self.flush)
 
     def create_tables(self):
         self.conn.executescript("""
@@ -56,13 +519,171 @@ class Database:
         """)
         self.conn.commit()
 
+    def schema_version(self):
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self):
+        # Keep a copy of the library as it was before any schema change touches it
+        if self.schema_version() < MIGRATIONS[-1][0]:
+            backup(self.db_name)
+        for version, script in MIGRATIONS:
+            if version <= self.schema_version():
+                continue
+            self.conn.executescript(f"BEGIN; {script}; PRAGMA user_version = {version}; COMMIT;")
+
     def execute_with_args(self, query, /, *args):
-        self.conn.execute(query, *args)
+        self.flush()
+        started = time.perf_counter()
+        cursor = self.conn.execute(query, *args)
         self.conn.commit()
+        self.query_log.record(self.conn, query, args[0] if args else (),
+                              (time.perf_counter() - started) * 1000, cursor.rowcount)
+
+    def execute_in_transaction(self, *statements):
+        """Run (query, args) pairs as one transaction, rolling all of them back if one fails."""
+        self.flush()
+        started = time.perf_counter()
+        try:
+            for query, args in statements:
+                self.conn.execute(query, args)
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        self.query_log.record(self.conn, "; ".join(query for query, _ in statements), (),
+                              (time.perf_counter() - started) * 1000, len(statements))
+
+    def execute_deferred(self, key, query, args=()):
+        """
+        Write-behind for UI-triggered updates. The statement is queued under key, replacing an earlier write
+        to the same row, and the queue is committed in one short transaction by flush(). Reads flush it first,
+        so they always see it, and no write lock is held between flushes for other processes to run into.
+        """
+        self.pending_writes.pop(key, None)
+        self.pending_writes[key] = (query, args)
+
+    @TRACER.traced("sql", "Database.flush")
+    def flush(self):
+        """Commit the queued writes; returns how many rows they were for."""
+        if not self.pending_writes:
+            return 0
+        statements = list(self.pending_writes.values())
+        self.pending_writes.clear()
+        try:
+            self.execute_in_transaction(*statements)
+        except sqlite3.Error:
+            # One at a time, so that a write that cannot be made (a duplicate title) does not take the rest with it
+            for statement in statements:
+                try:
+                    self.execute_in_transaction(statement)
+                except sqlite3.Error as e:
+                    print(f"Error: {e}")
+        return len(statements)
+
+    @contextmanager
+    def transaction(self):
+        """
+        For writes that have to read their own results: statements run through execute() inside the block
+        are committed together when it ends, or rolled back if it raises.
+        """
+        self.flush()
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    def execute(self, query, args=()):
+        """Run one statement in the enclosing transaction()."""
+        started = time.perf_counter()
+        cursor = self.conn.execute(query, args)
+        self.query_log.record(self.conn, query, args, (time.perf_counter() - started) * 1000, cursor.rowcount)
+
+    def open_reader(self):
+        """
+        A second connection to the library for a job that reads a large result off the GUI thread, which owns
+        this one. Queued writes are committed first so that it sees them; the job closes it when done.
+        """
+        self.flush()
+        return sqlite3.connect(self.db_name, check_same_thread=False)
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        self.conn.close()
+
+    def fetchall(self, query, args=(), row_factory=None):
+        self.flush()
+        started = time.perf_counter()
+        cursor = self.conn.execute(query, args)
+        cursor.row_factory = row_factory
+        rows = cursor.fetchall()
+        self.query_log.record(self.conn, query, args, (time.perf_counter() - started) * 1000, len(rows))
+        return rows
+
+    def fetchone(self, query, args=()):
+        self.flush()
+        started = time.perf_counter()
+        row = self.conn.execute(query, args).fetchone()
+        self.query_log.record(self.conn, query, args, (time.perf_counter() - started) * 1000, int(row is not None))
+        return row
+
+    def iterate(self, query, args=()):
+        """Yield rows one at a time, recorded once the cursor is exhausted."""
+        self.flush()
+        started = time.perf_counter()
+        rows = 0
+        for row in self.conn.execute(query, args):
+            rows += 1
+            yield row
+        self.query_log.record(self.conn, query, args, (time.perf_counter() - started) * 1000, rows)
 
 
 DATABASE = Database()
 
+
+class PageReader:
+    """Row factory building PaperRows and remembering the keyset cursor (last_view, added_at, id) of the last."""
+    __slots__ = ("last",)
+
+    def __init__(self):
+        self.last = None
+
+    def __call__(self, cursor, row):
+        self.last = row
+        return PaperRow(row[0], row[1], row[2], row[3])
+
+    def cursor(self):
+        return None if self.last is None else (self.last[4], self.last[5], self.last[0])
+
+
+@functools.lru_cache(maxsize=None)
+def papers_page_query(viewed: bool, after: bool, title: bool, folder: bool):
+    """The SQL of one page shape, built once so every page of that shape reuses the same prepared statement."""
+    conditions = ["p.is_active = TRUE", "p.last_view IS NOT NULL" if viewed else "p.last_view IS NULL"]
+    if after:
+        conditions.append("(p.last_view, p.added_at, p.id) < (?, ?, ?)" if viewed else "(p.added_at, p.id) < (?, ?)")
+    if title:
+        conditions.append("p.title LIKE ?")
+    if folder:
+        # Unary + keeps the planner on the keyset index instead of sorting the whole category for every page
+        conditions.append("+p.folder_id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = ?)")
+    return f"""
+        SELECT p.id, p.title, f.folder_name, p.file_path, p.last_view, p.added_at
+        FROM papers p
+        INNER JOIN folders f ON p.folder_id = f.id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY p.last_view DESC, p.added_at DESC, p.id DESC
+        LIMIT ?
+        """
+
+
+def paper_filter_args(title, folder_id):
+    return ((f"%{title}%",) if title is not None else ()) + ((folder_id,) if folder_id is not None else ())
+
+
+@TRACER.traced_methods("sql")
 class Paper:
 
     @staticmethod
@@ -101,6 +722,36 @@ class Paper:
         """
         DATABASE.execute_with_args(query, (arxiv_id, title, authors, abstract, file_path, website_url, folder_id))
 
+    @staticmethod
+    def insert_rows(rows: list):
+        """Insert (arxiv_id, title, authors, abstract, file_path, website_url, folder_id) rows in one transaction."""
+        query = """
+        INSERT INTO papers (arxiv_id, title, authors, abstract, file_path, website_url, folder_id)
+        values ( ?, ?, ?, ?, ?, ?, ?);
+        """
+        DATABASE.execute_in_transaction(*((query, row) for row in rows))
+
+    @staticmethod
+    def get_taken_values(column: str, values: list):
+        """The subset of values already used in one of the unique columns, including removed papers."""
+        if column not in ("arxiv_id", "title", "file_path") or not values:
+            return set()
+        query = f"""
+        SELECT {column} FROM papers WHERE {column} IN ({", ".join("?" * len(values))})
+        """
+        return {value for (value,) in DATABASE.fetchall(query, tuple(values))}
+
+    @staticmethod
+    def get_file_paths_under(directory: str):
+        """File paths of papers stored anywhere below directory, including removed papers."""
+        prefix = directory.rstrip(os.sep) + os.sep
+        query = """
+        SELECT file_path FROM papers WHERE file_path >= ? AND file_path < ?
+        """
+        # Every path starting with prefix sorts between prefix and prefix with its last character bumped
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return {file_path for (file_path,) in DATABASE.fetchall(query, (prefix, upper))}
+
     @staticmethod
     def get_all_papers():
         query = """
@@ -108,9 +759,39 @@ class Paper:
         FROM papers p
         INNER JOIN folders f ON p.folder_id = f.id
         WHERE p.is_active = TRUE
-        ORDER BY p.last_view DESC, p.added_at DESC;
+        ORDER BY p.last_view DESC, p.added_at DESC, p.id DESC;
         """
-        return DATABASE.conn.execute(query).fetchall()
+        return DATABASE.fetchall(query)
+
+    @staticmethod
+    def get_papers_page(after=None, limit: int = PAGE_SIZE, title: str = None, folder_id: int = None):
+        """
+        One page of active papers in get_all_papers order, optionally filtered by title substring and category
+        subtree. after is the cursor returned with the previous page. Returns (rows, cursor), where cursor is
+        None after the last page; each page is a bounded index range scan, however deep into the library.
+        """
+        rows, page = [], PageReader()
+        # Viewed papers come first, then never viewed ones (last_view NULL sorts last)
+        if after is None or after[0] is not None:
+            args = (*(after or ()), *paper_filter_args(title, folder_id), limit)
+            rows += DATABASE.fetchall(papers_page_query(True, after is not None, title is not None,
+                                                        folder_id is not None), args, page)
+            if len(rows) == limit:
+                return rows, page.cursor()
+            after = None
+        args = (*(after[1:] if after else ()), *paper_filter_args(title, folder_id), limit - len(rows))
+        rows += DATABASE.fetchall(papers_page_query(False, after is not None, title is not None,
+                                                    folder_id is not None), args, page)
+        return rows, page.cursor() if len(rows) == limit else None
+
+    @staticmethod
+    def iter_papers(title: str = None, folder_id: int = None, page_size: int = PAGE_SIZE):
+        """Stream PaperRows page by page, holding one page in memory and no read transaction between pages."""
+        rows, cursor = Paper.get_papers_page(None, page_size, title, folder_id)
+        yield from rows
+        while cursor is not None:
+            rows, cursor = Paper.get_papers_page(cursor, page_size, title, folder_id)
+            yield from rows
 
     @staticmethod
     def get_last_n_viewed_papers(limit: int = 5):
@@ -122,7 +803,7 @@ class Paper:
         ORDER BY p.last_view DESC, p.added_at DESC
         LIMIT ?;
         """
-        return DATABASE.conn.execute(query, (limit,)).fetchall()
+        return DATABASE.fetchall(query, (limit,))
 
     @staticmethod
     def search_paper(title: str):
@@ -133,14 +814,101 @@ class Paper:
         WHERE p.title LIKE ? and p.is_active = TRUE
         ORDER BY p.last_view DESC, p.added_at DESC;
         """
-        return DATABASE.conn.execute(query, (f'%{title}%', )).fetchall()
+        return DATABASE.fetchall(query, (f'%{title}%', ))
+
+    @staticmethod
+    def get_all_paper_details():
+        query = """
+        SELECT p.id, p.arxiv_id, p.title, p.authors, p.abstract, p.file_path, p.website_url,
+               p.added_at, p.last_view, f.folder_name
+        FROM papers p
+        INNER JOIN folders f ON p.folder_id = f.id
+        WHERE p.is_active = TRUE
+        ORDER BY p.id;
+        """
+        return DATABASE.iterate(query)
+
+    @staticmethod
+    def get_trigram_document_counts(trigrams: list):
+        query = f"""
+        SELECT term, doc FROM paper_search_vocab WHERE term IN ({", ".join("?" * len(trigrams))})
+        """
+        return dict(DATABASE.fetchall(query, tuple(trigrams)))
+
+    @staticmethod
+    def fuzzy_search_candidates(fts_query: str, limit: int):
+        query = """
+        SELECT p.id, p.title, f.folder_name, p.file_path, s.title, s.authors
+        FROM paper_search s
+        INNER JOIN papers p ON p.id = s.rowid
+        INNER JOIN folders f ON p.folder_id = f.id
+        WHERE paper_search MATCH ? AND p.is_active = TRUE
+        ORDER BY s.rank
+        LIMIT ?;
+        """
+        return DATABASE.fetchall(query, (fts_query, limit))
+
+    @staticmethod
+    def substring_search(fts_phrase: str):
+        """Every paper whose indexed title or authors contain the phrase, in search_paper order."""
+        query = """
+        SELECT p.id, p.title, f.folder_name, p.file_path
+        FROM paper_search s
+        INNER JOIN papers p ON p.id = s.rowid
+        INNER JOIN folders f ON p.folder_id = f.id
+        WHERE paper_search MATCH ? AND p.is_active = TRUE
+        ORDER BY p.last_view DESC, p.added_at DESC;
+        """
+        return DATABASE.fetchall(query, (fts_phrase,))
+
+    @staticmethod
+    def set_article_text(paper_id: int, text: str):
+        DATABASE.execute_in_transaction(
+            ("DELETE FROM article_text WHERE rowid = ?", (paper_id,)),
+            ("INSERT INTO article_text (rowid, body) VALUES (?, ?)", (paper_id, text)),
+            ("INSERT OR IGNORE INTO vector_dirty (paper_id) VALUES (?)", (paper_id,)),
+        )
+
+    @staticmethod
+    def search_article_text(fts_query: str, limit: int):
+        query = """
+        SELECT p.id, p.title, f.folder_name, p.file_path
+        FROM article_text a
+        INNER JOIN papers p ON p.id = a.rowid
+        INNER JOIN folders f ON p.folder_id = f.id
+        WHERE article_text MATCH ? AND p.is_active = TRUE
+        ORDER BY a.rank
+        LIMIT ?;
+        """
+        return DATABASE.fetchall(query, (fts_query, limit))
+
+    @staticmethod
+    def get_papers_to_vectorize(limit: int, text_length: int):
+        """(id, title, authors, abstract, start of the article text, space-separated cited arXiv ids) rows."""
+        query = """
+        SELECT p.id, p.title, p.authors, p.abstract, substr(a.body, 1, ?),
+               (SELECT group_concat(c.cited_arxiv_id, ' ') FROM citations c WHERE c.citing_id = p.id)
+        FROM vector_dirty d
+        INNER JOIN papers p ON d.paper_id = p.id
+        LEFT JOIN article_text a ON a.rowid = p.id
+        ORDER BY d.paper_id
+        LIMIT ?
+        """
+        return DATABASE.fetchall(query, (text_length, limit))
+
+    @staticmethod
+    def get_paper_titles(paper_ids: list):
+        query = f"""
+        SELECT id, title FROM papers WHERE is_active = TRUE AND id IN ({", ".join("?" * len(paper_ids))})
+        """
+        return dict(DATABASE.fetchall(query, tuple(paper_ids)))
 
     @staticmethod
     def get_url(paper_id: str):
         query = """
         SELECT website_url FROM papers p WHERE id = ? and p.is_active = 1 LIMIT 1;
         """
-        return DATABASE.conn.execute(query, (paper_id,)).fetchone()
+        return DATABASE.fetchone(query, (paper_id,))
 
 
     @staticmethod
@@ -169,7 +937,7 @@ class Paper:
         query = """
         SELECT id FROM papers WHERE title = ? AND is_active = TRUE LIMIT 1
         """
-        return DATABASE.conn.execute(query, (title,)).fetchone()
+        return DATABASE.fetchone(query, (title,))
 
     @staticmethod
     def change_category(paper_id: str, folder_id: int):
@@ -184,7 +952,7 @@ class Paper:
         SELECT id from papers p WHERE p.is_active = TRUE
         ORDER BY last_view DESC, added_at DESC LIMIT 1
         """
-        return DATABASE.conn.execute(query).fetchone()
+        return DATABASE.fetchone(query)
 
 
     @staticmethod
@@ -193,22 +961,26 @@ class Paper:
         SELECT file_path FROM papers 
         WHERE id = ? AND is_active = TRUE
         """
-        return DATABASE.conn.execute(query, (paper_id,)).fetchone()
+        return DATABASE.fetchone(query, (paper_id,))
 
     @staticmethod
-    def update_paper_last_view_date(paper_id: str):
+    def update_paper_last_view_date(paper_id: str, immediate: bool = False):
+        """Deferred to the next flush, unless immediate, for views other connections need to see right away."""
         query = """
         UPDATE papers SET last_view = ? WHERE id = ? AND is_active = TRUE
         """
-        DATABASE.execute_with_args(query, (datetime.datetime.now(), paper_id))
+        if immediate:
+            DATABASE.execute_with_args(query, (datetime.datetime.now(), paper_id))
+        else:
+            DATABASE.execute_deferred(("papers.last_view", paper_id), query, (datetime.datetime.now(), paper_id))
 
     @staticmethod
     def get_selected_folder_id():
         query = """
-        SELECT folder_id from papers
+        SELECT folder_id from papers WHERE is_active = TRUE
         ORDER BY last_view DESC, added_at DESC LIMIT 1
         """
-        return DATABASE.conn.execute(query).fetchone()
+        return DATABASE.fetchone(query)
 
     @staticmethod
     def get_paper_using_id(paper_id):
@@ -220,14 +992,14 @@ class Paper:
         WHERE p.id = ? and p.is_active = TRUE
         LIMIT 1
         """
-        return DATABASE.conn.execute(query, (paper_id,)).fetchone()
+        return DATABASE.fetchone(query, (paper_id,))
 
     @staticmethod
     def get_folder_id_for_title(title: str):
         query = """
         SELECT folder_id FROM papers WHERE title = ?
         """
-        return DATABASE.conn.execute(query, (title,)).fetchone()
+        return DATABASE.fetchone(query, (title,))
 
     @staticmethod
     def get_id_title_and_folder_name_for_file_path(file_path: str):
@@ -237,7 +1009,7 @@ class Paper:
         WHERE p.file_path = ? and p.is_active = TRUE
         LIMIT 1
         """
-        return DATABASE.conn.execute(query, (file_path,)).fetchone()
+        return DATABASE.fetchone(query, (file_path,))
 
     @staticmethod
     def get_file_path_of_last_local_pdf():
@@ -245,7 +1017,7 @@ class Paper:
         SELECT file_path FROM papers WHERE is_active = TRUE and website_url is NULL
         order by added_at DESC LIMIT 1
         """
-        return DATABASE.conn.execute(query).fetchone()
+        return DATABASE.fetchone(query)
 
     @staticmethod
     def change_folder_id(folder_id: int, new_folder_id: int):
@@ -259,7 +1031,7 @@ class Paper:
         query = """
         UPDATE papers SET folder_id = ? WHERE id = ?
         """
-        DATABASE.execute_with_args(query, (folder_id, paper_id))
+        DATABASE.execute_deferred(("papers.folder_id", paper_id), query, (folder_id, paper_id))
 
 
     @staticmethod
@@ -267,10 +1039,11 @@ class Paper:
         query = """
         UPDATE papers SET title = ? WHERE id = ?
         """
-        DATABASE.execute_with_args(query, (title, paper_id ))
+        DATABASE.execute_deferred(("papers.title", paper_id), query, (title, paper_id))
 
 
 
+@TRACER.traced_methods("sql")
 class Folder:
 
     @staticmethod
@@ -294,14 +1067,108 @@ class Folder:
         query = """
         SELECT folder_name FROM folders
         """
-        return DATABASE.conn.execute(query).fetchall()
+        return DATABASE.fetchall(query)
+
+    @staticmethod
+    def get_folder_tree():
+        query = """
+        SELECT id, folder_name, parent_folder_id FROM folders ORDER BY parent_folder_id, id
+        """
+        return DATABASE.fetchall(query)
+
+    @staticmethod
+    def get_child_folders(folder_id: int):
+        query = """
+        SELECT id, folder_name FROM folders WHERE parent_folder_id = ? ORDER BY id
+        """
+        return DATABASE.fetchall(query, (folder_id,))
+
+    @staticmethod
+    def get_subtree_folder_ids(folder_id: int):
+        query = """
+        SELECT descendant_id FROM folder_closure WHERE ancestor_id = ? ORDER BY depth
+        """
+        return DATABASE.fetchall(query, (folder_id,))
+
+    @staticmethod
+    def get_subtree_paper_counts():
+        query = """
+        SELECT c.ancestor_id, COUNT(p.id)
+        FROM folder_closure c
+        INNER JOIN papers p ON p.folder_id = c.descendant_id AND p.is_active = TRUE
+        GROUP BY c.ancestor_id
+        """
+        return dict(DATABASE.fetchall(query))
+
+    @staticmethod
+    def get_subtree_papers(folder_id: int):
+        query = """
+        SELECT p.id, p.title, f.folder_name, p.file_path
+        FROM folder_closure c
+        INNER JOIN papers p ON p.folder_id = c.descendant_id
+        INNER JOIN folders f ON p.folder_id = f.id
+        WHERE c.ancestor_id = ? AND p.is_active = TRUE
+        ORDER BY p.last_view DESC, p.added_at DESC
+        """
+        return DATABASE.fetchall(query, (folder_id,))
+
+    @staticmethod
+    def is_in_subtree(folder_id: int, ancestor_id: int):
+        query = """
+        SELECT 1 FROM folder_closure WHERE ancestor_id = ? AND descendant_id = ?
+        """
+        return DATABASE.fetchone(query, (ancestor_id, folder_id)) is not None
+
+    @staticmethod
+    def move_folder(folder_id: int, new_parent_folder_id: int):
+        if Folder.is_in_subtree(new_parent_folder_id, folder_id):
+            raise ValueError("A folder cannot be moved into its own subtree")
+
+        DATABASE.execute_in_transaction(*Folder.move_folder_statements(folder_id, new_parent_folder_id))
+
+    @staticmethod
+    def move_folder_statements(folder_id: int, new_parent_folder_id: int):
+        """(query, args) pairs that re-parent a folder and keep folder_closure in step."""
+        return (
+            ("""
+            DELETE FROM folder_closure
+            WHERE descendant_id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = ?)
+              AND ancestor_id NOT IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = ?)
+            """, (folder_id, folder_id)),
+            ("""
+            INSERT INTO folder_closure (ancestor_id, descendant_id, depth)
+            SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+            FROM folder_closure a, folder_closure d
+            WHERE a.descendant_id = ? AND d.ancestor_id = ?
+            """, (new_parent_folder_id, folder_id)),
+            ("""
+            UPDATE folders SET parent_folder_id = ? WHERE id = ?
+            """, (new_parent_folder_id, folder_id)),
+        )
+
+    @staticmethod
+    def remove_folder_tree(folder_id: int, new_folder_id: int = 1):
+        """Delete a folder with all its subfolders, moving their papers to new_folder_id."""
+        if Folder.is_in_subtree(new_folder_id, folder_id):
+            raise ValueError("Papers cannot be moved into the folder being removed")
+
+        DATABASE.execute_in_transaction(
+            ("""
+            UPDATE papers SET folder_id = ?
+            WHERE folder_id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = ?)
+            """, (new_folder_id, folder_id)),
+            ("""
+            DELETE FROM folders
+            WHERE id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = ?)
+            """, (folder_id,)),
+        )
 
     @staticmethod
     def get_folder_id_for_title(title: str):
         query = """
         SELECT id FROM folders WHERE folder_name = ? LIMIT 1
         """
-        return DATABASE.conn.execute(query, (title,)).fetchone()
+        return DATABASE.fetchone(query, (title,))
 
     @staticmethod
     def remove_folder(folder_id: int):
@@ -310,5 +1177,63 @@ class Folder:
         """
         DATABASE.execute_with_args(query, (folder_id,))
 
+
+@TRACER.traced_methods("sql")
+class Tag:
+
+    @staticmethod
+    def get_all_tags():
+        query = """
+        SELECT tag_name FROM tags ORDER BY tag_name
+        """
+        return DATABASE.fetchall(query)
+
+    @staticmethod
+    def get_all_paper_tags():
+        query = """
+        SELECT t.tag_name, pt.paper_id FROM paper_tags pt INNER JOIN tags t ON pt.tag_id = t.id
+        """
+        return DATABASE.iterate(query)
+
+    @staticmethod
+    def get_tags_for_paper(paper_id):
+        query = """
+        SELECT t.tag_name FROM paper_tags pt INNER JOIN tags t ON pt.tag_id = t.id
+        WHERE pt.paper_id = ? ORDER BY t.tag_name
+        """
+        return DATABASE.fetchall(query, (paper_id,))
+
+    @staticmethod
+    def set_tags_for_paper(paper_id, tag_names):
+        DATABASE.execute_in_transaction(
+            ("DELETE FROM paper_tags WHERE paper_id = ?", (paper_id,)),
+            *(("INSERT OR IGNORE INTO tags (tag_name) VALUES (?)", (tag_name,)) for tag_name in tag_names),
+            *(("""
+            INSERT OR IGNORE INTO paper_tags (paper_id, tag_id)
+            SELECT ?, id FROM tags WHERE tag_name = ?
+            """, (paper_id, tag_name)) for tag_name in tag_names),
+        )
+
+
+@TRACER.traced_methods("sql")
+class ReadingState:
+
+    @staticmethod
+    def get(paper_id: int):
+        """(page, page_offset, zoom) where the paper was left, None if it was never opened in the PDF viewer."""
+        query = """
+        SELECT page, page_offset, zoom FROM reading_state WHERE paper_id = ?
+        """
+        return DATABASE.fetchone(query, (paper_id,))
+
+    @staticmethod
+    def save(paper_id: int, page: int, page_offset: float, zoom):
+        query = """
+        INSERT OR REPLACE INTO reading_state (paper_id, page, page_offset, zoom, updated_at) VALUES (?, ?, ?, ?, ?)
+        """
+        DATABASE.execute_deferred(("reading_state", paper_id), query,
+                                  (paper_id, page, page_offset, zoom, datetime.datetime.now()))
+
+
 Folder.default_entries()
 Paper.default_entries()
\ No newline at end of file
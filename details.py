@@ -1,22 +1,32 @@
 from PyQt6.QtCore import Qt, pyqtSignal, QSize
 from PyQt6.QtGui import QIcon
 from PyQt6.QtWidgets import QFrame, QVBoxLayout, QLabel, QWidget, QTextEdit, QComboBox, QSizePolicy, \
-    QPushButton, QHBoxLayout, QStackedWidget
+    QPushButton, QHBoxLayout, QStackedWidget, QLineEdit, QListWidget, QListWidgetItem, QCheckBox
 
-from database import Paper, Folder
+from citations import CitationGraph
+from database import Paper, Folder, Tag
+from tag_index import TAG_INDEX
 
 
 class Details(QFrame):
     on_title_changed = pyqtSignal(str)
     on_category_changed = pyqtSignal(bool)
+    on_tags_changed = pyqtSignal(str)
+    on_paper_clicked = pyqtSignal(int)
+    on_paper_shown = pyqtSignal(int)
 
     def __init__(self):
         super().__init__()
 
         self.website_address_widget: QWidget = None
         self.category_combo = None
+        self.tags_value = None
+        self.related_list = None
+        self.cited_by_list = None
+        self.references_list = None
         self.website_url = None
         self.website_address_value = None
+        self.keep_offline_checkbox = None
         self.setStyleSheet("""
         Details { 
             background-color: #383a40;
@@ -48,8 +58,12 @@ class Details(QFrame):
 
         self.layout.addWidget(self.add_title(), alignment=Qt.AlignmentFlag.AlignTop)
         self.layout.addWidget(self.add_category(), alignment=Qt.AlignmentFlag.AlignTop)
+        self.layout.addWidget(self.add_tags(), alignment=Qt.AlignmentFlag.AlignTop)
         self.layout.addWidget(self.add_file_path(), alignment=Qt.AlignmentFlag.AlignTop)
         self.layout.addWidget(self.add_website_address(), alignment=Qt.AlignmentFlag.AlignTop)
+        self.layout.addWidget(self.add_related(), alignment=Qt.AlignmentFlag.AlignTop)
+        for citations_widget in self.add_citations():
+            self.layout.addWidget(citations_widget, alignment=Qt.AlignmentFlag.AlignTop)
 
         self.layout.addStretch(1)
 
@@ -196,6 +210,40 @@ class Details(QFrame):
 
         self.category_combo.blockSignals(False)
 
+    def add_tags(self):
+        tags_widget = QWidget()
+        tags_layout = QVBoxLayout(tags_widget)
+        tags_layout.setContentsMargins(0, 0, 0, 0)
+        tags_layout.setSpacing(0)
+
+        tags_label = QLabel("Tags")
+        tags_label.setStyleSheet("""
+        padding: 0px;
+        font: 24px sans-serif;
+        font-weight: bold;
+        """)
+        tags_label.setFixedHeight(40)
+        tags_layout.addWidget(tags_label)
+
+        self.tags_value = QLineEdit()
+        self.tags_value.setPlaceholderText("comma, separated, tags")
+        self.tags_value.setStyleSheet("""
+            background-color: #232328;
+            padding: 2px;
+            border: 1px solid #555;
+            border-radius: 6px;
+        """)
+        self.tags_value.editingFinished.connect(self.update_tags)
+        tags_layout.addWidget(self.tags_value)
+        return tags_widget
+
+    def update_tags(self):
+        if self.paper_id is None:
+            return
+        value = self.tags_value.text()
+        TAG_INDEX.set_paper_tags(self.paper_id, value.split(","))
+        self.on_tags_changed.emit(value)
+
     def add_file_path(self):
         file_path_widget = QWidget()
         file_path_layout = QVBoxLayout(file_path_widget)
@@ -225,8 +273,19 @@ class Details(QFrame):
         self.file_path_value.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
         self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
         file_path_layout.addWidget(self.file_path_value)
+
+        # Pinned downloads are never deleted to stay under the storage quota
+        self.keep_offline_checkbox = QCheckBox("Keep offline")
+        self.keep_offline_checkbox.toggled.connect(self.update_keep_offline)
+        file_path_layout.addWidget(self.keep_offline_checkbox)
         return file_path_widget
 
+    def update_keep_offline(self, checked: bool):
+        from storage import Storage
+
+        if self.paper_id is not None:
+            Storage.pin(self.paper_id, checked)
+
 
     def add_website_address(self):
         self.website_address_widget: QWidget = QWidget()
@@ -259,6 +318,61 @@ class Details(QFrame):
         website_address_layout.addWidget(self.website_address_value)
         return self.website_address_widget
 
+    def _add_paper_list(self, title: str):
+        list_widget_container = QWidget()
+        list_layout = QVBoxLayout(list_widget_container)
+        list_layout.setContentsMargins(0, 0, 0, 0)
+        list_layout.setSpacing(0)
+
+        list_label = QLabel(title)
+        list_label.setStyleSheet("""
+            padding: 0px;
+            font: 24px sans-serif;
+            font-weight: bold;
+        """)
+        list_label.setFixedHeight(40)
+        list_layout.addWidget(list_label)
+
+        paper_list = QListWidget()
+        paper_list.setStyleSheet("""
+            background-color: #232328;
+            padding: 2px;
+            border: 1px solid #555;
+            border-radius: 6px;
+        """)
+        paper_list.setWordWrap(True)
+        paper_list.setFixedHeight(120)
+        paper_list.itemClicked.connect(lambda item: self.on_paper_clicked.emit(item.data(Qt.ItemDataRole.UserRole)))
+        list_layout.addWidget(paper_list)
+        return list_widget_container, paper_list
+
+    def add_related(self):
+        related_widget, self.related_list = self._add_paper_list("Related")
+        return related_widget
+
+    def add_citations(self):
+        cited_by_widget, self.cited_by_list = self._add_paper_list("Cited by in my library")
+        references_widget, self.references_list = self._add_paper_list("References in my library")
+        return cited_by_widget, references_widget
+
+    def update_related(self):
+        # numpy is only needed once a paper is shown, keep it off the startup path
+        from related_papers import RELATED_INDEX
+
+        self.related_list.clear()
+        for related_id, title, score in RELATED_INDEX.related_papers(self.paper_id):
+            item = QListWidgetItem(title, self.related_list)
+            item.setData(Qt.ItemDataRole.UserRole, related_id)
+            item.setToolTip(f"Similarity {score:.2f}")
+
+    def update_citations(self):
+        for paper_list, papers in ((self.cited_by_list, CitationGraph.get_cited_by(self.paper_id)),
+                                   (self.references_list, CitationGraph.get_references(self.paper_id))):
+            paper_list.clear()
+            for paper_id, title in papers:
+                item = QListWidgetItem(title, paper_list)
+                item.setData(Qt.ItemDataRole.UserRole, paper_id)
+
     def update_title_fixed_height(self, n: int):
         self.title_value_stack.setFixedHeight(n)
         self.title_value_text_edit.setFixedHeight(n)
@@ -293,8 +407,21 @@ class Details(QFrame):
         self.category_combo.setCurrentIndex(self.categories.index(self.folder_name))
         self.file_path_value.setText(self.file_path)
         self.website_address_value.setText(self.website_url)
+        self.tags_value.setText(", ".join(tag_name for (tag_name,) in Tag.get_tags_for_paper(self.paper_id)))
 
         if self.website_url is None or len(self.website_url) == 0:
             self.website_address_widget.hide()
         else:
             self.website_address_widget.show()
+
+        from storage import Storage
+
+        # Only downloads that can be fetched again are ever evicted
+        self.keep_offline_checkbox.setVisible(bool(self.website_url) and not self.file_path.startswith(("http://", "https://")))
+        self.keep_offline_checkbox.blockSignals(True)
+        self.keep_offline_checkbox.setChecked(Storage.is_pinned(self.paper_id))
+        self.keep_offline_checkbox.blockSignals(False)
+
+        self.update_related()
+        self.update_citations()
+        self.on_paper_shown.emit(self.paper_id)
@@ -0,0 +1,83 @@
+from database import Paper
+
+# Typo-tolerant search: the FTS5 trigram index returns papers sharing any trigram with the query,
+# ranked by bm25, and the best candidates are re-ranked by how many of the query's trigrams they contain.
+# Papers containing the query verbatim are always listed; only the fuzzy expansion is capped at CANDIDATES.
+
+CANDIDATES = 200
+MIN_SIMILARITY = 0.3
+# Only the rarest trigrams of the query are looked up; common ones match most of the library and only cost time
+LOOKUP_TRIGRAMS = 8
+
+
+def normalize(text: str):
+    # Same separators the paper_search triggers turn into spaces
+    return " ".join(text.lower().replace("_", " ").replace("-", " ").replace(".", " ").split())
+
+
+def trigrams(text: str):
+    text = normalize(text)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def fts_query(query_trigrams):
+    return " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in sorted(query_trigrams))
+
+
+def fts_phrase(text: str):
+    # A trigram phrase matches its consecutive trigrams, i.e. the text as a substring
+    return '"' + normalize(text).replace('"', '""') + '"'
+
+
+def similarity(query_trigrams, text):
+    if not text:
+        return 0.0
+    text_trigrams = trigrams(text)
+    shared = len(query_trigrams & text_trigrams)
+    # Coverage of the query, with a small penalty for long titles so closer matches come first
+    return shared / len(query_trigrams) - 0.001 * len(text_trigrams - query_trigrams) / (len(text_trigrams) or 1)
+
+
+def article_text_query(text: str):
+    # Every word must appear in the article, each as a quoted string so FTS5 syntax is never interpreted
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def search(text: str, limit: int = CANDIDATES):
+    """
+    Return (id, title, folder_name, file_path) rows ranked by similarity, best first, followed by saved
+    articles whose text contains every word of the query.
+    """
+    results = search_titles(text, limit)
+    if text.split():
+        listed = {row[0] for row in results}
+        results += [row for row in Paper.search_article_text(article_text_query(text), limit) if row[0] not in listed]
+    return results
+
+
+def search_titles(text: str, limit: int = CANDIDATES):
+    query_trigrams = trigrams(text)
+    if not query_trigrams:
+        return Paper.search_paper(text)
+
+    document_counts = Paper.get_trigram_document_counts(list(query_trigrams))
+    lookup = sorted((trigram for trigram in query_trigrams if trigram in document_counts),
+                    key=document_counts.get)[:LOOKUP_TRIGRAMS]
+    if not lookup:
+        return []
+
+    # Verbatim matches cover every query trigram, so they lead, most recently viewed first like the plain search
+    exact = Paper.substring_search(fts_phrase(text))
+    listed = {row[0] for row in exact}
+
+    scored = []
+    for paper_id, title, folder_name, file_path, indexed_title, indexed_authors in Paper.fuzzy_search_candidates(
+            fts_query(lookup), limit):
+        if paper_id in listed:
+            continue
+        score = max(similarity(query_trigrams, indexed_title), similarity(query_trigrams, indexed_authors))
+        if score >= MIN_SIMILARITY:
+            scored.append((score, (paper_id, title, folder_name, file_path)))
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return exact + [row for _, row in scored]
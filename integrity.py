@@ -0,0 +1,190 @@
+import datetime
+import hashlib
+import os
+import sqlite3
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+import database
+
+# Library integrity: a low-priority worker thread stats every local file in batches, compares size and
+# mtime with the last scan and reports missing files. Missing files are looked for under the directories
+# the library already uses, matched by size first and then by a hash of their first and last blocks.
+
+BATCH_SIZE = 200
+# Pause between batches so the scanner never competes with the UI for the disk
+BATCH_PAUSE_MS = 20
+HASH_BLOCK = 64 * 1024
+
+
+def content_hash(file_path: str, size: int):
+    digest = hashlib.sha256(str(size).encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read(HASH_BLOCK))
+        if size > 2 * HASH_BLOCK:
+            f.seek(-HASH_BLOCK, os.SEEK_END)
+            digest.update(f.read(HASH_BLOCK))
+    return digest.hexdigest()
+
+
+def check_file(paper_id: int, file_path: str, size, mtime, known_hash):
+    """Return (paper_id, status, size, mtime, content_hash) for one file; status is ok, changed or missing."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return paper_id, "missing", size, mtime, known_hash
+
+    if stat.st_size == size and stat.st_mtime == mtime and known_hash:
+        return paper_id, "ok", size, mtime, known_hash
+    try:
+        new_hash = content_hash(file_path, stat.st_size)
+    except OSError:
+        return paper_id, "missing", size, mtime, known_hash
+    # First sight of a file is not a change
+    status = "ok" if size is None or new_hash == known_hash else "changed"
+    return paper_id, status, stat.st_size, stat.st_mtime, new_hash
+
+
+def known_roots(file_paths):
+    """
+    Directories to look for moved files in: the parent of every directory holding library files, so that
+    moves between sibling folders are found, but never the home directory or anything above it.
+    """
+    home = os.path.expanduser("~")
+    directories = set()
+    for directory in {os.path.dirname(file_path) for file_path in file_paths}:
+        parent = os.path.dirname(directory)
+        too_wide = parent == os.path.dirname(parent) or os.path.commonpath([parent, home]) == parent
+        directories.add(directory if too_wide else parent)
+
+    roots = []
+    for directory in sorted(directories):
+        if not roots or os.path.commonpath([roots[-1], directory]) != roots[-1]:
+            roots.append(directory)
+    return [root for root in roots if os.path.isdir(root)]
+
+
+def find_moved(missing, roots, library_paths):
+    """Return [(paper_id, new_path)] for missing (paper_id, size, content_hash) files found under roots."""
+    wanted = {}
+    for paper_id, size, known_hash in missing:
+        if size is not None and known_hash:
+            wanted.setdefault(size, {})[known_hash] = paper_id
+
+    found = []
+    for root in roots:
+        for parent_directory, _, files in os.walk(root):
+            for file in files:
+                file_path = os.path.join(parent_directory, file)
+                if file_path in library_paths:
+                    continue
+                try:
+                    size = os.path.getsize(file_path)
+                    if size not in wanted:
+                        continue
+                    paper_id = wanted[size].pop(content_hash(file_path, size), None)
+                except OSError:
+                    continue
+                if paper_id is not None:
+                    found.append((paper_id, file_path))
+    return found
+
+
+class Integrity:
+
+    @staticmethod
+    def get_local_files():
+        query = """
+        SELECT p.id, p.file_path, c.size, c.mtime, c.content_hash
+        FROM papers p
+        LEFT JOIN file_checks c ON c.paper_id = p.id
+        WHERE p.is_active = TRUE AND p.file_path NOT LIKE 'http://%' AND p.file_path NOT LIKE 'https://%'
+              AND p.id NOT IN (SELECT paper_id FROM cold_files)
+        """
+        return database.DATABASE.fetchall(query)
+
+    @staticmethod
+    def store_results(results: list):
+        checked_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        query = """
+        INSERT OR REPLACE INTO file_checks (paper_id, status, size, mtime, content_hash, checked_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """
+        database.DATABASE.execute_in_transaction(*((query, (*result, checked_at)) for result in results))
+
+    @staticmethod
+    def relocate(paper_id: int, file_path: str):
+        try:
+            database.DATABASE.execute_in_transaction(
+                ("UPDATE papers SET file_path = ? WHERE id = ?", (file_path, paper_id)),
+                ("UPDATE file_checks SET status = 'ok' WHERE paper_id = ?", (paper_id,)),
+            )
+        except sqlite3.IntegrityError as e:
+            print(f"Error: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def get_dead_ids():
+        """Papers whose file is gone and cannot be downloaded again."""
+        query = """
+        SELECT c.paper_id
+        FROM file_checks c
+        INNER JOIN papers p ON p.id = c.paper_id
+        WHERE c.status = 'missing' AND p.website_url IS NULL AND p.is_active = TRUE
+        """
+        return {paper_id for (paper_id,) in database.DATABASE.fetchall(query)}
+
+    @staticmethod
+    def mark_missing(paper_id: int):
+        # Papers opened before the first scan have no file_checks row yet
+        checked_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        query = """
+        INSERT INTO file_checks (paper_id, status, checked_at) VALUES (?, 'missing', ?)
+        ON CONFLICT (paper_id) DO UPDATE SET status = 'missing', checked_at = excluded.checked_at
+        """
+        database.DATABASE.execute_with_args(query, (paper_id, checked_at))
+
+    @staticmethod
+    def summary():
+        """Counts of local files per status, plus unchecked and missing-but-downloadable files."""
+        query = """
+        SELECT CASE WHEN c.status IS NULL THEN 'unchecked'
+                    WHEN c.status = 'missing' AND p.website_url IS NOT NULL THEN 'missing-downloadable'
+                    ELSE c.status END,
+               COUNT(*)
+        FROM papers p
+        LEFT JOIN file_checks c ON c.paper_id = p.id
+        WHERE p.is_active = TRUE AND p.file_path NOT LIKE 'http://%' AND p.file_path NOT LIKE 'https://%'
+              AND p.id NOT IN (SELECT paper_id FROM cold_files)
+        GROUP BY 1
+        """
+        summary = {"ok": 0, "changed": 0, "missing": 0, "missing-downloadable": 0, "unchecked": 0}
+        summary.update(database.DATABASE.fetchall(query))
+        return summary
+
+
+class IntegrityScanner(QThread):
+    """Checks files off the GUI thread; the receiver writes the results on the GUI thread."""
+
+    BatchChecked = pyqtSignal(list)
+    Relocated = pyqtSignal(list)
+
+    def __init__(self, files, parent=None):
+        super().__init__(parent)
+        self.files = files
+
+    def run(self):
+        missing = []
+        for start in range(0, len(self.files), BATCH_SIZE):
+            if self.isInterruptionRequested():
+                return
+            results = [check_file(*file) for file in self.files[start:start + BATCH_SIZE]]
+            missing += [(paper_id, size, known_hash)
+                        for paper_id, status, size, _, known_hash in results if status == "missing"]
+            self.BatchChecked.emit(results)
+            self.msleep(BATCH_PAUSE_MS)
+
+        if missing and not self.isInterruptionRequested():
+            library_paths = {file_path for _, file_path, *_ in self.files}
+            self.Relocated.emit(find_moved(missing, known_roots(library_paths), library_paths))
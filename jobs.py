@@ -0,0 +1,274 @@
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from PyQt6.QtCore import QObject, QRunnable, QThread, QThreadPool, QTimer, pyqtSignal
+
+from tracing import TRACER
+
+# Background jobs: downloads, scraping and imports run on a shared thread pool instead of the GUI thread.
+# Jobs are started in priority order, each resource class has its own concurrency cap, and background
+# priorities always leave one slot of a class free so that opening a paper never waits behind a prefetch.
+# The job function runs on a worker and must not touch the database; on_done runs on the GUI thread.
+# CPU-bound Python would hold the GIL the GUI thread needs, so such jobs hand it to worker processes
+# with run_in_process and only wait on their pool thread. Those are spawned rather than forked: a fork of
+# this multithreaded process could inherit a lock some other thread holds and hang on it.
+
+OPEN, USER, PREFETCH, INDEX = range(4)
+PRIORITY_NAMES = {OPEN: "open", USER: "user", PREFETCH: "prefetch", INDEX: "index"}
+
+RESOURCE_LIMITS = {
+    "network": 4,
+    "disk": 2,
+    "cpu": max(1, (os.cpu_count() or 1) - 1),
+}
+
+QUEUED, RUNNING, RETRYING, DONE, FAILED, CANCELLED = "queued", "running", "retrying", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+RETRY_DELAY_MS = 2000
+# How often a job waiting on a worker process checks whether it was cancelled
+PROCESS_POLL_S = 0.2
+# Finished jobs kept for the jobs panel
+HISTORY = 100
+THROUGHPUT_WINDOW = 60
+
+JOB_IDS = itertools.count(1)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    One unit of background work. function(job) runs on a worker thread and reports progress through
+    job.report(done, total), which raises JobCancelled once the job is cancelled. Unlisted jobs (page renders)
+    are scheduled like the others but kept out of the jobs panel and its counts.
+    """
+
+    def __init__(self, title: str, function, priority: int = USER, resource: str = "network", retries: int = 2,
+                 unit: str = "B", on_done=None, on_failed=None, listed: bool = True):
+        self.id = next(JOB_IDS)
+        self.title = title
+        self.function = function
+        self.priority = priority
+        self.resource = resource
+        self.retries = retries
+        self.unit = unit
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.listed = listed
+
+        self.state = QUEUED
+        self.attempts = 0
+        self.done_items = 0
+        self.total_items = None
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.cancelled = threading.Event()
+
+    def report(self, done: int, total=None):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        self.done_items, self.total_items = done, total
+
+    def progress(self):
+        """Fraction done, None when the total is unknown."""
+        if self.state == DONE:
+            return 1.0
+        return min(1.0, self.done_items / self.total_items) if self.total_items else None
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def throughput(self):
+        """Units per second since the last attempt started."""
+        elapsed = self.elapsed()
+        return self.done_items / elapsed if elapsed > 0 else 0.0
+
+
+class JobRunner(QRunnable):
+
+    def __init__(self, scheduler, job: Job):
+        super().__init__()
+        self.scheduler = scheduler
+        self.job = job
+
+    def run(self):
+        # Pool threads are reused, so the priority is set for every job
+        background = self.job.priority >= PREFETCH
+        QThread.currentThread().setPriority(QThread.Priority.LowPriority if background else
+                                            QThread.Priority.NormalPriority)
+        if TRACER.enabled:
+            TRACER.name_thread("Job pool")
+        try:
+            if self.job.cancelled.is_set():
+                raise JobCancelled()
+            with TRACER.span(self.job.title, "job", {"priority": PRIORITY_NAMES[self.job.priority],
+                                                     "attempt": self.job.attempts}):
+                result, error = self.job.function(self.job), None
+        except Exception as e:
+            result, error = None, e
+        # Queued onto the GUI thread, where the scheduler lives
+        self.scheduler.Finished.emit(self.job, result, error)
+
+
+class JobScheduler(QObject):
+    JobChanged = pyqtSignal(object)
+    Finished = pyqtSignal(object, object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(sum(RESOURCE_LIMITS.values()))
+        # One heap per resource class, so that a full class is passed over without popping its queue
+        self.queues = {resource: [] for resource in RESOURCE_LIMITS}
+        self.running = dict.fromkeys(RESOURCE_LIMITS, 0)
+        self.jobs = deque()
+        self.finished_at = deque()
+        self.closed = False
+        self.processes = None
+        self.processes_lock = threading.Lock()
+        self.Finished.connect(self.finish)
+
+    def submit(self, job: Job):
+        if job.resource not in RESOURCE_LIMITS:
+            raise ValueError(f"Unknown resource class: {job.resource}")
+        if self.closed:
+            return job
+        if job.listed:
+            self.jobs.append(job)
+        self.enqueue(job)
+        return job
+
+    def enqueue(self, job: Job):
+        if job.cancelled.is_set():
+            return
+        job.state = QUEUED
+        heapq.heappush(self.queues[job.resource], (job.priority, job.id, job))
+        self.JobChanged.emit(job)
+        self.dispatch()
+
+    def limit(self, job: Job):
+        limit = RESOURCE_LIMITS[job.resource]
+        return limit - 1 if job.priority >= PREFETCH and limit > 1 else limit
+
+    def dispatch(self):
+        if self.closed:
+            return
+        for resource, queue in self.queues.items():
+            while queue:
+                job = queue[0][-1]
+                if job.state != QUEUED:
+                    heapq.heappop(queue)
+                    continue
+                # Lower priorities get no more slots than this one, so none of them could start either
+                if self.running[resource] >= self.limit(job):
+                    break
+                heapq.heappop(queue)
+                self.running[resource] += 1
+                job.state = RUNNING
+                job.attempts += 1
+                job.started_at, job.finished_at = time.monotonic(), None
+                job.done_items, job.total_items = 0, None
+                self.pool.start(JobRunner(self, job), -job.priority)
+                self.JobChanged.emit(job)
+
+    def finish(self, job: Job, result, error):
+        self.running[job.resource] -= 1
+        job.finished_at = time.monotonic()
+
+        if job.cancelled.is_set() or isinstance(error, JobCancelled):
+            job.state = CANCELLED
+        elif isinstance(error, OSError) and job.attempts <= job.retries and not self.closed:
+            # Network and disk errors are usually transient, everything else would fail again
+            job.state = RETRYING
+            job.error = error
+            print(f"{job.title} failed ({error}), retrying")
+            QTimer.singleShot(RETRY_DELAY_MS * 2 ** (job.attempts - 1), lambda: self.enqueue(job))
+        elif error is not None:
+            self.fail(job, error)
+        else:
+            job.state = DONE
+            job.error = None
+            if job.on_done is not None:
+                try:
+                    job.on_done(result)
+                except Exception as e:
+                    self.fail(job, e)
+
+        if job.state == DONE and job.listed:
+            self.finished_at.append(job.finished_at)
+        self.trim()
+        self.JobChanged.emit(job)
+        self.dispatch()
+
+    def fail(self, job: Job, error):
+        job.state = FAILED
+        job.error = error
+        print(f"{job.title} failed: {error}")
+        if job.on_failed is not None:
+            job.on_failed(error)
+
+    def cancel(self, job: Job):
+        """Queued jobs are dropped at once, running ones stop at their next progress report."""
+        job.cancelled.set()
+        if job.state in (QUEUED, RETRYING):
+            job.state = CANCELLED
+            job.finished_at = time.monotonic()
+            self.JobChanged.emit(job)
+
+    def trim(self):
+        finished = [job.id for job in self.jobs if job.state in FINISHED_STATES]
+        if len(finished) > HISTORY:
+            dropped = set(finished[:-HISTORY])
+            self.jobs = deque(job for job in self.jobs if job.id not in dropped)
+        while self.finished_at and self.finished_at[0] < time.monotonic() - THROUGHPUT_WINDOW:
+            self.finished_at.popleft()
+
+    def counts(self):
+        """Running and queued jobs, and jobs done in the last THROUGHPUT_WINDOW seconds."""
+        self.trim()
+        running = sum(job.state == RUNNING for job in self.jobs)
+        queued = sum(job.state in (QUEUED, RETRYING) for job in self.jobs)
+        return running, queued, len(self.finished_at)
+
+    def run_in_process(self, job: Job, function, *args):
+        """
+        Call function(*args) in a worker process from job's function and return its result. function must be
+        a top-level function of a module that imports without Qt, so that a fresh interpreter can load it.
+        Cancelling the job stops the wait, not the call.
+        """
+        with self.processes_lock:
+            if self.processes is None:
+                self.processes = ProcessPoolExecutor(max_workers=RESOURCE_LIMITS["cpu"],
+                                                     mp_context=multiprocessing.get_context("spawn"))
+        future = self.processes.submit(function, *args)
+        while True:
+            try:
+                return future.result(timeout=PROCESS_POLL_S)
+            except FutureTimeoutError:
+                if job.cancelled.is_set():
+                    future.cancel()
+                    raise JobCancelled()
+
+    def shutdown(self, timeout_ms: int = 3000):
+        """Cancel everything and give running jobs timeout_ms to notice."""
+        self.closed = True
+        for job in list(self.jobs):
+            self.cancel(job)
+        self.pool.clear()
+        with self.processes_lock:
+            if self.processes is not None:
+                self.processes.shutdown(wait=False, cancel_futures=True)
+        return self.pool.waitForDone(timeout_ms)
@@ -1,27 +1,82 @@
+from startup_timing import STARTUP_TIMER
+
+import json
 import sqlite3
 import sys
-import urllib.request as request
 import uuid
 from typing import Tuple
 
-from PyQt6.QtCore import Qt, QUrl, QFileInfo
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QHBoxLayout, QInputDialog, QTreeWidgetItem,
-                             QFileIconProvider, QFrame, QVBoxLayout, QLineEdit, QFileDialog, QStyle)
+if __name__ == "__main__":
+    # Hand paths and URLs to a running window before paying for the imports below
+    with STARTUP_TIMER.measure_import("single_instance"):
+        from single_instance import forward, parse_requests
+    if forward(parse_requests(sys.argv[1:])):
+        sys.exit(0)
+
+with STARTUP_TIMER.measure_import("PyQt6"):
+    from PyQt6.QtCore import Qt, QUrl, QFileInfo, QTimer, QCoreApplication, QThread, QEventLoop
+    from PyQt6.QtGui import QColor, QBrush
+    from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QHBoxLayout, QInputDialog, QTreeWidgetItem,
+                                 QFileIconProvider, QFrame, QVBoxLayout, QLineEdit, QFileDialog, QStyle,
+                                 QTreeWidgetItemIterator, QStackedWidget)
+
+with STARTUP_TIMER.measure_import("tracing"):
+    from tracing import TRACER, TRACE_ENV
+
+with STARTUP_TIMER.measure_import("database"):
+    import database
+    from database import Folder, backup
+    from query_log import QUERY_STATS_ENV
+
+with STARTUP_TIMER.measure_import("utils"):
+    from utils import *
+
+with STARTUP_TIMER.measure_import("custom_widget"):
+    from custom_widget import WarningDialog
+
+with STARTUP_TIMER.measure_import("details"):
+    from details import Details
+
+with STARTUP_TIMER.measure_import("input_window"):
+    from input_window import InputWebsite
 
-from custom_widget import WarningDialog
-from database import Folder
-from details import Details
-from input_window import InputWebsite
-from save_article import save_open_page
-from tree_widget import TreeWidget
-from utils import *
-from viewer import Viewer
+with STARTUP_TIMER.measure_import("fuzzy_search"):
+    import fuzzy_search
+
+with STARTUP_TIMER.measure_import("tag_index"):
+    from tag_index import TAG_INDEX
+
+with STARTUP_TIMER.measure_import("tree_widget"):
+    from tree_widget import TreeWidget, FOLDER_ROLE, COLLECTION_ROLE
+
+with STARTUP_TIMER.measure_import("citations"):
+    from citations import CitationGraph, SCAN_CHUNK, read_references
+
+with STARTUP_TIMER.measure_import("integrity"):
+    from integrity import Integrity, IntegrityScanner
+
+with STARTUP_TIMER.measure_import("smart_collection"):
+    from smart_collection import SmartCollection
+
+with STARTUP_TIMER.measure_import("jobs"):
+    from jobs import FINISHED_STATES, Job, JobScheduler, OPEN, USER, INDEX
+
+with STARTUP_TIMER.measure_import("watchdog"):
+    from watchdog import Watchdog
 
 
 class PaperFlux(QMainWindow):
     def __init__(self):
         super().__init__()
         self.website_menu = None
+        self.library_children = {}
+        self.library_papers = {}
+        self.library_counts = None
+        self.library_expand = False
+        self.library_last_viewed_paper_id = None
+        self.library_icons = (None, None)
+        self.search_text = ""
+        self.tag_filter_text = ""
         self.setWindowTitle("PaperFlux")
         self.resize(1200, 800)
         self.side_window_width = 250
@@ -63,6 +118,18 @@ class PaperFlux(QMainWindow):
         search.setFixedHeight(30)
         frame_layout.addWidget(search)
 
+        self.tag_filter = QLineEdit()
+        self.tag_filter.setPlaceholderText("Tags: ml vision|nlp -survey")
+        self.tag_filter.setStyleSheet("""
+        background-color: #383a40;
+        border: 1px solid #4f545c;
+        border-radius: 12px;
+        padding: 8px;
+        """)
+        self.tag_filter.textChanged.connect(self.filter_tags)
+        self.tag_filter.setFixedHeight(30)
+        frame_layout.addWidget(self.tag_filter)
+
 
         self.tree_widget = TreeWidget()
         self.tree_widget.setStyleSheet("""
@@ -73,8 +140,21 @@ class PaperFlux(QMainWindow):
         """)
         frame_layout.addWidget(self.tree_widget)
 
-        # Web View
-        self.viewer = Viewer()
+        # Web View, created after the first paint (QtWebEngine is the slowest part of startup)
+        self.viewer = None
+        self.pdf_viewer = None
+        self.viewer_stack = None
+        self.viewer_placeholder = QWidget()
+        self.first_paint_done = False
+        self.citation_jobs = []
+        self.integrity_scanner = None
+        self.pending_requests = []
+        self.instance_server = None
+        self.dead_paper_ids = Integrity.get_dead_ids()
+        self.jobs = JobScheduler(self)
+        self.open_downloads = {}
+        self.eviction = None
+        self.sync_job = None
 
         # Right Widget
         self.right_container = Details()
@@ -83,44 +163,408 @@ class PaperFlux(QMainWindow):
         self.right_container.setContentsMargins(0, 0, 0, 0)
         self.right_container.on_title_changed.connect(lambda _: self.load_full_library())
         self.right_container.on_category_changed.connect(lambda _: self.load_full_library())
+        self.right_container.on_tags_changed.connect(lambda _: self.tag_filter_text and self.refresh_library())
 
+        self.tree_widget.FolderExpanded.connect(self.populate_folder)
+        self.tree_widget.CollectionExpanded.connect(self.populate_collection)
         self.tree_widget.ItemChanged.connect(self.render_item)
         self.tree_widget.ItemChanged.connect(self.right_container.update_display)
+        self.right_container.on_paper_clicked.connect(self.render_item)
+        self.right_container.on_paper_clicked.connect(self.right_container.update_display)
+        self.right_container.on_paper_shown.connect(lambda _: self.index_related_papers())
 
+        self.main_layout = main_layout
         main_layout.addWidget(self.left_container)
 
-        main_layout.addWidget(self.viewer)
+        main_layout.addWidget(self.viewer_placeholder, stretch=1)
         main_layout.addWidget(self.right_container)
 
+        from custom_widget import JobsPanel
+
+        self.jobs_panel = JobsPanel(self.jobs, self)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.jobs_panel)
+        self.jobs_panel.hide()
+
         self.init_menu_bar()
 
+        # Commit the queued last_view, title, category and reading position writes no read has flushed yet
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setInterval(1000)
+        self.flush_timer.timeout.connect(lambda: database.DATABASE.flush())
+        self.flush_timer.start()
+        QApplication.instance().applicationStateChanged.connect(lambda _: database.DATABASE.flush())
+
+        # Logs the stack of the GUI thread whenever the event loop stops running, when PAPERFLUX_STALL_MS is set
+        self.watchdog = Watchdog()
+        self.watchdog.start(self)
+
         self.load_full_library()
+
+    def paintEvent(self, a0):
+        super().paintEvent(a0)
+        if not self.first_paint_done:
+            self.first_paint_done = True
+            STARTUP_TIMER.mark("first paint")
+            QTimer.singleShot(0, self.deferred_startup)
+
+    def deferred_startup(self):
+        backup()
+        self.ensure_viewer()
+        STARTUP_TIMER.mark("viewer ready")
         self.load_last_paper()
+        self.handle_requests(self.pending_requests)
+        STARTUP_TIMER.mark("last paper loaded")
+        STARTUP_TIMER.report()
+        self.extract_citations()
+        self.evict_downloads()
+        self.archive_cold_files()
+        self.scan_library()
+        self.sync_library()
+
+    def sync_library(self, on_failed=None):
+        """
+        Exchange changes with the configured shared directory or sync server, if there is one, in a background
+        job. Returns the job, or None when there is no sync target.
+        """
+        from sync import exchange, get_target, prepare
+
+        if self.sync_job is not None and self.sync_job.state not in FINISHED_STATES:
+            return self.sync_job
+        if get_target() is None:
+            return None
+        try:
+            transport, replica, pulled_seqs, lines = prepare()
+        except Exception as e:
+            print(f"Sync failed: {e}")
+            if on_failed is not None:
+                on_failed(e)
+            return None
+        self.sync_job = self.jobs.submit(Job(
+            "Sync",
+            lambda job: exchange(transport, replica, pulled_seqs, lines, lambda: job.report(0)),
+            priority=USER,
+            resource="network",
+            on_done=lambda exchanged: self.synced(replica, *exchanged, lines),
+            on_failed=on_failed,
+        ))
+        return self.sync_job
+
+    def synced(self, replica, pulled, pushed, lines):
+        from sync import finish
+
+        for result in finish(replica, pulled, pushed, lines):
+            print(f"Sync: {result['status']} {result['changes']} changes ({result['bytes']} bytes)")
+        if pulled:
+            self.load_full_library()
+
+    def dialog_to_sync(self):
+        from sync import Sync, get_target
+
+        if get_target() is None:
+            text, ok = QInputDialog.getText(self, "Sync", "Shared directory or sync server URL:")
+            if not ok or text == "":
+                return
+            Sync.set_state("target", text)
+        self.sync_library(on_failed=lambda _: WarningDialog("Sync failed, see the log for details").exec())
+
+    def wait_for_job(self, job, timeout_ms: int):
+        """Run the event loop until job has finished, for at most timeout_ms."""
+        if job.state in FINISHED_STATES:
+            return
+        loop = QEventLoop()
+        quit_when_finished = lambda changed: changed is job and job.state in FINISHED_STATES and loop.quit()
+        self.jobs.JobChanged.connect(quit_when_finished)
+        QTimer.singleShot(timeout_ms, loop.quit)
+        loop.exec()
+        self.jobs.JobChanged.disconnect(quit_when_finished)
+
+    def scan_library(self):
+        if self.integrity_scanner is not None and self.integrity_scanner.isRunning():
+            return self.integrity_scanner
+        self.integrity_scanner = IntegrityScanner(Integrity.get_local_files(), self)
+        # Connected to methods of the window so the writes are queued onto the GUI thread
+        self.integrity_scanner.BatchChecked.connect(self.store_file_checks)
+        self.integrity_scanner.Relocated.connect(self.relocate_files)
+        self.integrity_scanner.finished.connect(self.mark_dead_items)
+        self.integrity_scanner.start(QThread.Priority.LowestPriority)
+        return self.integrity_scanner
+
+    def store_file_checks(self, results):
+        Integrity.store_results(results)
+
+    def relocate_files(self, moved):
+        for paper_id, file_path in moved:
+            if Integrity.relocate(paper_id, file_path):
+                print(f"Found moved file for paper {paper_id} at {file_path}")
+        if moved and self.right_container.paper_id is not None:
+            self.right_container.update_display(self.right_container.paper_id)
+
+    def mark_dead_items(self):
+        self.dead_paper_ids = Integrity.get_dead_ids()
+        iterator = QTreeWidgetItemIterator(self.tree_widget)
+        while item := iterator.value():
+            if (paper_id := item.data(0, Qt.ItemDataRole.UserRole)) is not None:
+                self.set_item_dead(item, paper_id in self.dead_paper_ids)
+            iterator += 1
+
+    def set_item_dead(self, item: QTreeWidgetItem, dead: bool):
+        if dead:
+            style = QApplication.style()
+            item.setIcon(0, style.standardIcon(style.StandardPixmap.SP_MessageBoxWarning))
+            item.setForeground(0, QColor("#8a8d93"))
+            item.setToolTip(0, "File not found")
+        elif item.toolTip(0):
+            item.setForeground(0, QBrush())
+            item.setToolTip(0, "")
+
+    def evict_downloads(self):
+        """Bring the downloads back under quota in a background job; the database is only read and checked here."""
+        from storage import Storage, quota_bytes, set_aside
+
+        if self.eviction is not None and self.eviction.state not in FINISHED_STATES:
+            return
+        papers, quota, keep = Storage.get_eviction_candidates(), quota_bytes(), {self.right_container.paper_id}
+        self.eviction = self.jobs.submit(Job(
+            "Free download space",
+            lambda job: set_aside(papers, quota, keep),
+            priority=INDEX,
+            resource="disk",
+            retries=0,
+            on_done=self.evicted,
+        ))
+
+    def evicted(self, set_aside_files):
+        from storage import Storage
+
+        for paper_id, file_path, size in Storage.finish_eviction(set_aside_files):
+            print(f"Evicted {file_path} ({size / 1024 / 1024:.1f} MB), it is downloaded again when opened")
+
+    def archive_cold_files(self):
+        """Compress PDFs not opened for PAPERFLUX_COLD_DAYS into the cold archive, one background job each."""
+        from cold_storage import ColdStorage, cold_days, compress
+
+        if (days := cold_days()) is None:
+            return
+        current_paper_id = self.right_container.paper_id
+        for paper_id, file_path, last_view in ColdStorage.get_candidates(days):
+            if paper_id == current_paper_id:
+                continue
+            self.jobs.submit(Job(
+                f"Archive {os.path.basename(file_path)}",
+                lambda job, file_path=file_path: compress(file_path, job.report),
+                priority=INDEX,
+                resource="disk",
+                on_done=lambda archived, paper_id=paper_id, file_path=file_path, last_view=last_view:
+                    ColdStorage.store(paper_id, file_path, last_view, archived),
+            ))
+
+    def index_related_papers(self):
+        """Vectorize papers added or edited since the last run; the details pane shows the stored vectors meanwhile."""
+        from related_papers import RELATED_INDEX
+
+        RELATED_INDEX.backfill(
+            self.jobs,
+            on_done=lambda: self.right_container.paper_id is not None and self.right_container.update_related())
+
+    def extract_citations(self):
+        """Read the references of unscanned local PDFs in worker processes, SCAN_CHUNK papers per job."""
+        if any(job.state not in FINISHED_STATES for job in self.citation_jobs):
+            return
+        papers = CitationGraph.get_pending_scans()
+        self.citation_jobs = [self.jobs.submit(Job(
+            f"Read references of {len(chunk)} papers",
+            lambda job, chunk=chunk: self.read_references(job, chunk),
+            priority=INDEX,
+            resource="cpu",
+            retries=0,
+            unit="papers",
+            on_done=self.store_citations,
+        )) for chunk in (papers[start:start + SCAN_CHUNK] for start in range(0, len(papers), SCAN_CHUNK))]
+
+    def read_references(self, job, papers):
+        scanned = []
+        for done, (paper_id, arxiv_id, file_path) in enumerate(papers):
+            job.report(done, len(papers))
+            if (cited := self.jobs.run_in_process(job, read_references, file_path)) is not None:
+                scanned.append((paper_id, arxiv_id, cited))
+        return scanned
+
+    def store_citations(self, scanned):
+        for paper_id, arxiv_id, cited_arxiv_ids in scanned:
+            CitationGraph.store(paper_id, arxiv_id, cited_arxiv_ids)
+        if scanned and self.right_container.paper_id is not None:
+            self.right_container.update_citations()
+
+    def ensure_viewer(self):
+        if self.viewer is not None:
+            return self.viewer
+
+        with STARTUP_TIMER.measure_import("viewer"):
+            from viewer import Viewer
+
+        with STARTUP_TIMER.measure_import("pdf_viewer"):
+            from pdf_viewer import PdfViewer, PDF_VIEWER_ENV
+
+        # Local PDFs are shown by the paged viewer, which remembers where each one was left
+        self.viewer = Viewer()
+        self.viewer_stack = QStackedWidget()
+        self.viewer_stack.addWidget(self.viewer)
+        if os.environ.get(PDF_VIEWER_ENV) != "web":
+            self.pdf_viewer = PdfViewer(self.jobs)
+            self.viewer_stack.addWidget(self.pdf_viewer)
+        self.main_layout.replaceWidget(self.viewer_placeholder, self.viewer_stack)
+        self.main_layout.setStretchFactor(self.viewer_stack, 1)
+        self.viewer_placeholder.deleteLater()
+        self.viewer_placeholder = None
+        return self.viewer
+
+    def show_url(self, url: QUrl):
+        viewer = self.ensure_viewer()
+        self.viewer_stack.setCurrentWidget(viewer)
+        viewer.setUrl(url)
+
+    def show_file(self, paper_id, file_path):
+        """Open a local file, PDFs where the reader left them."""
+        self.ensure_viewer()
+        if self.pdf_viewer is not None and file_path.lower().endswith(".pdf") and \
+                self.pdf_viewer.open(paper_id, file_path):
+            self.viewer_stack.setCurrentWidget(self.pdf_viewer)
+            return
+        # Everything else, and PDFs QtPdf cannot read (password protected ones), in the web view
+        self.show_url(QUrl.fromLocalFile(file_path))
 
     def closeEvent(self, a0):
-        self.viewer.page().deleteLater()
-        self.viewer.deleteLater()
-        self.viewer.get_profile().deleteLater()
+        if self.instance_server is not None:
+            self.instance_server.close()
+        self.flush_timer.stop()
+        self.watchdog.stop()
+        if self.pdf_viewer is not None:
+            self.pdf_viewer.close_document()
+        database.DATABASE.flush()
+        if (sync_job := self.sync_library()) is not None:
+            from sync import CLOSE_TIMEOUT_MS
+
+            # Unpushed changes go out with the next sync if the network is slower than this
+            self.wait_for_job(sync_job, CLOSE_TIMEOUT_MS)
+        self.jobs.shutdown()
+        if self.integrity_scanner is not None:
+            self.integrity_scanner.requestInterruption()
+            self.integrity_scanner.wait()
+        database.DATABASE.flush()
+        if self.viewer is not None:
+            self.viewer.page().deleteLater()
+            self.viewer.deleteLater()
+            self.viewer.get_profile().deleteLater()
+        if stats_path := os.environ.get(QUERY_STATS_ENV):
+            with open(stats_path, "w") as f:
+                json.dump(database.DATABASE.query_log.as_dict(), f, indent=2)
         a0.accept()
 
     def search_paper(self, text):
         print('search_paper: ', text)
-        if text == "":
+        self.search_text = text
+        self.refresh_library()
+
+    def filter_tags(self, text):
+        self.tag_filter_text = text.strip()
+        self.refresh_library()
+
+    def refresh_library(self):
+        if self.search_text == "":
             self.load_full_library()
         else:
-            self.load_search_library(text)
+            self.load_search_library(self.search_text)
 
+    @TRACER.traced("ui")
     def render_item(self, paper_id):
         file_path = Paper.get_paper_path(paper_id)[0]
-        Paper.update_paper_last_view_date(paper_id)
+        # A `paperflux storage --evict` in another process must see the view of a download before choosing it
+        Paper.update_paper_last_view_date(paper_id, immediate=file_path.startswith(os.path.join(FILE_PATH, "")))
 
         if file_path.startswith(("https://", "http://")):
-            self.viewer.setUrl(QUrl(file_path))
+            self.show_url(QUrl(file_path))
         else:
-            if not os.path.exists(file_path):
-                url = Paper.get_url(paper_id)[0]
-                request.urlretrieve(url, file_path)
-            self.viewer.setUrl(QUrl.fromLocalFile(file_path))
+            with TRACER.span("exists", "fs", {"file_path": file_path}):
+                exists = os.path.exists(file_path)
+            if not exists:
+                from cold_storage import ColdStorage
+
+                if (archived := ColdStorage.get(paper_id)) is not None:
+                    self.open_archived(paper_id, file_path, *archived)
+                    return
+                url = Paper.get_url(paper_id)
+                if url is None or not url[0]:
+                    # Local-only paper whose file is gone, there is nothing to download it from
+                    Integrity.mark_missing(paper_id)
+                    self.mark_dead_items()
+                    WarningDialog(f"{file_path} was not found. It may have been moved or deleted.").exec()
+                    return
+
+                self.download_and_open(paper_id, url[0], file_path)
+                return
+            self.show_file(paper_id, file_path)
+
+    def download_and_open(self, paper_id, url, file_path):
+        """Download an evicted or missing file on the job pool and show it once it is there."""
+        from storage import download
+
+        if (pending := self.open_downloads.get(file_path)) is not None and pending.state not in FINISHED_STATES:
+            return
+
+        def opened(_):
+            # Only if the reader has not moved on to another paper meanwhile
+            if self.right_container.paper_id == paper_id:
+                self.show_file(paper_id, file_path)
+
+        self.open_downloads[file_path] = self.jobs.submit(Job(
+            f"Download {os.path.basename(file_path)}",
+            lambda job: download(url, file_path, job.report),
+            priority=OPEN,
+            resource="network",
+            on_done=opened,
+            on_failed=lambda e: WarningDialog(f"Could not download {os.path.basename(file_path)}: {e}").exec(),
+        ))
+
+    def open_archived(self, paper_id, file_path, archive_path, sha256, size):
+        """Show a file from the cold archive, decompressing it into the cache on the job pool first if needed."""
+        from cold_storage import cached_copy, extract
+
+        if (cache_path := cached_copy(archive_path, size)) is not None:
+            self.show_file(paper_id, cache_path)
+            return
+        if (pending := self.open_downloads.get(archive_path)) is not None and pending.state not in FINISHED_STATES:
+            return
+
+        def opened(cache_path):
+            # Only if the reader has not moved on to another paper meanwhile
+            if self.right_container.paper_id == paper_id:
+                self.show_file(paper_id, cache_path)
+
+        self.open_downloads[archive_path] = self.jobs.submit(Job(
+            f"Decompress {os.path.basename(file_path)}",
+            lambda job: extract(archive_path, sha256, size, job.report),
+            priority=OPEN,
+            resource="disk",
+            on_done=opened,
+            on_failed=lambda e: WarningDialog(f"Could not open the archived {os.path.basename(file_path)}: {e}").exec(),
+        ))
+
+    def refresh_live(self):
+        """Load the live page of the current article and update its offline snapshot."""
+        paper_id = self.right_container.paper_id
+        url = Paper.get_url(paper_id) if paper_id is not None else None
+        if url is None or not url[0]:
+            return
+        self.show_url(QUrl(url[0]))
+
+        file_path = Paper.get_paper_path(paper_id)[0]
+        if file_path.endswith(".html") and not file_path.startswith(("https://", "http://")):
+            from snapshot import save_snapshot
+
+            try:
+                Paper.set_article_text(paper_id, save_snapshot(url[0], file_path))
+            except Exception as e:
+                print(f"Could not refresh the offline copy of {url[0]}: {e}")
 
     def init_menu_bar(self):
         menu_bar = self.menuBar()
@@ -128,6 +572,15 @@ class PaperFlux(QMainWindow):
         # -- File
         file_menu = menu_bar.addMenu("File")
 
+        import_bibliography_action = file_menu.addAction("Import Bibliography")
+        import_bibliography_action.triggered.connect(self.import_bibliography)
+
+        export_bibliography_action = file_menu.addAction("Export Bibliography")
+        export_bibliography_action.triggered.connect(self.export_bibliography)
+
+        sync_action = file_menu.addAction("Sync Now")
+        sync_action.triggered.connect(self.dialog_to_sync)
+
         exit_action = file_menu.addAction("Exit")
         exit_action.triggered.connect(self.close)
 
@@ -137,6 +590,18 @@ class PaperFlux(QMainWindow):
         new_category_action = edit_menu.addAction("Add Category")
         new_category_action.triggered.connect(self.dialog_to_add_category)
 
+        # ## -- New Subcategory
+        new_subcategory_action = edit_menu.addAction("Add Subcategory")
+        new_subcategory_action.triggered.connect(self.dialog_to_add_subcategory)
+
+        # ## -- New Smart Collection
+        new_collection_action = edit_menu.addAction("Add Smart Collection")
+        new_collection_action.triggered.connect(self.dialog_to_add_collection)
+
+        # ## -- Move Category
+        move_category_action = edit_menu.addAction("Move Category")
+        move_category_action.triggered.connect(self.dialog_to_move_category)
+
         # ## -- Add arXiv pdf
         arxiv_add_action = edit_menu.addAction("Add PDF URL")
         arxiv_add_action.triggered.connect(self.add_arxiv_pdf)
@@ -169,6 +634,66 @@ class PaperFlux(QMainWindow):
         toggle_library_action.setShortcut("Ctrl+L")
         toggle_library_action.triggered.connect(self.toggle_library_action)
 
+        # ## -- Refresh Live
+        refresh_live_action = view_menu.addAction("Refresh Live")
+        refresh_live_action.setShortcut("Ctrl+Shift+R")
+        refresh_live_action.triggered.connect(self.refresh_live)
+
+        # ## -- Query Statistics
+        query_stats_action = view_menu.addAction("Query Statistics")
+        query_stats_action.triggered.connect(self.show_query_stats)
+
+        # ## -- Storage Usage
+        storage_usage_action = view_menu.addAction("Storage Usage")
+        storage_usage_action.triggered.connect(self.show_storage_usage)
+
+        # ## -- Library Health
+        library_health_action = view_menu.addAction("Library Health")
+        library_health_action.triggered.connect(self.show_library_health)
+
+        # ## -- Jobs
+        view_menu.addAction(self.jobs_panel.toggleViewAction())
+
+        # ## -- Record Trace
+        record_trace_action = view_menu.addAction("Record Trace")
+        record_trace_action.setCheckable(True)
+        record_trace_action.setChecked(TRACER.enabled)
+        record_trace_action.toggled.connect(self.record_trace)
+
+    def record_trace(self, recording: bool):
+        if recording:
+            TRACER.start()
+            return
+        TRACER.stop()
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Save Trace",
+            os.environ.get(TRACE_ENV, "paperflux-trace.json"),
+            "Chrome Trace (*.json)"
+        )
+        if file_path:
+            events = TRACER.export(file_path)
+            print(f"Wrote {events} trace events to {file_path}, open it in ui.perfetto.dev")
+
+    def show_query_stats(self):
+        from custom_widget import QueryStatsDialog
+
+        QueryStatsDialog().exec()
+
+    def show_library_health(self):
+        from custom_widget import HealthDialog
+
+        dialog = HealthDialog()
+        dialog.scan_requested.connect(lambda: self.scan_library().finished.connect(dialog.refresh))
+        if self.integrity_scanner is not None and self.integrity_scanner.isRunning():
+            self.integrity_scanner.finished.connect(dialog.refresh)
+        dialog.exec()
+
+    def show_storage_usage(self):
+        from custom_widget import StorageDialog
+
+        StorageDialog(keep={self.right_container.paper_id}).exec()
+
     def add_website(self):
         input_window = InputWebsite()
         input_window.website_data_submitted.connect(self.add_website_in_db)
@@ -193,26 +718,89 @@ class PaperFlux(QMainWindow):
 
     def remove_page_selected_item(self):
         selected_item: QTreeWidgetItem = self.tree_widget.selectedItems()[0]
-        text = selected_item.text(0)
-        if paper_id := Paper.get_paper_id_of_title(text):
-            Paper.soft_delete_row(paper_id[0])
+        if paper_id := selected_item.data(0, Qt.ItemDataRole.UserRole):
+            Paper.soft_delete_row(paper_id)
 
             if last_viewed_paper_id := Paper.get_last_viewed_paper():
                 self.render_item(last_viewed_paper_id[0])
 
-        elif (folder_id := Paper.get_folder_id_for_title(text)) and folder_id[0] != 1:
-            Paper.change_folder_id(folder_id[0], 1)
-            Folder.remove_folder(folder_id[0])
+        elif (folder_id := selected_item.data(0, FOLDER_ROLE)) and folder_id != 1:
+            Folder.remove_folder_tree(folder_id, 1)
+
+        elif (collection_id := selected_item.data(0, COLLECTION_ROLE)) is not None:
+            SmartCollection.remove(collection_id)
 
         self.load_full_library()
 
     def save_open_page(self):
-        url = self.viewer.url().toString()
-        save_open_page(url, folder_id=Paper.get_selected_folder_id()[0])
+        self.save_url(self.ensure_viewer().url().toString())
+
+    def handle_requests(self, requests):
+        """Open or add the paths and URLs passed on the command line or forwarded by a later launch."""
+        if self.viewer is None:
+            # Before deferred_startup, which would replace them with the last viewed paper
+            self.pending_requests += requests
+            return
+        self.pending_requests = []
+        self.showNormal()
+        self.raise_()
+        self.activateWindow()
+        for request in requests:
+            self.handle_request(request["command"], request["target"])
+
+    def handle_request(self, command, target):
+        is_url = target.startswith(("https://", "http://"))
+        if command == "add" and is_url:
+            self.save_url(target)
+            return
+        if command == "add":
+            from save_article import save_local_pdf
+
+            try:
+                save_local_pdf(target, folder_id=Paper.get_selected_folder_id()[0])
+            except sqlite3.IntegrityError:
+                pass
+            self.load_full_library()
+            self.extract_citations()
+
+        if (paper := Paper.get_id_title_and_folder_name_for_file_path(target)) is not None:
+            self.right_container.update_display(paper[0])
+            self.render_item(paper[0])
+        elif is_url:
+            self.show_url(QUrl(target))
+        else:
+            self.show_url(QUrl.fromLocalFile(target))
+
+    def save_url(self, url):
+        """Ask for the category here, download on the job pool, insert back on the GUI thread."""
+        from save_article import choose_folder_id, fetch_url
+
+        folder_id = choose_folder_id()
+        self.jobs.submit(Job(
+            f"Save {url}",
+            lambda job: fetch_url(url, job.report),
+            priority=USER,
+            resource="network",
+            on_done=lambda record: self.store_fetched(url, record, folder_id),
+        ))
+
+    def store_fetched(self, url, record, folder_id):
+        from save_article import store_record
+
+        if record is None:
+            print(f"Nothing to save at {url}")
+            return
+        try:
+            store_record(record, folder_id)
+        except sqlite3.IntegrityError as e:
+            print(f"Error: {e}")
+            return
         self.load_full_library()
+        self.evict_downloads()
+        self.extract_citations()
 
     def open_webpage(self, url):
-        return lambda : self.viewer.setUrl(QUrl(url))
+        return lambda : self.show_url(QUrl(url))
 
     def add_local_pdf(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -223,29 +811,23 @@ class PaperFlux(QMainWindow):
         )
 
         if file_path:
-            file_name = os.path.basename(file_path)
-            try:
+            from save_article import save_local_pdf
 
-                Paper.insert_row(
-                    arxiv_id=str(uuid.uuid4()),
-                    title=file_name,
-                    authors=None,
-                    abstract=None,
-                    file_path=file_path,
-                    website_url=None,
-                    folder_id=Paper.get_selected_folder_id()[0]
-                )
+            try:
+                save_local_pdf(file_path, folder_id=Paper.get_selected_folder_id()[0])
             except sqlite3.IntegrityError:
-
-                paper_id, title, folder_name = Paper.get_id_title_and_folder_name_for_file_path(file_path)
-
-
-                warning = WarningDialog(
-                    f"{title} already exists in category {folder_name}",
-                )
+                existing = Paper.get_id_title_and_folder_name_for_file_path(file_path)
+                if existing is None:
+                    warning = WarningDialog(f"{os.path.basename(file_path)} is already in the library")
+                else:
+                    paper_id, title, folder_name = existing
+                    warning = WarningDialog(
+                        f"{title} already exists in category {folder_name}",
+                    )
                 warning.exec()
 
             self.load_full_library()
+            self.extract_citations()
 
 
     def add_local_dir(self):
@@ -260,39 +842,110 @@ class PaperFlux(QMainWindow):
 
 
         if folder_path:
-            folder_name = os.path.basename(folder_path)
-            folder_id = Folder.get_folder_id_for_title(folder_name)
-            if folder_id is None:
-                Folder.insert_row(folder_name, 0)
-                folder_id = Folder.get_folder_id_for_title(folder_name)
-
-            folder_id = folder_id[0]
-
-            for (parent_directory, _, files) in os.walk(folder_path):
-                for file in (i for i in files if i.endswith(".pdf")):
-                    if Paper.get_paper_id_of_title(file.rstrip(".pdf")):
-                        continue
-
-                    try:
-                        Paper.insert_row(
-                            arxiv_id=str(uuid.uuid4()),
-                            title=file.rstrip(".pdf"),
-                            authors=None,
-                            abstract=None,
-                            file_path=os.path.join(parent_directory, file),
-                            website_url=None,
-                            folder_id=folder_id
-                        )
-                    except sqlite3.IntegrityError:
-                        pass
+            from save_article import local_directory_folder_id, scan_local_directory
+
+            folder_id = local_directory_folder_id(folder_path)
+            known_file_paths = Paper.get_file_paths_under(folder_path)
+            self.jobs.submit(Job(
+                f"Import {folder_path}",
+                lambda job: scan_local_directory(folder_path, known_file_paths, job.report),
+                priority=USER,
+                resource="disk",
+                retries=0,
+                unit="files",
+                on_done=lambda pairs: self.store_local_metadata(pairs, folder_id),
+            ))
+
+    def store_local_metadata(self, pairs, folder_id):
+        from save_article import save_local_metadata
+
+        for _ in save_local_metadata(pairs, folder_id):
+            pass
+        self.load_full_library()
+        self.extract_citations()
+
+
+    def import_bibliography(self):
+        file_path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Select Bibliography",
+            get_directory(),
+            "Bibliographies (*.bib *.bibtex *.ris *.json)"
+        )
+
+        if file_path:
+            from bibliography import Bibliography, GUI_BATCH_SIZE, read_new_records
+
+            batches = read_new_records(file_path, Bibliography.get_dedupe_keys(), batch_size=GUI_BATCH_SIZE)
+            self.import_batch(file_path, batches, {}, 0)
+
+    def import_batch(self, file_path, batches, folders, read):
+        """Read the next batch on the job pool and store it here, then go on with the one after it."""
+        def read_batch(job):
+            job.report(read)
+            return next(batches, None)
+
+        self.jobs.submit(Job(
+            f"Import {os.path.basename(file_path)}",
+            read_batch,
+            priority=USER,
+            resource="disk",
+            retries=0,
+            unit="entries",
+            on_done=lambda batch: self.store_batch(file_path, batches, folders, read, batch),
+            on_failed=lambda e: WarningDialog(f"Could not import {os.path.basename(file_path)}: {e}").exec(),
+        ))
+
+    def store_batch(self, file_path, batches, folders, read, batch):
+        from bibliography import store_rows
+
+        if batch is None:
             self.load_full_library()
+            self.extract_citations()
+            return
+        statuses, rows = batch
+        for _ in store_rows(rows, folders):
+            pass
+        self.import_batch(file_path, batches, folders, read + len(statuses) + len(rows))
 
+    def export_bibliography(self):
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self,
+            "Export Bibliography",
+            get_directory(),
+            "BibTeX (*.bib);;RIS (*.ris);;CSL-JSON (*.json)"
+        )
+
+        if file_path:
+            from bibliography import EXTENSIONS, export_file
+
+            extension = selected_filter[selected_filter.index("*") + 1:-1]
+            if os.path.splitext(file_path)[1].lower() not in EXTENSIONS:
+                file_path += extension
+            fmt = EXTENSIONS[os.path.splitext(file_path)[1].lower()]
+            connection = database.DATABASE.open_reader()
+
+            def export(job):
+                try:
+                    with open(file_path, "w", encoding="utf-8") as out:
+                        return export_file(out, fmt, connection=connection, progress=job.report)
+                finally:
+                    connection.close()
+
+            self.jobs.submit(Job(
+                f"Export {os.path.basename(file_path)}",
+                export,
+                priority=USER,
+                resource="disk",
+                retries=0,
+                unit="entries",
+                on_failed=lambda e: WarningDialog(f"Could not export {os.path.basename(file_path)}: {e}").exec(),
+            ))
 
     def add_arxiv_pdf(self):
         text, ok = QInputDialog.getText(self, "Add Article URL", "Paste arXiv or medium or any other article URL here:")
         if ok and text != "":
-            save_open_page(text, folder_id=Paper.get_selected_folder_id()[0])
-            self.load_full_library()
+            self.save_url(text)
 
     def dialog_to_add_category(self):
         text, ok = QInputDialog.getText(self, "Add New Category",
@@ -301,6 +954,52 @@ class PaperFlux(QMainWindow):
             self.tree_widget.get_category(text)
             Folder.insert_row(text, 0)
 
+    def selected_folder_id(self):
+        for item in self.tree_widget.selectedItems():
+            if (folder_id := item.data(0, FOLDER_ROLE)) is not None:
+                return folder_id
+            if item.parent() is not None and (folder_id := item.parent().data(0, FOLDER_ROLE)) is not None:
+                return folder_id
+        return None
+
+    def dialog_to_add_subcategory(self):
+        parent_folder_id = self.selected_folder_id()
+        if parent_folder_id is None:
+            WarningDialog("Select a category first").exec()
+            return
+
+        text, ok = QInputDialog.getText(self, "Add New Subcategory",
+                                        "Please enter a new subcategory.")
+        if ok and text != "":
+            Folder.insert_row(text, parent_folder_id)
+            self.load_full_library()
+
+    def dialog_to_add_collection(self):
+        from custom_widget import SmartCollectionDialog
+
+        dialog = SmartCollectionDialog()
+        if dialog.exec() and dialog.name.text():
+            try:
+                SmartCollection.insert_row(dialog.name.text(), dialog.rules())
+            except (sqlite3.IntegrityError, ValueError) as e:
+                WarningDialog(f"Could not add the collection: {e}").exec()
+            self.load_full_library()
+
+    def dialog_to_move_category(self):
+        folder_id = self.selected_folder_id()
+        if folder_id is None:
+            WarningDialog("Select a category first").exec()
+            return
+
+        top_level = "(Top level)"
+        folders = {folder_name: other_id for other_id, folder_name, _ in Folder.get_folder_tree()
+                   if not Folder.is_in_subtree(other_id, folder_id)}
+        text, ok = QInputDialog.getItem(self, "Move Category", "Move the selected category under:",
+                                        [top_level, *folders], editable=False)
+        if ok:
+            Folder.move_folder(folder_id, 0 if text == top_level else folders[text])
+            self.load_full_library()
+
     def load_last_paper(self):
         paper_id = Paper.get_last_viewed_paper()
         if paper_id is None:
@@ -309,22 +1008,27 @@ class PaperFlux(QMainWindow):
         self.right_container.update_display(paper_id)
         self.render_item(paper_id)
 
+    @TRACER.traced("ui")
     def load_full_library(self):
         paper = Paper.get_all_papers()
         if not paper:
             return None
-        return self.load_library(paper)
+        if self.tag_filter_text:
+            return self.load_library(TAG_INDEX.filter_papers(paper, self.tag_filter_text), expand=True)
+        return self.load_library(paper, counts=Folder.get_subtree_paper_counts())
 
+    @TRACER.traced("ui")
     def load_search_library(self, title: str):
-        paper = Paper.search_paper(title)
+        paper = fuzzy_search.search(title)
         if not paper:
             return None
+        paper = TAG_INDEX.filter_papers(paper, self.tag_filter_text)
         return self.load_library(paper, add_recent=False, expand=True)
 
-    def load_library(self, paper: list, add_recent: bool = True, expand: bool = False):
+    @TRACER.traced("ui")
+    def load_library(self, paper: list, add_recent: bool = True, expand: bool = False, counts: dict = None):
 
         self.tree_widget.clear()
-        categories = {}
 
         last_viewed_paper_id = Paper.get_last_viewed_paper()
 
@@ -334,8 +1038,9 @@ class PaperFlux(QMainWindow):
         if add_recent:
             last_n_papers = Paper.get_last_n_viewed_papers()
             recent_category = self.tree_widget.get_category("Recent", expand=expand)
+            listed_paper_ids = {p[0] for p in paper}
             for last_paper in last_n_papers:
-                if any(last_paper[1] == p[1] for p in paper):
+                if last_paper[0] in listed_paper_ids:
                     self.add_tree_widget_item(
                         category=recent_category,
                         paper_id=last_paper[0],
@@ -346,21 +1051,66 @@ class PaperFlux(QMainWindow):
                         style=style
                     )
 
-        folder_list = Folder.get_all_folders()
-        for (folder_name, ) in folder_list:
-            categories[folder_name] = self.tree_widget.get_category(folder_name, expand=expand)
+        # Folder items are created level by level when expanded, see populate_folder
+        folder_ids = {}
+        self.library_children = {}
+        for folder_id, folder_name, parent_folder_id in Folder.get_folder_tree():
+            folder_ids[folder_name] = folder_id
+            self.library_children.setdefault(parent_folder_id, []).append((folder_id, folder_name))
+
+        if add_recent:
+            for collection_id, collection_name, _, _ in SmartCollection.get_all_collections():
+                self.tree_widget.get_collection(collection_name, collection_id)
 
+        self.library_papers = {}
         for paper_id, title, folder_name, file_path in paper:
-            category: QTreeWidgetItem = categories[folder_name]
+            self.library_papers.setdefault(folder_ids[folder_name], []).append((paper_id, title, file_path))
+
+        self.library_counts = counts
+        self.library_expand = expand
+        self.library_last_viewed_paper_id = last_viewed_paper_id
+        self.library_icons = (icon_provider, style)
+
+        for folder_id, folder_name in self.library_children.get(0, ()):
+            self.add_folder_item(None, folder_id, folder_name)
+
+    def add_folder_item(self, parent: QTreeWidgetItem, folder_id: int, folder_name: str):
+        if self.library_counts is not None:
+            folder_name = f"{folder_name} ({self.library_counts.get(folder_id, 0)})"
+        return self.tree_widget.get_category(folder_name, expand=self.library_expand,
+                                             folder_id=folder_id, parent=parent)
+
+    def populate_collection(self, collection: QTreeWidgetItem):
+        icon_provider, style = QFileIconProvider(), QApplication.style()
+        for paper_id, title, _, file_path in SmartCollection.get_papers(collection.data(0, COLLECTION_ROLE)):
+            self.add_tree_widget_item(
+                category=collection,
+                paper_id=paper_id,
+                title=title,
+                file_path=file_path,
+                last_viewed_paper_id=self.library_last_viewed_paper_id,
+                icon_provider=icon_provider,
+                style=style)
+
+    @TRACER.traced("ui")
+    def populate_folder(self, category: QTreeWidgetItem):
+        folder_id = category.data(0, FOLDER_ROLE)
+        for child_id, child_name in self.library_children.get(folder_id, ()):
+            self.add_folder_item(category, child_id, child_name)
+
+        icon_provider, style = self.library_icons
+        for paper_id, title, file_path in self.library_papers.get(folder_id, ()):
             self.add_tree_widget_item(
                 category=category,
                 paper_id=paper_id,
                 title=title,
                 file_path=file_path,
-                last_viewed_paper_id=last_viewed_paper_id,
+                last_viewed_paper_id=self.library_last_viewed_paper_id,
                 icon_provider=icon_provider,
                 style=style)
 
+        if category.childCount() == 0:
+            category.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.DontShowIndicator)
 
     def add_tree_widget_item(self,
                              category: QTreeWidgetItem,
@@ -379,13 +1129,30 @@ class PaperFlux(QMainWindow):
             item.setIcon(0, style.standardIcon(style.StandardPixmap.SP_FileIcon))
         item.setText(0, title)
         item.setData(0, Qt.ItemDataRole.UserRole, paper_id)
+        if paper_id in self.dead_paper_ids:
+            self.set_item_dead(item, True)
 
         if last_viewed_paper_id and paper_id == last_viewed_paper_id[0]:
             self.tree_widget.setCurrentItem(item)
 
 
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
+def run(argv):
+    from single_instance import InstanceServer, parse_requests
+
+    # QtWebEngine is imported after the application exists, which requires shared GL contexts
+    QCoreApplication.setAttribute(Qt.ApplicationAttribute.AA_ShareOpenGLContexts)
+    app = QApplication(argv)
+    # Listening before the window is built: later launches wait in the socket's queue instead of starting
+    instance_server = InstanceServer()
+    instance_server.listen()
     window = PaperFlux()
+    STARTUP_TIMER.mark("window constructed")
+    window.instance_server = instance_server
+    instance_server.Requested.connect(window.handle_requests)
+    window.handle_requests(parse_requests(argv[1:]))
     window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    return app.exec()
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv))
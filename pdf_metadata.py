@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+
+# Title, authors, subject and arXiv id embedded in a PDF, read from the Info dictionary and XMP.
+# read_metadata() is a top-level function so that ProcessPoolExecutor can ship it to spawned worker processes.
+
+ARXIV_ID = re.compile(r"arxiv\s*:\s*(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?", re.IGNORECASE)
+# Producer leftovers that are not a title
+JUNK_TITLE = re.compile(r"^(untitled|microsoft word - .*|.*\.(docx?|dvi|pdf|tex|ps))$", re.IGNORECASE)
+# Below this, starting worker processes (a fresh interpreter each) costs more than it saves
+POOL_THRESHOLD = 32
+CHUNK_SIZE = 16
+
+
+def clean(value):
+    if isinstance(value, dict):
+        # XMP language alternatives, {"x-default": "..."}
+        value = value.get("x-default") or next(iter(value.values()), None)
+    elif isinstance(value, (list, tuple)):
+        value = ", ".join(str(item) for item in value if item)
+    if value is None:
+        return None
+    value = " ".join(str(value).split())
+    return value or None
+
+
+def usable_title(title):
+    return title if title and len(title) > 3 and not JUNK_TITLE.match(title) else None
+
+
+def read_metadata(file_path: str):
+    """Return {"title", "authors", "abstract", "arxiv_id"} for a PDF, None for whatever it does not carry."""
+    metadata = {"title": None, "authors": None, "abstract": None, "arxiv_id": None}
+    try:
+        reader = PdfReader(file_path)
+        info = reader.metadata or {}
+        metadata["title"] = usable_title(clean(info.get("/Title")))
+        metadata["authors"] = clean(info.get("/Author"))
+        metadata["abstract"] = clean(info.get("/Subject"))
+
+        try:
+            xmp = reader.xmp_metadata
+        except Exception:
+            xmp = None
+        if xmp is not None:
+            metadata["title"] = metadata["title"] or usable_title(clean(xmp.dc_title))
+            metadata["authors"] = metadata["authors"] or clean(xmp.dc_creator)
+            metadata["abstract"] = metadata["abstract"] or clean(xmp.dc_description)
+
+        # arXiv stamps its id on the first page; some producers also put it in the Info or XMP identifiers
+        candidates = [str(value) for value in info.values()]
+        if xmp is not None and xmp.dc_identifier:
+            candidates.append(str(xmp.dc_identifier))
+        if reader.pages:
+            candidates.append(reader.pages[0].extract_text() or "")
+        for text in candidates:
+            if match := ARXIV_ID.search(text):
+                metadata["arxiv_id"] = match.group(1)
+                break
+    except Exception as e:
+        print(f"Could not read metadata from {file_path}: {e}")
+    return metadata
+
+
+def read_all_metadata(file_paths: list, workers: int = None):
+    """Yield (file_path, metadata) in order, parsing on every core once there are enough files."""
+    if len(file_paths) < POOL_THRESHOLD:
+        for file_path in file_paths:
+            yield file_path, read_metadata(file_path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        yield from zip(file_paths, executor.map(read_metadata, file_paths, chunksize=CHUNK_SIZE))
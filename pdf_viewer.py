@@ -0,0 +1,504 @@
+import bisect
+from collections import OrderedDict
+
+from PyQt6.QtCore import QModelIndex, QPointF, QRect, QSize, Qt, QTimer
+from PyQt6.QtGui import QColor, QDesktopServices, QGuiApplication, QKeySequence, QPainter
+from PyQt6.QtPdf import QPdfDocument, QPdfLinkModel, QPdfSearchModel
+from PyQt6.QtWidgets import QAbstractScrollArea, QApplication, QLineEdit
+
+from database import ReadingState
+from jobs import CANCELLED, DONE, OPEN, PREFETCH, QUEUED, Job
+from tracing import TRACER
+
+# Paged viewer for local PDFs. Only the pages in the window are rendered, on the job pool at OPEN priority,
+# followed by PREFETCH_PAGES on either side at PREFETCH priority, so a book reopened at page 750 never renders
+# the 749 pages before it. Where each paper was left (page, offset into it, zoom) goes through
+# ReadingState.save, which the window's flush timer commits, and is restored when the paper is opened again.
+# Links are followed on click, a drag selects text within one page for Ctrl+C, and Ctrl+F searches the text.
+# PAPERFLUX_PDF_VIEWER=web shows PDFs in the web view instead.
+PDF_VIEWER_ENV = "PAPERFLUX_PDF_VIEWER"
+
+MARGIN = 12
+PAGE_GAP = 12
+PREFETCH_PAGES = 2
+# Page sizes read per job; QtPdf loads each page to measure it, about 0.1 ms a page
+MEASURE_PAGES = 100
+CACHE_BYTES = 256 * 1024 * 1024
+SAVE_DELAY_MS = 500
+SCROLL_STEP = 40
+ZOOM_STEP = 1.15
+MIN_ZOOM, MAX_ZOOM = 0.25, 6.0
+# Page sizes are in points, 100% shows them at 96 dpi like the web view
+POINTS_TO_PIXELS = 96 / 72
+BACKGROUND = QColor("#2e2e2e")
+SELECTION = QColor(0, 120, 215, 80)
+SEARCH_RESULT = QColor(255, 210, 0, 90)
+CURRENT_RESULT = QColor(255, 120, 0, 130)
+
+
+class PdfViewer(QAbstractScrollArea):
+
+    def __init__(self, jobs, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs
+        self.document = None
+        self.paper_id = None
+        self.file_path = None
+        # None fits the widest page to the window
+        self.zoom = None
+        self.scale = 1.0
+        self.page_sizes = []
+        self.page_tops = []
+        self.content_width = 0
+        # Renders finishing after another document was opened are dropped
+        self.generation = 0
+        # (page, width in pixels) -> QImage, least recently drawn first
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.pending = {}
+        self.measure_jobs = []
+        self.measured_sizes = []
+        self.saved_state = None
+        # Links of the page under the mouse
+        self.links = QPdfLinkModel(self)
+        # (page, press point in points) while dragging, and the QPdfSelection it made
+        self.selecting = None
+        self.selection = None
+        self.search = QPdfSearchModel(self)
+        self.search.rowsInserted.connect(self.search_results_arrived)
+        self.search_index = -1
+
+        # Always on, so that fitting the width does not toggle the scroll bar and the width with it
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
+        self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+        self.verticalScrollBar().valueChanged.connect(self.scrolled)
+        self.horizontalScrollBar().valueChanged.connect(lambda _: self.viewport().update())
+
+        # Scrolling saves the position once it settles, not on every step
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(SAVE_DELAY_MS)
+        self.save_timer.timeout.connect(self.save_state)
+
+        self.search_box = QLineEdit(self)
+        self.search_box.setPlaceholderText("Find in document")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.setFixedWidth(240)
+        self.search_box.hide()
+        self.search_box.textChanged.connect(self.set_search)
+        self.search_box.returnPressed.connect(lambda: self.find_next(
+            -1 if QApplication.keyboardModifiers() & Qt.KeyboardModifier.ShiftModifier else 1))
+        self.setMouseTracking(True)
+        self.viewport().setMouseTracking(True)
+
+    def open(self, paper_id: int, file_path: str):
+        """Show file_path where paper_id was left; False if QtPdf cannot read it."""
+        if paper_id == self.paper_id and file_path == self.file_path:
+            return True
+        self.close_document()
+
+        # Without a parent: renders still running for the previous document keep it alive, not the viewer
+        document = QPdfDocument(None)
+        with TRACER.span("open pdf", "fs", {"file_path": file_path}):
+            error = document.load(file_path)
+        if error != QPdfDocument.Error.None_ or document.pageCount() == 0:
+            return False
+
+        self.document = document
+        self.paper_id = paper_id
+        self.file_path = file_path
+        self.generation += 1
+        self.links.setDocument(document)
+        self.search.setDocument(document)
+        self.set_search(self.search_box.text() if self.search_box.isVisible() else "")
+
+        state = ReadingState.get(paper_id)
+        page, page_offset, self.zoom = state or (0, 0.0, None)
+        self.saved_state = tuple(state) if state else None
+        page = min(page, document.pageCount() - 1)
+        if document.pageCount() <= MEASURE_PAGES:
+            self.page_sizes = [document.pagePointSize(page) for page in range(document.pageCount())]
+        else:
+            # Long documents are laid out as if every page had the size of this one until measure_pages is done
+            self.page_sizes = [document.pagePointSize(page)] * document.pageCount()
+            self.measure_pages()
+        self.layout_pages()
+        self.scroll_to(page, page_offset)
+        self.viewport().update()
+        return True
+
+    def measure_pages(self):
+        document, generation, page_count = self.document, self.generation, len(self.page_sizes)
+        self.measured_sizes = list(self.page_sizes)
+        for start in range(0, page_count, MEASURE_PAGES):
+            pages = range(start, min(start + MEASURE_PAGES, page_count))
+            self.measure_jobs.append(self.jobs.submit(Job(
+                f"Measure pages {pages.start + 1}-{pages.stop}",
+                lambda job, pages=pages: [document.pagePointSize(page) for page in pages],
+                priority=PREFETCH,
+                resource="cpu",
+                retries=0,
+                listed=False,
+                on_done=lambda sizes, pages=pages: self.measured(generation, pages, sizes),
+            )))
+
+    def measured(self, generation: int, pages: range, sizes):
+        if generation != self.generation:
+            return
+        self.measured_sizes[pages.start:pages.stop] = sizes
+        if any(job.state != DONE for job in self.measure_jobs):
+            return
+        self.measure_jobs = []
+        if self.measured_sizes != self.page_sizes:
+            page, page_offset = self.position()
+            self.page_sizes = self.measured_sizes
+            self.layout_pages()
+            self.scroll_to(page, page_offset)
+            self.viewport().update()
+
+    def close_document(self):
+        """Save where the current paper was left and drop its pages."""
+        self.save_state()
+        for job in [*self.pending.values(), *self.measure_jobs]:
+            self.jobs.cancel(job)
+        self.pending.clear()
+        self.measure_jobs = []
+        self.cache.clear()
+        self.cache_bytes = 0
+        self.links.setDocument(None)
+        self.search.setDocument(None)
+        self.search_index = -1
+        self.selecting = None
+        self.selection = None
+        self.document = None
+        self.paper_id = None
+        self.file_path = None
+        self.page_sizes = []
+        self.page_tops = []
+        self.viewport().update()
+
+    def save_state(self):
+        self.save_timer.stop()
+        if self.paper_id is None:
+            return
+        state = (*self.position(), self.zoom)
+        if state != self.saved_state:
+            ReadingState.save(self.paper_id, *state)
+            self.saved_state = state
+
+    def page_width(self, page: int):
+        return round(self.page_sizes[page].width() * self.scale)
+
+    def page_height(self, page: int):
+        return round(self.page_sizes[page].height() * self.scale)
+
+    def layout_pages(self):
+        viewport = self.viewport()
+        widest = max(size.width() for size in self.page_sizes)
+        self.scale = self.zoom * POINTS_TO_PIXELS if self.zoom else max(viewport.width() - 2 * MARGIN, 1) / widest
+
+        self.page_tops = []
+        top = MARGIN
+        for page in range(len(self.page_sizes)):
+            self.page_tops.append(top)
+            top += self.page_height(page) + PAGE_GAP
+        height = top - PAGE_GAP + MARGIN
+        self.content_width = max(round(widest * self.scale) + 2 * MARGIN, viewport.width())
+
+        vertical = self.verticalScrollBar()
+        vertical.setRange(0, max(0, height - viewport.height()))
+        vertical.setPageStep(viewport.height())
+        vertical.setSingleStep(SCROLL_STEP)
+        horizontal = self.horizontalScrollBar()
+        horizontal.setRange(0, self.content_width - viewport.width())
+        horizontal.setPageStep(viewport.width())
+        horizontal.setSingleStep(SCROLL_STEP)
+
+    def position(self):
+        """(page at the top of the window, fraction of that page scrolled past)."""
+        value = self.verticalScrollBar().value()
+        page = max(0, bisect.bisect_right(self.page_tops, value) - 1)
+        page_offset = (value - self.page_tops[page]) / max(self.page_height(page), 1)
+        return page, round(min(1.0, max(0.0, page_offset)), 4)
+
+    def scroll_to(self, page: int, page_offset: float):
+        self.verticalScrollBar().setValue(self.page_tops[page] + round(page_offset * self.page_height(page)))
+
+    def scrolled(self, _):
+        self.viewport().update()
+        if self.paper_id is not None:
+            self.save_timer.start()
+
+    def set_zoom(self, zoom):
+        """Zoom around the page at the top of the window; None fits the width."""
+        if not self.page_sizes:
+            return
+        page, page_offset = self.position()
+        self.zoom = None if zoom is None else min(MAX_ZOOM, max(MIN_ZOOM, zoom))
+        self.layout_pages()
+        self.scroll_to(page, page_offset)
+        self.viewport().update()
+        self.save_timer.start()
+
+    def zoom_by(self, factor: float):
+        self.set_zoom(self.scale / POINTS_TO_PIXELS * factor)
+
+    def visible_pages(self):
+        top = self.verticalScrollBar().value()
+        bottom = top + self.viewport().height()
+        first = max(0, bisect.bisect_right(self.page_tops, top) - 1)
+        last = max(first, bisect.bisect_left(self.page_tops, bottom) - 1)
+        return range(first, min(last, len(self.page_sizes) - 1) + 1)
+
+    def page_rect(self, page: int):
+        width = self.page_width(page)
+        left = (self.content_width - width) // 2 - self.horizontalScrollBar().value()
+        return QRect(left, self.page_tops[page] - self.verticalScrollBar().value(), width, self.page_height(page))
+
+    def cached(self, page: int, width: int):
+        """The render at width, or any other render of the page to stretch until that one arrives."""
+        if (image := self.cache.get((page, width))) is not None:
+            self.cache.move_to_end((page, width))
+            return image, True
+        for (cached_page, _), image in self.cache.items():
+            if cached_page == page:
+                return image, False
+        return None, False
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        painter.fillRect(event.rect(), BACKGROUND)
+        if not self.page_sizes:
+            return
+
+        visible = self.visible_pages()
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        for page in visible:
+            rect = self.page_rect(page)
+            image, exact = self.cached(page, rect.width())
+            # QtPdf renders onto a transparent image, most pages have no background of their own
+            painter.fillRect(rect, Qt.GlobalColor.white)
+            if image is not None:
+                painter.drawImage(rect, image)
+            if not exact:
+                self.request(page, OPEN)
+            self.paint_highlights(painter, page, rect)
+        painter.end()
+
+        first = max(0, visible.start - PREFETCH_PAGES)
+        last = min(len(self.page_sizes) - 1, visible.stop - 1 + PREFETCH_PAGES)
+        self.cancel_distant(first, last)
+        for page in range(first, last + 1):
+            if page not in visible:
+                self.request(page, PREFETCH)
+
+    def paint_highlights(self, painter: QPainter, page: int, rect: QRect):
+        """Search results and the selection on page, whose geometry is in points."""
+        current = self.search.resultAtIndex(self.search_index) if self.search_index >= 0 else None
+        results = self.search.resultsOnPage(page) if self.search.searchString() else []
+        selection = self.selection.bounds() if self.selection is not None and self.selecting_page() == page else []
+        if not results and not selection:
+            return
+        painter.save()
+        painter.translate(rect.topLeft())
+        painter.scale(self.scale, self.scale)
+        painter.setPen(Qt.PenStyle.NoPen)
+        for result in results:
+            is_current = current is not None and current.page() == page and \
+                result.rectangles() == current.rectangles()
+            for rectangle in result.rectangles():
+                painter.fillRect(rectangle, CURRENT_RESULT if is_current else SEARCH_RESULT)
+        painter.setBrush(SELECTION)
+        for polygon in selection:
+            painter.drawPolygon(polygon)
+        painter.restore()
+
+    def request(self, page: int, priority: int):
+        width = self.page_width(page)
+        key = (page, width)
+        if key in self.cache:
+            return
+        if (job := self.pending.get(key)) is not None and job.state != CANCELLED:
+            # Finished jobs are only left here when the page could not be rendered
+            if job.state != QUEUED or job.priority <= priority:
+                return
+            # A prefetched page scrolled into view before its turn
+            self.jobs.cancel(job)
+
+        ratio = self.devicePixelRatioF()
+        size = QSize(round(width * ratio), round(self.page_height(page) * ratio))
+        document, generation = self.document, self.generation
+        self.pending[key] = self.jobs.submit(Job(
+            f"Render page {page + 1}",
+            lambda job: document.render(page, size),
+            priority=priority,
+            resource="cpu",
+            retries=0,
+            listed=False,
+            on_done=lambda image: self.rendered(generation, key, image, ratio),
+        ))
+
+    def cancel_distant(self, first: int, last: int):
+        """Drop queued renders of pages scrolled past and of other zoom levels."""
+        for key, job in list(self.pending.items()):
+            page, width = key
+            if job.state == QUEUED and not (first <= page <= last and width == self.page_width(page)):
+                self.jobs.cancel(job)
+                del self.pending[key]
+
+    def rendered(self, generation: int, key, image, ratio: float):
+        if generation != self.generation or image.isNull():
+            return
+        self.pending.pop(key, None)
+        image.setDevicePixelRatio(ratio)
+        self.cache[key] = image
+        self.cache_bytes += image.sizeInBytes()
+        while self.cache_bytes > CACHE_BYTES and len(self.cache) > 1:
+            _, dropped = self.cache.popitem(last=False)
+            self.cache_bytes -= dropped.sizeInBytes()
+        self.viewport().update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.place_search_box()
+        if self.page_sizes:
+            page, page_offset = self.position()
+            self.layout_pages()
+            self.scroll_to(page, page_offset)
+
+    def wheelEvent(self, event):
+        if event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            self.zoom_by(ZOOM_STEP ** (event.angleDelta().y() / 120))
+            event.accept()
+            return
+        super().wheelEvent(event)
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.StandardKey.ZoomIn):
+            self.zoom_by(ZOOM_STEP)
+        elif event.matches(QKeySequence.StandardKey.ZoomOut):
+            self.zoom_by(1 / ZOOM_STEP)
+        elif event.key() == Qt.Key.Key_0 and event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            self.set_zoom(None)
+        elif event.matches(QKeySequence.StandardKey.Copy):
+            if self.selection is not None and self.selection.text():
+                QGuiApplication.clipboard().setText(self.selection.text())
+        elif event.matches(QKeySequence.StandardKey.Find):
+            self.search_box.show()
+            self.search_box.setFocus()
+            self.search_box.selectAll()
+            self.set_search(self.search_box.text())
+        elif event.matches(QKeySequence.StandardKey.FindNext):
+            self.find_next(1)
+        elif event.matches(QKeySequence.StandardKey.FindPrevious):
+            self.find_next(-1)
+        elif event.key() == Qt.Key.Key_Escape and self.search_box.isVisible():
+            self.search_box.hide()
+            self.set_search("")
+            self.setFocus()
+        elif event.key() in (Qt.Key.Key_Return, Qt.Key.Key_Enter):
+            # Already handled by the search box's returnPressed
+            pass
+        elif event.key() == Qt.Key.Key_Home:
+            self.verticalScrollBar().setValue(0)
+        elif event.key() == Qt.Key.Key_End:
+            self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
+        else:
+            super().keyPressEvent(event)
+
+    def page_at(self, position: QPointF):
+        """(page, point on it in points) under a viewport position, None between pages."""
+        for page in self.visible_pages():
+            rect = self.page_rect(page)
+            if rect.contains(position.toPoint()):
+                return page, (position - QPointF(rect.topLeft())) / self.scale
+        return None
+
+    def link_at(self, position: QPointF):
+        if self.document is None or (hit := self.page_at(position)) is None:
+            return None
+        page, point = hit
+        if self.links.page() != page:
+            self.links.setPage(page)
+        link = self.links.linkAt(point)
+        # Links to URLs have no page, and QPdfLink only counts links with one as valid
+        return link if link.isValid() or not link.url().isEmpty() else None
+
+    def follow_link(self, link):
+        if not link.url().isEmpty():
+            QDesktopServices.openUrl(link.url())
+            return
+        page = link.page()
+        page_offset = link.location().y() / max(self.page_sizes[page].height(), 1)
+        self.scroll_to(page, min(1.0, max(0.0, page_offset)))
+
+    def selecting_page(self):
+        return self.selecting[0] if self.selecting is not None else None
+
+    def mousePressEvent(self, event):
+        hit = self.page_at(event.position()) if self.document is not None else None
+        if event.button() != Qt.MouseButton.LeftButton or hit is None:
+            super().mousePressEvent(event)
+            return
+        self.selecting = hit
+        self.selection = None
+        self.viewport().update()
+
+    def mouseMoveEvent(self, event):
+        if self.selecting is not None and event.buttons() & Qt.MouseButton.LeftButton:
+            # A selection stays on the page it started on, the end point is kept inside that page
+            page, start = self.selecting
+            rect = self.page_rect(page)
+            end = (event.position() - QPointF(rect.topLeft())) / self.scale
+            size = self.page_sizes[page]
+            end = QPointF(min(max(end.x(), 0.0), size.width()), min(max(end.y(), 0.0), size.height()))
+            self.selection = self.document.getSelection(page, start, end)
+            self.viewport().update()
+            return
+        link = self.link_at(event.position())
+        self.viewport().setCursor(Qt.CursorShape.PointingHandCursor if link is not None else
+                                  Qt.CursorShape.ArrowCursor)
+        super().mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        if self.selecting is None or event.button() != Qt.MouseButton.LeftButton:
+            super().mouseReleaseEvent(event)
+            return
+        # A click that selected nothing follows the link under it
+        if self.selection is None or not self.selection.text():
+            self.selection = None
+            if (link := self.link_at(event.position())) is not None:
+                self.selecting = None
+                self.follow_link(link)
+        self.viewport().update()
+
+    def set_search(self, text: str):
+        if self.search.searchString() != text:
+            self.search.setSearchString(text)
+        self.search_index = -1
+        self.viewport().update()
+
+    def search_results_arrived(self):
+        """Results are found page by page in the background; the first one is shown once it is in."""
+        if self.search_index < 0 and self.search_box.isVisible() and self.search.rowCount(QModelIndex()) > 0:
+            self.find_next(1)
+        self.viewport().update()
+
+    def find_next(self, step: int):
+        count = self.search.rowCount(QModelIndex())
+        if count == 0:
+            return
+        self.search_index = (self.search_index + step) % count if self.search_index >= 0 else \
+            (0 if step > 0 else count - 1)
+        result = self.search.resultAtIndex(self.search_index)
+        rectangles = result.rectangles()
+        top = rectangles[0].top() if rectangles else result.location().y()
+        # The result a third of the way down the window, unless it is already in view
+        page_top = self.page_tops[result.page()] + round(top * self.scale)
+        scroll = self.verticalScrollBar()
+        if not scroll.value() <= page_top <= scroll.value() + self.viewport().height() - SCROLL_STEP:
+            scroll.setValue(page_top - self.viewport().height() // 3)
+        self.viewport().update()
+
+    def place_search_box(self):
+        self.search_box.move(self.viewport().width() - self.search_box.width() - MARGIN, MARGIN)
@@ -0,0 +1,124 @@
+import collections
+import functools
+import os
+import re
+import sys
+import time
+
+# Statements slower than this many milliseconds get their EXPLAIN QUERY PLAN captured.
+SLOW_QUERY_MS = float(os.environ.get("PAPERFLUX_SLOW_QUERY_MS", "50"))
+# Set to a file path to write the statistics there when the application exits.
+QUERY_STATS_ENV = "PAPERFLUX_QUERY_STATS"
+
+LATENCY_SAMPLES = 512
+SLOW_QUERY_ENTRIES = 100
+
+
+# Queries are a few hundred constant strings, so each is normalized once
+@functools.lru_cache(maxsize=1024)
+def normalize(query: str):
+    return re.sub(r"\s+", " ", query).strip().rstrip(";")
+
+
+def percentile(values, fraction: float):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def is_full_scan(plan):
+    """True when a plan scans a table without an index or sorts through a temporary B-tree."""
+    for detail in plan:
+        if "USE TEMP B-TREE" in detail:
+            return True
+        if detail.startswith("SCAN") and "INDEX" not in detail:
+            return True
+    return False
+
+
+class StatementStats:
+    __slots__ = ("query", "count", "total_ms", "rows", "latencies", "plan")
+
+    def __init__(self, query: str):
+        self.query = query
+        self.count = 0
+        self.total_ms = 0.0
+        self.rows = 0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.plan = None
+
+    def as_dict(self):
+        return {
+            "query": self.query,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "p95_ms": round(percentile(self.latencies, 0.95), 3),
+            "rows": self.rows,
+            "plan": self.plan,
+            "full_scan": None if self.plan is None else is_full_scan(self.plan),
+        }
+
+
+class QueryLog:
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self.statements = {}
+        self.slow_queries = collections.deque(maxlen=SLOW_QUERY_ENTRIES)
+
+    def record(self, conn, query: str, args, elapsed_ms: float, rows: int):
+        key = normalize(query)
+        stats = self.statements.get(key)
+        if stats is None:
+            stats = self.statements[key] = StatementStats(key)
+        stats.count += 1
+        stats.total_ms += elapsed_ms
+        stats.rows += max(rows, 0)
+        stats.latencies.append(elapsed_ms)
+
+        if elapsed_ms >= self.slow_query_ms:
+            if stats.plan is None:
+                stats.plan = self.explain(conn, query, args)
+            self.slow_queries.append((time.time(), round(elapsed_ms, 3), key))
+
+    @staticmethod
+    def explain(conn, query: str, args):
+        try:
+            return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, args)]
+        except Exception as e:
+            return [f"EXPLAIN failed: {e}"]
+
+    def explain_all(self, conn):
+        """Capture the plan of every statement seen so far, not only the slow ones."""
+        for key, stats in self.statements.items():
+            if stats.plan is None and key.upper().startswith("SELECT"):
+                stats.plan = self.explain(conn, key, [None] * key.count("?"))
+
+    def reset(self):
+        self.statements.clear()
+        self.slow_queries.clear()
+
+    def as_dict(self):
+        statements = sorted(self.statements.values(), key=lambda s: s.total_ms, reverse=True)
+        return {
+            "slow_query_ms": self.slow_query_ms,
+            "statements": [stats.as_dict() for stats in statements],
+            "slow_queries": [
+                {"at": at, "elapsed_ms": elapsed_ms, "query": query}
+                for at, elapsed_ms, query in self.slow_queries
+            ],
+        }
+
+    def format(self):
+        lines = [f"{'count':>7} {'total ms':>10} {'p95 ms':>9} {'rows':>9}  statement"]
+        for stats in self.as_dict()["statements"]:
+            lines.append(f"{stats['count']:>7} {stats['total_ms']:>10.2f} {stats['p95_ms']:>9.2f} "
+                         f"{stats['rows']:>9}  {stats['query']}")
+            for detail in stats["plan"] or ():
+                lines.append(f"{'':>39}  plan: {detail}")
+            if stats["full_scan"]:
+                lines.append(f"{'':>39}  FULL SCAN OR TEMP B-TREE SORT")
+        return "\n".join(lines)
+
+    def dump(self, file=None):
+        print(self.format(), file=file or sys.stderr)
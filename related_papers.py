@@ -0,0 +1,200 @@
+import re
+import zlib
+
+import numpy as np
+
+import database
+from database import Paper
+from jobs import INDEX, Job
+
+# Related papers from hashed bag-of-words vectors over title, authors, abstract, cited papers and the
+# extracted article text. Every paper is a DIMENSIONS-wide float16 row in one matrix; a cosine query is a
+# single matrix-vector product. Each paper's top-k neighbours are cached in related_cache and patched when
+# papers arrive or change.
+# New papers are vectorized by background INDEX jobs; until then queries are answered from the vectors stored so far.
+
+DIMENSIONS = 256
+TOP_K = 10
+BATCH_SIZE = 5000
+# Characters of article text vectorized per paper, and its weight against the title, authors and abstract
+TEXT_LENGTH = 20000
+TEXT_WEIGHT = 0.5
+# Cached scores are recomputed with a different summation order, so comparisons against them allow for rounding
+SCORE_TOLERANCE = 1e-3
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from in into is it of on or that the this to with we our via using"
+    " paper pdf".split()
+)
+
+
+def tokens(text: str):
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if len(token) > 1 and token not in STOP_WORDS]
+
+
+def features(title, authors, abstract, cited):
+    # The title counts twice, authors as whole names so that co-authorship shows up, cited arXiv ids so that
+    # shared references do
+    words = tokens(title or "") * 2 + tokens(abstract or "")
+    return words + [name.strip().lower() for name in (authors or "").split(",") if name.strip()] + \
+        ["cites " + arxiv_id for arxiv_id in (cited or "").split()]
+
+
+def hashed(features):
+    """One L2-normalized float32 row of hashed feature counts."""
+    hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in features), dtype=np.int64)
+    # Signed hashing keeps collisions from always adding up
+    row = np.bincount(hashes % DIMENSIONS, weights=np.where(hashes & 0x80000000, 1.0, -1.0), minlength=DIMENSIONS)
+    # Sublinear term frequency, so one repeated word does not dominate
+    row = np.sign(row) * np.log1p(np.abs(row))
+    norm = np.linalg.norm(row)
+    return row / norm if norm else row
+
+
+def vectorize(papers):
+    """Turn (title, authors, abstract, article text, cited arXiv ids) rows into L2-normalized float16 rows."""
+    matrix = np.zeros((len(papers), DIMENSIONS), dtype=np.float32)
+    for row, (title, authors, abstract, text, cited) in enumerate(papers):
+        # The article text is normalized on its own, so that a long one does not drown out the title
+        matrix[row] = hashed(features(title, authors, abstract, cited)) + TEXT_WEIGHT * hashed(tokens(text or ""))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1, norms)).astype(np.float16)
+
+
+class RelatedIndex:
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.matrix = np.zeros((0, DIMENSIONS), dtype=np.float16)
+        self.row_of = {}
+        # k-th best cached score per row: +inf while a row has no cached list, -inf when it holds fewer than k
+        self.kth_scores = np.zeros(0, dtype=np.float32)
+        self.loaded = False
+        self.backfill_job = None
+
+    def load(self):
+        rows = database.DATABASE.fetchall("SELECT paper_id, vector FROM paper_vectors ORDER BY paper_id")
+        self.ids = np.fromiter((paper_id for paper_id, _ in rows), dtype=np.int64, count=len(rows))
+        self.matrix = np.frombuffer(b"".join(vector for _, vector in rows), dtype=np.float16) \
+            .reshape(len(rows), DIMENSIONS).copy()
+        self.row_of = {int(paper_id): row for row, paper_id in enumerate(self.ids)}
+
+        self.kth_scores = np.full(len(rows), np.inf, dtype=np.float32)
+        for paper_id, scores in database.DATABASE.fetchall("SELECT paper_id, scores FROM related_cache"):
+            scores = np.frombuffer(scores, dtype=np.float32)
+            if (row := self.row_of.get(paper_id)) is not None and len(scores) == TOP_K:
+                self.kth_scores[row] = scores[-1]
+        self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def backfill(self, jobs, on_done=None):
+        """
+        Vectorize new or edited papers in INDEX-priority cpu jobs, one batch of BATCH_SIZE after the other.
+        on_done() runs on the GUI thread after every stored batch.
+        """
+        if self.backfill_job is not None:
+            return
+        self.ensure_loaded()
+        missing = Paper.get_papers_to_vectorize(BATCH_SIZE, TEXT_LENGTH)
+        if not missing:
+            return
+
+        def stored(new_matrix):
+            self.backfill_job = None
+            self.add(missing, new_matrix)
+            if on_done is not None:
+                on_done()
+            self.backfill(jobs, on_done)
+
+        def failed(error):
+            self.backfill_job = None
+            print(f"Could not index related papers: {error}")
+
+        self.backfill_job = jobs.submit(Job(
+            f"Index {len(missing)} papers for related papers",
+            lambda job: vectorize([paper[1:] for paper in missing]),
+            priority=INDEX,
+            resource="cpu",
+            retries=0,
+            on_done=stored,
+            on_failed=failed,
+        ))
+
+    def add(self, missing, new_matrix):
+        """Store the vectors of get_papers_to_vectorize rows and drop the cached lists they change."""
+        new_ids = np.array([paper_id for paper_id, *_ in missing], dtype=np.int64)
+
+        statements = [("INSERT OR REPLACE INTO paper_vectors (paper_id, vector) VALUES (?, ?)",
+                       (int(paper_id), vector.tobytes())) for paper_id, vector in zip(new_ids, new_matrix)]
+        # Only this batch: papers queued while it was being vectorized stay queued for the next one
+        statements += [("DELETE FROM vector_dirty WHERE paper_id = ?", (int(paper_id),)) for paper_id in new_ids]
+        # The text of re-vectorized papers changed, so their own lists are out of date
+        statements += [("DELETE FROM related_cache WHERE paper_id = ?", (int(paper_id),)) for paper_id in new_ids]
+
+        # Only papers with a cached list can be affected: when a new vector beats their k-th neighbour, or when
+        # a paper that was in the list changed. A list holds every paper scoring at least its k-th score, or
+        # any positive score while it has fewer than k, so the old vectors tell which lists those are.
+        stale = np.isin(self.ids, new_ids)
+        cached_rows = np.flatnonzero(np.isfinite(self.kth_scores))
+        if len(cached_rows):
+            cached_matrix = self.matrix[cached_rows].astype(np.float32)
+            kth_scores = self.kth_scores[cached_rows, None]
+            changed = (cached_matrix @ new_matrix.astype(np.float32).T > kth_scores - SCORE_TOLERANCE).any(axis=1)
+            if stale.any():
+                changed |= (cached_matrix @ self.matrix[stale].astype(np.float32).T >=
+                            np.maximum(kth_scores, 0) - SCORE_TOLERANCE).any(axis=1)
+            for row in cached_rows[changed]:
+                statements.append(("DELETE FROM related_cache WHERE paper_id = ?", (int(self.ids[row]),)))
+                self.kth_scores[row] = np.inf
+
+        # Papers whose vector was dropped because their text changed are replaced, not duplicated
+        if stale.any():
+            self.ids, self.matrix, self.kth_scores = self.ids[~stale], self.matrix[~stale], self.kth_scores[~stale]
+
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.matrix = np.vstack([self.matrix, new_matrix])
+        self.kth_scores = np.concatenate([self.kth_scores, np.full(len(new_ids), np.inf, dtype=np.float32)])
+        self.row_of = {int(paper_id): row for row, paper_id in enumerate(self.ids)}
+
+        database.DATABASE.execute_in_transaction(*statements)
+
+    def neighbours(self, paper_id: int):
+        cached = database.DATABASE.fetchone(
+            "SELECT related_ids, scores FROM related_cache WHERE paper_id = ?", (paper_id,))
+        if cached is not None:
+            return list(zip(np.frombuffer(cached[0], dtype=np.int64).tolist(),
+                            np.frombuffer(cached[1], dtype=np.float32).tolist()))
+
+        self.ensure_loaded()
+        row = self.row_of.get(paper_id)
+        if row is None:
+            return []
+
+        similarities = self.matrix.astype(np.float32) @ self.matrix[row].astype(np.float32)
+        similarities[row] = -np.inf
+        k = min(TOP_K, len(similarities) - 1)
+        if k <= 0:
+            return []
+        best = np.argpartition(-similarities, k - 1)[:k]
+        best = best[np.argsort(-similarities[best])]
+        best = best[similarities[best] > 0]
+
+        related_ids, scores = self.ids[best], similarities[best].astype(np.float32)
+        database.DATABASE.execute_in_transaction(
+            ("INSERT OR REPLACE INTO related_cache (paper_id, related_ids, scores) VALUES (?, ?, ?)",
+             (paper_id, related_ids.tobytes(), scores.tobytes())),
+        )
+        self.kth_scores[row] = scores[-1] if len(scores) == TOP_K else -np.inf
+        return list(zip(related_ids.tolist(), scores.tolist()))
+
+    def related_papers(self, paper_id: int):
+        """Return [(paper_id, title, score)] for the closest papers still in the library, among those indexed so far."""
+        neighbours = self.neighbours(paper_id)
+        if not neighbours:
+            return []
+        titles = Paper.get_paper_titles([related_id for related_id, _ in neighbours])
+        return [(related_id, titles[related_id], score) for related_id, score in neighbours if related_id in titles]
+
+
+RELATED_INDEX = RelatedIndex()
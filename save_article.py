@@ -1,34 +1,201 @@
 import os
 import re
 import sqlite3
-import urllib.request as request
 from uuid import uuid4
 
-import requests
-from requests.exceptions import HTTPError
-
-from custom_widget import CategoryDialog
 from database import Paper, Folder
+from pdf_metadata import read_metadata, read_all_metadata
+from tracing import TRACER
 from utils import arxiv_scrapper, FILE_PATH
 
+INSERT_BATCH_SIZE = 200
+
+
+def choose_folder_id():
+    from custom_widget import CategoryDialog
 
-def save_open_page(url: str, folder_id=None):
     category_dialog = CategoryDialog()
 
     category_dialog.exec()
     category_title = category_dialog.combo.currentText()
-    folder_id = Folder.get_folder_id_for_title(category_title)[0]
+    return Folder.get_folder_id_for_title(category_title)[0]
+
+
+def save_open_page(url: str, folder_id=None):
+    save_url(url, folder_id=choose_folder_id())
+
+
+def save_url(url: str, folder_id=None):
+    if re.search(r"^https?://medium.com", url):
+        return save_medium_webpage(url, folder_id=folder_id)
+    elif re.search(r"^https?://arxiv.org", url):
+        return save_arxiv_research_paper(url, folder_id=folder_id)
+    elif re.search(r"^https?://towardsdatascience.com", url):
+        return save_medium_webpage(url, folder_id=folder_id)
+    else:
+        return save_document_webpage(url, folder_id=folder_id)
 
+
+@TRACER.traced("network")
+def fetch_url(url: str, progress=None):
+    """
+    Download what url points to and return the paper record to store, None when there is nothing to save.
+    Touches no database, so it can run on a worker thread; store_record() then runs on the main one.
+    """
     if re.search(r"^https?://medium.com", url):
-        save_medium_webpage(url, folder_id=folder_id)
+        return fetch_medium_webpage(url)
     elif re.search(r"^https?://arxiv.org", url):
-        save_arxiv_research_paper(url, folder_id=folder_id)
+        return fetch_arxiv_research_paper(url, progress)
     elif re.search(r"^https?://towardsdatascience.com", url):
-        save_medium_webpage(url, folder_id=folder_id)
+        return fetch_medium_webpage(url)
     else:
-        save_document_webpage(url, folder_id=folder_id)
+        return fetch_document_webpage(url, progress)
+
+
+def store_record(record, folder_id=None):
+    """Insert a record from fetch_url(); raises sqlite3.IntegrityError when the paper is already saved."""
+    if record is None:
+        return None
+    Paper.insert_row(
+        arxiv_id=record["arxiv_id"],
+        title=record["title"],
+        authors=record["authors"],
+        abstract=record["abstract"],
+        file_path=record["file_path"],
+        website_url=record["website_url"],
+        folder_id=folder_id
+    )
+    if record.get("text"):
+        Paper.set_article_text(Paper.get_paper_id_of_title(record["title"])[0], record["text"])
+    return record["title"]
+
+
+def filename_title(file_path: str):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def save_local_pdf(file_path: str, folder_id=None):
+    """Add one PDF using its embedded metadata; raises sqlite3.IntegrityError when it is already saved."""
+    metadata = read_metadata(file_path)
+    arxiv_id = metadata["arxiv_id"]
+    if arxiv_id and Paper.get_taken_values("arxiv_id", [arxiv_id]):
+        arxiv_id = None
+
+    Paper.insert_row(
+        arxiv_id=arxiv_id or str(uuid4()),
+        title=metadata["title"] or filename_title(file_path),
+        authors=metadata["authors"],
+        abstract=metadata["abstract"],
+        file_path=file_path,
+        # The file is the user's own copy, not one that could be downloaded again; the id stays in arxiv_id
+        website_url=None,
+        folder_id=folder_id
+    )
+
+
+def save_local_batch(batch: list, folder_id: int):
+    """Insert (file_path, metadata) pairs in one transaction, yielding (status, title, file_path) for each."""
+    titles = [metadata["title"] or filename_title(file_path) for file_path, metadata in batch]
+    taken_titles = Paper.get_taken_values("title", titles)
+    taken_arxiv_ids = Paper.get_taken_values("arxiv_id", [m["arxiv_id"] for _, m in batch if m["arxiv_id"]])
+
+    rows, statuses = [], []
+    for (file_path, metadata), title in zip(batch, titles):
+        # Same title or same arXiv id as a saved paper: the same paper in another file
+        if title in taken_titles or metadata["arxiv_id"] in taken_arxiv_ids:
+            statuses.append(("exists", title, file_path))
+            continue
+        taken_titles.add(title)
+        arxiv_id = metadata["arxiv_id"]
+        if arxiv_id:
+            taken_arxiv_ids.add(arxiv_id)
+        rows.append((arxiv_id or str(uuid4()), title, metadata["authors"], metadata["abstract"], file_path, None,
+                     folder_id))
+        statuses.append(("added", title, file_path))
+
+    try:
+        Paper.insert_rows(rows)
+    except sqlite3.IntegrityError as e:
+        print(f"Error: {e}")
+        statuses = [("exists" if status == "added" else status, title, file_path)
+                    for status, title, file_path in statuses]
+    yield from statuses
+
+
+def local_directory_folder_id(folder_path: str):
+    """The category named after the directory, created if needed."""
+    folder_name = os.path.basename(folder_path.rstrip(os.sep))
+    folder_id = Folder.get_folder_id_for_title(folder_name)
+    if folder_id is None:
+        Folder.insert_row(folder_name, 0)
+        folder_id = Folder.get_folder_id_for_title(folder_name)
+    return folder_id[0]
+
+
+def save_local_directory(folder_path: str, folder_id=None):
+    """Yield (status, title, file_path) for every PDF found under folder_path."""
+    if folder_id is None:
+        folder_id = local_directory_folder_id(folder_path)
+
+    file_paths = [os.path.join(parent_directory, file)
+                  for (parent_directory, _, files) in os.walk(folder_path)
+                  for file in files if file.endswith(".pdf")]
+
+    # Files already in the library are reported without being parsed again
+    new_file_paths = []
+    for start in range(0, len(file_paths), INSERT_BATCH_SIZE):
+        chunk = file_paths[start:start + INSERT_BATCH_SIZE]
+        taken = Paper.get_taken_values("file_path", chunk)
+        for file_path in chunk:
+            if file_path in taken:
+                yield "exists", filename_title(file_path), file_path
+            else:
+                new_file_paths.append(file_path)
+
+    yield from save_local_metadata(read_all_metadata(new_file_paths), folder_id)
+
+
+def save_local_metadata(pairs, folder_id: int):
+    """Insert (file_path, metadata) pairs in batches, yielding (status, title, file_path) for each."""
+    batch = []
+    for file_path, metadata in pairs:
+        batch.append((file_path, metadata))
+        if len(batch) == INSERT_BATCH_SIZE:
+            yield from save_local_batch(batch, folder_id)
+            batch = []
+    if batch:
+        yield from save_local_batch(batch, folder_id)
+
+
+@TRACER.traced("fs")
+def scan_local_directory(folder_path: str, known_file_paths: set, progress=None):
+    """
+    Worker-thread half of save_local_directory: walk folder_path and read the metadata of every PDF not in
+    known_file_paths. Returns [(file_path, metadata)] for save_local_metadata().
+    """
+    file_paths = [file_path
+                  for (parent_directory, _, files) in os.walk(folder_path)
+                  for file in files if file.endswith(".pdf")
+                  if (file_path := os.path.join(parent_directory, file)) not in known_file_paths]
+    pairs = []
+    for file_path, metadata in read_all_metadata(file_paths):
+        pairs.append((file_path, metadata))
+        if progress is not None:
+            progress(len(pairs), len(file_paths))
+    return pairs
+
 
 def save_document_webpage(url: str, folder_id=None):
+    try:
+        return store_record(fetch_document_webpage(url), folder_id)
+    except sqlite3.IntegrityError as e:
+        print(f"Error: {e}")
+
+
+def fetch_document_webpage(url: str, progress=None):
+    import requests
+    from requests.exceptions import HTTPError
+
     try:
         response = requests.get(url, stream=True, timeout=30,
                                 headers={
@@ -40,73 +207,80 @@ def save_document_webpage(url: str, folder_id=None):
                                     "Accept": "*/*",
                                 })
         response.raise_for_status()
-
-        content_type = response.headers.get("Content-Type", "").lower()
-
-        if "application/pdf" in content_type:
-            filename = url.split("/")[-1]
-            if not filename.endswith(".pdf"):
-                filename = filename + ".pdf"
-            save_path = os.path.join(FILE_PATH,  filename)
-            with open(save_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size= 8192):
-                    if chunk:
-                        f.write(chunk)
-
-            Paper.insert_row(
-                arxiv_id=str(uuid4()),
-                title=filename,
-                authors=None,
-                abstract=None,
-                file_path=save_path,
-                website_url=url,
-                folder_id=folder_id
-            )
     except HTTPError as e:
         print(f"Error: {e}")
-    except sqlite3.IntegrityError as e:
-        print(f"Error: {e}")
+        return None
+
+    content_type = response.headers.get("Content-Type", "").lower()
+    if "application/pdf" not in content_type:
+        return None
+
+    filename = url.split("/")[-1]
+    if not filename.endswith(".pdf"):
+        filename = filename + ".pdf"
+    save_path = os.path.join(FILE_PATH, filename)
+    total = int(response.headers.get("Content-Length") or 0) or None
+    temporary_path = f"{save_path}.{uuid4().hex}.part"
+    try:
+        with open(temporary_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                if chunk:
+                    f.write(chunk)
+                    if progress is not None:
+                        progress(f.tell(), total)
+        os.replace(temporary_path, save_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+    return {"arxiv_id": str(uuid4()), "title": filename, "authors": None, "abstract": None,
+            "file_path": save_path, "website_url": url}
 
 
 def save_medium_webpage(url: str, folder_id=None):
+    return store_record(fetch_medium_webpage(url), folder_id)
+
+
+def fetch_medium_webpage(url: str):
+    from snapshot import save_snapshot, excerpt
+
     url = url.rstrip("/")
     title = url.split("/")[-1].replace('-', ' ').title()
 
     article_id = str(uuid4())
 
-    Paper.insert_row(
-        arxiv_id=article_id,
-        title=title,
-        authors=None,
-        abstract=None,
-        file_path=url,
-        website_url=url,
-        folder_id=folder_id
-    )
+    # Reopened from the offline snapshot; without one the article is loaded live as before
+    file_path, text = os.path.join(FILE_PATH, article_id + ".html"), None
+    try:
+        text = save_snapshot(url, file_path)
+    except Exception as e:
+        print(f"Could not save an offline copy of {url}: {e}")
+        file_path = url
+
+    return {"arxiv_id": article_id, "title": title, "authors": None, "abstract": excerpt(text) if text else None,
+            "file_path": file_path, "website_url": url, "text": text}
 
 
 def save_arxiv_research_paper(url: str, folder_id=None):
+    try:
+        return store_record(fetch_arxiv_research_paper(url), folder_id)
+    except Exception as e:
+        print(f"Error: {e}")
+
+
+def fetch_arxiv_research_paper(url: str, progress=None):
+    from storage import download
+
     if not re.match(r"^https?://arxiv.org/(abs|pdf)/\d{4}.\d{4,5}", url):
         print("Please provide a direct PDF link.")
-        return
+        return None
 
     url = re.sub(r"abs", "pdf", url)
     arxiv_id = url.split("/")[-1]
 
     title, authors, abstract = arxiv_scrapper(arxiv_id)
     save_path = os.path.join(FILE_PATH, arxiv_id + ".pdf")
+    download(url, save_path, progress)
 
-    try:
-        request.urlretrieve(url, save_path)
-
-        Paper.insert_row(
-            arxiv_id=arxiv_id,
-            title=title,
-            authors=authors,
-            abstract=abstract,
-            file_path=save_path,
-            website_url=url,
-            folder_id=folder_id
-        )
-    except Exception as e:
-        print(f"Error: {e}")
+    return {"arxiv_id": arxiv_id, "title": title, "authors": authors, "abstract": abstract,
+            "file_path": save_path, "website_url": url}
@@ -0,0 +1,95 @@
+import getpass
+import hashlib
+import json
+import os
+from urllib.parse import unquote, urlparse
+
+from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtNetwork import QLocalServer, QLocalSocket
+
+# One window per library. The first instance listens on a local socket named after the user and the database
+# path; later launches (`paperflux open <path|url>`, a desktop "open with") send their requests there and exit
+# before importing the rest of the application, so there is never a second writer or a second backup().
+# A request is a JSON list of {"command": "open" | "add", "target": path or URL} objects on one line.
+
+CONNECT_TIMEOUT_MS = 200
+REPLY_TIMEOUT_MS = 2000
+
+
+def server_name(db_name: str = None):
+    # Same default as database.DB_NAME, which cannot be imported here without opening the database
+    db_name = db_name or os.environ.get("PAPERFLUX_DB", "research_library.db")
+    digest = hashlib.sha1(f"{getpass.getuser()}:{os.path.realpath(db_name)}".encode()).hexdigest()
+    return f"paperflux-{digest[:16]}"
+
+
+def normalize_target(target: str):
+    """URLs as given, files as absolute paths since the running instance has its own working directory."""
+    if target.startswith("file://"):
+        return unquote(urlparse(target).path)
+    if target.startswith(("https://", "http://")):
+        return target
+    return os.path.realpath(target)
+
+
+def parse_requests(arguments, add: bool = False):
+    """Requests for the paths and URLs among command line arguments, skipping options such as Qt's."""
+    add = add or "--add" in arguments
+    return [{"command": "add" if add else "open", "target": normalize_target(argument)}
+            for argument in arguments
+            if argument.startswith(("https://", "http://", "file://")) or os.path.isfile(argument)]
+
+
+def forward(requests: list, name: str = None):
+    """Send requests to the running instance; False when there is none."""
+    socket = QLocalSocket()
+    socket.connectToServer(name or server_name())
+    if not socket.waitForConnected(CONNECT_TIMEOUT_MS):
+        return False
+    socket.write((json.dumps(requests) + "\n").encode())
+    socket.waitForBytesWritten(REPLY_TIMEOUT_MS)
+    # The running instance answers as soon as it has queued the requests
+    if not socket.waitForReadyRead(REPLY_TIMEOUT_MS) or not bytes(socket.readAll()).startswith(b"ok"):
+        print("PaperFlux is running but did not answer")
+    socket.disconnectFromServer()
+    return True
+
+
+class InstanceServer(QObject):
+    Requested = pyqtSignal(list)
+
+    def __init__(self, name: str = None, parent=None):
+        super().__init__(parent)
+        self.name = name or server_name()
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.SocketOption.UserAccessOption)
+        self.server.newConnection.connect(self.accept)
+
+    def listen(self):
+        if self.server.listen(self.name):
+            return True
+        # A crashed instance leaves its socket file behind, forward() has just failed to connect to it
+        QLocalServer.removeServer(self.name)
+        if not self.server.listen(self.name):
+            print(f"Could not listen for other PaperFlux launches: {self.server.errorString()}")
+            return False
+        return True
+
+    def accept(self):
+        while (socket := self.server.nextPendingConnection()) is not None:
+            socket.readyRead.connect(lambda socket=socket: self.read(socket))
+            socket.disconnected.connect(socket.deleteLater)
+
+    def read(self, socket: QLocalSocket):
+        while socket.canReadLine():
+            try:
+                requests = json.loads(bytes(socket.readLine()))
+            except ValueError:
+                socket.write(b"error\n")
+                continue
+            socket.write(b"ok\n")
+            socket.flush()
+            self.Requested.emit(requests)
+
+    def close(self):
+        self.server.close()
@@ -0,0 +1,181 @@
+import datetime
+import json
+
+import database
+
+# A smart collection is a list of [kind, value] rules that must all hold. Its members live in
+# collection_members; triggers record every written paper in collection_dirty and refresh() only
+# re-evaluates those papers, plus whatever a time-relative rule lets in or out as the clock moves.
+
+RULE_KINDS = {
+    "added_within_days": "Added in the last N days",
+    "not_opened_for_days": "Not opened for N days",
+    "unread": "Never opened",
+    "title_contains": "Title contains",
+    "authors_contains": "Authors contain",
+    "abstract_contains": "Abstract contains",
+    "url_contains": "Website URL contains",
+    "in_folder": "In category (with subcategories)",
+    "has_tag": "Tagged",
+}
+
+PRESETS = {
+    "Added this week": [["added_within_days", 7]],
+    "Unread arXiv": [["unread", None], ["url_contains", "arxiv.org"]],
+    "Not opened in 6 months": [["not_opened_for_days", 182]],
+}
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def utc_cutoff(now: datetime.datetime, days):
+    # added_at is written by SQLite's CURRENT_TIMESTAMP, which is UTC
+    return (now.astimezone(datetime.timezone.utc) - datetime.timedelta(days=float(days))).strftime(TIME_FORMAT)
+
+
+def local_cutoff(now: datetime.datetime, days):
+    # last_view is written from datetime.now(), which is local time
+    return (now - datetime.timedelta(days=float(days))).strftime(TIME_FORMAT)
+
+
+def rule_predicate(kind: str, value, now: datetime.datetime):
+    """Translate one rule into an SQL condition on papers p and its parameters."""
+    if kind == "added_within_days":
+        return "p.added_at >= ?", (utc_cutoff(now, value),)
+    if kind == "not_opened_for_days":
+        # Never-opened papers count from when they were added, which is stored in UTC
+        return "(p.last_view < ? OR (p.last_view IS NULL AND p.added_at < ?))", (local_cutoff(now, value),
+                                                                                   utc_cutoff(now, value))
+    if kind == "unread":
+        return "p.last_view IS NULL", ()
+    if kind in ("title_contains", "authors_contains", "abstract_contains"):
+        return f"p.{kind.split('_')[0]} LIKE ?", (f"%{value}%",)
+    if kind == "url_contains":
+        return "p.website_url LIKE ?", (f"%{value}%",)
+    if kind == "in_folder":
+        return "p.folder_id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = ?)", (value,)
+    if kind == "has_tag":
+        return ("p.id IN (SELECT pt.paper_id FROM paper_tags pt INNER JOIN tags t ON pt.tag_id = t.id "
+                "WHERE t.tag_name = ?)"), (value,)
+    raise ValueError(f"Unknown smart collection rule: {kind}")
+
+
+def collection_predicate(rules, now: datetime.datetime):
+    conditions, args = ["p.is_active = TRUE"], []
+    for kind, value in rules:
+        condition, condition_args = rule_predicate(kind, value, now)
+        conditions.append(f"({condition})")
+        args.extend(condition_args)
+    return " AND ".join(conditions), tuple(args)
+
+
+def time_slice_candidates(rules, evaluated_at: datetime.datetime, now: datetime.datetime):
+    """
+    Statements adding to collection_candidates the papers that time alone may have moved in or out of
+    the collection since evaluated_at. Members are always re-checked, which covers papers leaving a
+    window; papers entering an "older than" window are found with index range scans on the time slice.
+    """
+    statements = []
+    if not any(kind in ("added_within_days", "not_opened_for_days") for kind, _ in rules):
+        return statements
+
+    statements.append(("""
+    INSERT OR IGNORE INTO temp.collection_candidates (paper_id)
+    SELECT paper_id FROM collection_members WHERE collection_id = ?
+    """, None))
+
+    for kind, value in rules:
+        if kind != "not_opened_for_days":
+            continue
+        old_local, new_local = local_cutoff(evaluated_at, value), local_cutoff(now, value)
+        old_utc, new_utc = utc_cutoff(evaluated_at, value), utc_cutoff(now, value)
+        statements.append(("""
+        INSERT OR IGNORE INTO temp.collection_candidates (paper_id)
+        SELECT id FROM papers WHERE is_active = TRUE AND last_view >= ? AND last_view < ?
+        """, (old_local, new_local)))
+        statements.append(("""
+        INSERT OR IGNORE INTO temp.collection_candidates (paper_id)
+        SELECT id FROM papers WHERE last_view IS NULL AND added_at >= ? AND added_at < ?
+        """, (old_utc, new_utc)))
+    return statements
+
+
+class SmartCollection:
+
+    @staticmethod
+    def insert_row(collection_name: str, rules: list):
+        now = datetime.datetime.now().astimezone()
+        predicate, args = collection_predicate(rules, now)
+        database.DATABASE.execute_in_transaction(
+            ("""
+            INSERT INTO collections (collection_name, rules, evaluated_at) VALUES (?, ?, ?)
+            """, (collection_name, json.dumps(rules), now.strftime(TIME_FORMAT))),
+            # The only full evaluation a collection ever gets
+            (f"""
+            INSERT INTO collection_members (collection_id, paper_id)
+            SELECT (SELECT id FROM collections WHERE collection_name = ?), p.id FROM papers p WHERE {predicate}
+            """, (collection_name, *args)),
+        )
+
+    @staticmethod
+    def remove(collection_id: int):
+        query = """
+        DELETE FROM collections WHERE id = ?
+        """
+        database.DATABASE.execute_with_args(query, (collection_id,))
+
+    @staticmethod
+    def get_all_collections():
+        query = """
+        SELECT id, collection_name, rules, evaluated_at FROM collections ORDER BY collection_name
+        """
+        return database.DATABASE.fetchall(query)
+
+    @staticmethod
+    def refresh():
+        """Bring every collection up to date with the papers written since the last refresh."""
+        collections = SmartCollection.get_all_collections()
+        if not collections:
+            return
+
+        now = datetime.datetime.now().astimezone()
+        statements = [("CREATE TEMP TABLE IF NOT EXISTS collection_candidates (paper_id INTEGER PRIMARY KEY)", ())]
+        for collection_id, _, rules, evaluated_at in collections:
+            rules = json.loads(rules)
+            evaluated_at = datetime.datetime.strptime(evaluated_at, TIME_FORMAT).astimezone()
+            predicate, args = collection_predicate(rules, now)
+
+            statements.append(("DELETE FROM temp.collection_candidates", ()))
+            statements.append(("""
+            INSERT INTO temp.collection_candidates (paper_id) SELECT paper_id FROM collection_dirty
+            """, ()))
+            for query, query_args in time_slice_candidates(rules, evaluated_at, now):
+                statements.append((query, (collection_id,) if query_args is None else query_args))
+            statements.append(("""
+            DELETE FROM collection_members
+            WHERE collection_id = ? AND paper_id IN (SELECT paper_id FROM temp.collection_candidates)
+            """, (collection_id,)))
+            statements.append((f"""
+            INSERT INTO collection_members (collection_id, paper_id)
+            SELECT ?, p.id FROM papers p
+            WHERE p.id IN (SELECT paper_id FROM temp.collection_candidates) AND {predicate}
+            """, (collection_id, *args)))
+            statements.append(("""
+            UPDATE collections SET evaluated_at = ? WHERE id = ?
+            """, (now.strftime(TIME_FORMAT), collection_id)))
+
+        statements.append(("DELETE FROM collection_dirty", ()))
+        database.DATABASE.execute_in_transaction(*statements)
+
+    @staticmethod
+    def get_papers(collection_id: int):
+        SmartCollection.refresh()
+        query = """
+        SELECT p.id, p.title, f.folder_name, p.file_path
+        FROM collection_members m
+        INNER JOIN papers p ON m.paper_id = p.id
+        INNER JOIN folders f ON p.folder_id = f.id
+        WHERE m.collection_id = ?
+        ORDER BY p.last_view DESC, p.added_at DESC
+        """
+        return database.DATABASE.fetchall(query, (collection_id,))
@@ -0,0 +1,213 @@
+import base64
+import datetime
+import mimetypes
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+# Single-file offline copies of web articles: the page is fetched once, scripts and event handlers are
+# stripped, stylesheets are inlined and images and the url()s of styles are embedded as data URIs, so
+# reopening it needs no network.
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/26.3 Safari/605.1.15",
+    "Accept-Language": "en-US,en;q=0.5",
+}
+TIMEOUT = 30
+ASSET_WORKERS = 8
+MAX_ASSET_BYTES = 5 * 1024 * 1024
+MAX_TOTAL_ASSET_BYTES = 30 * 1024 * 1024
+EXCERPT_LENGTH = 600
+STRIPPED_TAGS = ("script", "noscript", "iframe", "object", "embed", "base")
+# Attributes a browser follows or loads, and the schemes in them that would run code
+URL_ATTRIBUTES = ("href", "src", "action", "formaction", "xlink:href")
+SCRIPT_SCHEMES = ("javascript:", "vbscript:")
+# SVG elements that can set those attributes after the page has loaded
+ANIMATION_TAGS = ("animate", "set")
+# url(...) and @import "..." in CSS, quoted or not
+CSS_URL = re.compile(r"""url\(\s*(["']?)(.*?)\1\s*\)|@import\s+(["'])(.*?)\3""", re.IGNORECASE | re.DOTALL)
+
+
+def fetch(url: str):
+    import requests
+
+    response = requests.get(url, timeout=TIMEOUT, headers=HEADERS)
+    response.raise_for_status()
+    return response
+
+
+def fetch_asset(url: str):
+    try:
+        response = fetch(url)
+    except Exception as e:
+        print(f"Could not fetch {url}: {e}")
+        return url, None, None
+    if len(response.content) > MAX_ASSET_BYTES:
+        return url, None, None
+    content_type = response.headers.get("Content-Type", "").split(";")[0] or mimetypes.guess_type(url)[0]
+    return url, content_type, response.content
+
+
+def fetch_assets(urls):
+    """{url: (content_type, content)}, content None for assets that could not be fetched."""
+    with ThreadPoolExecutor(max_workers=ASSET_WORKERS) as executor:
+        return {url: (content_type, content)
+                for url, content_type, content in executor.map(fetch_asset, sorted(urls))}
+
+
+def image_source(img):
+    # Lazy-loaded images keep the real address in data-src or the first srcset candidate
+    for attribute in ("src", "data-src"):
+        if (value := img.get(attribute)) and not value.startswith("data:"):
+            return value
+    srcset = img.get("srcset") or ""
+    return srcset.split(",")[0].split()[0] if srcset.strip() else None
+
+
+def runs_script(value: str):
+    # Browsers ignore whitespace and control characters inside the scheme, as in "java\tscript:"
+    scheme = "".join(character for character in value if character > " ").lower()
+    return scheme.startswith(SCRIPT_SCHEMES)
+
+
+def css_reference(match):
+    return (match.group(2) if match.group(3) is None else match.group(4)).strip()
+
+
+def is_fetched(reference: str):
+    # data: URIs are already embedded and #fragments point into the page itself
+    return bool(reference) and not reference.lower().startswith(("data:", "#")) and not runs_script(reference)
+
+
+def css_references(css: str, base: str):
+    """Absolute URLs of the url()s and @imports in css that a browser would fetch."""
+    return {urljoin(base, reference) for reference in map(css_reference, CSS_URL.finditer(css))
+            if is_fetched(reference)}
+
+
+def css_string(value: str):
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\a ")
+    return f'"{escaped}"'
+
+
+def rewrite_css(css: str, base: str, replacement):
+    """css with every fetched reference replaced by replacement(absolute_url), those that run code by none."""
+    def rewrite(match):
+        prefix, reference = "" if match.group(3) is None else "@import ", css_reference(match)
+        if runs_script(reference):
+            return prefix + "none"
+        if not is_fetched(reference):
+            return match.group(0)
+        return f"{prefix}url({css_string(replacement(urljoin(base, reference)))})"
+
+    return CSS_URL.sub(rewrite, css)
+
+
+def data_uri(content_type: str, content: bytes):
+    return f"data:{content_type};base64,{base64.b64encode(content).decode('ascii')}"
+
+
+def readable_text(soup):
+    """The article text: the <article> element when there is one, otherwise the body."""
+    root = soup.find("article") or soup.body or soup
+    return " ".join(root.get_text(" ").split())
+
+
+def capture(url: str):
+    """Return (html, text) for a sanitized single-file snapshot of url and its readable text."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(fetch(url).text, "html.parser")
+
+    for tag in soup.find_all(STRIPPED_TAGS):
+        tag.decompose()
+    # A refresh would navigate the offline copy away, back to the site or anywhere else
+    for tag in soup.find_all("meta", attrs={"http-equiv": re.compile("^refresh$", re.IGNORECASE)}):
+        tag.decompose()
+    # An animated href would be neither checked for script URLs nor made absolute
+    for tag in soup.find_all(ANIMATION_TAGS):
+        if any(name.lower() == "attributename" and isinstance(value, str) and value.strip().lower() in URL_ATTRIBUTES
+               for name, value in tag.attrs.items()):
+            tag.decompose()
+    for tag in soup.find_all(True):
+        for attribute in [attribute for attribute in tag.attrs if attribute.lower().startswith("on")]:
+            del tag[attribute]
+        for attribute in [attribute for attribute in tag.attrs if attribute.lower() in URL_ATTRIBUTES]:
+            if isinstance(tag[attribute], str) and runs_script(tag[attribute]):
+                del tag[attribute]
+        if tag.name == "a" and tag.get("href"):
+            tag["href"] = urljoin(url, tag["href"])
+    text = readable_text(soup)
+
+    stylesheets = [link for link in soup.find_all("link", rel="stylesheet") if link.get("href")]
+    images = [(img, source) for img in soup.find_all("img") if (source := image_source(img))]
+    # <picture> sources would win over the embedded <img>
+    for source in soup.find_all("source"):
+        source.decompose()
+
+    asset_urls = {urljoin(url, link["href"]) for link in stylesheets}
+    asset_urls |= {urljoin(url, source) for _, source in images}
+    assets = fetch_assets(asset_urls)
+
+    # (tag, attribute or None for the text, css, URL its references are relative to)
+    styles = [(style, None, style.get_text(), url) for style in soup.find_all("style")]
+    styles += [(tag, "style", tag["style"], url) for tag in soup.find_all(style=True) if isinstance(tag["style"], str)]
+    for link in stylesheets:
+        stylesheet_url = urljoin(url, link["href"])
+        content_type, content = assets.get(stylesheet_url, (None, None))
+        if content is None:
+            link.decompose()
+            continue
+        style = soup.new_tag("style")
+        link.replace_with(style)
+        styles.append((style, None, content.decode("utf-8", errors="replace"), stylesheet_url))
+    # Fonts, backgrounds and imports the styles load, relative to the stylesheet they are in
+    css_urls = set().union(*(css_references(css, base) for _, _, css, base in styles)) - assets.keys()
+    assets |= fetch_assets(css_urls)
+
+    embedded_bytes = 0
+
+    def embedded(asset_url: str, default_type: str):
+        """asset_url as a data URI while the total stays within MAX_TOTAL_ASSET_BYTES, otherwise as it is."""
+        nonlocal embedded_bytes
+        content_type, content = assets.get(asset_url, (None, None))
+        if content is None or embedded_bytes + len(content) > MAX_TOTAL_ASSET_BYTES:
+            return asset_url
+        embedded_bytes += len(content)
+        return data_uri(content_type or default_type, content)
+
+    for img, source in images:
+        for attribute in ("srcset", "data-src", "loading"):
+            if attribute in img.attrs:
+                del img[attribute]
+        img["src"] = embedded(urljoin(url, source), "image/png")
+
+    for tag, attribute, css, base in styles:
+        css = rewrite_css(css, base, lambda asset_url: embedded(asset_url, "application/octet-stream"))
+        if attribute is None:
+            tag.string = css
+        else:
+            tag[attribute] = css
+
+    taken_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    html = f'<!DOCTYPE html>\n<!-- Snapshot of {url} taken {taken_at} -->\n{soup}'
+    if not re.search(r"<meta[^>]+charset", html[:2048], re.IGNORECASE):
+        html = html.replace("<head>", '<head><meta charset="utf-8">', 1)
+    return html, text
+
+
+def excerpt(text: str):
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    return text[:EXCERPT_LENGTH].rsplit(" ", 1)[0] + " …"
+
+
+def save_snapshot(url: str, file_path: str):
+    """Write the snapshot of url to file_path and return the article text."""
+    html, text = capture(url)
+    temporary_path = f"{file_path}.part"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        f.write(html)
+    os.replace(temporary_path, file_path)
+    return text
@@ -0,0 +1,51 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# Set PAPERFLUX_STARTUP_TIMING=1 to print the report, or to a file path to also write it as JSON.
+STARTUP_TIMING_ENV = "PAPERFLUX_STARTUP_TIMING"
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.imports = []
+        self.marks = []
+        self.reported = False
+
+    @contextmanager
+    def measure_import(self, module_name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.imports.append((module_name, time.perf_counter() - started))
+
+    def mark(self, name: str):
+        self.marks.append((name, time.perf_counter() - self.start))
+
+    def as_dict(self):
+        return {
+            "imports_ms": {name: round(elapsed * 1000, 2) for name, elapsed in self.imports},
+            "marks_ms": {name: round(elapsed * 1000, 2) for name, elapsed in self.marks},
+        }
+
+    def report(self):
+        setting = os.environ.get(STARTUP_TIMING_ENV)
+        if not setting or self.reported:
+            return
+        self.reported = True
+
+        print("PaperFlux startup timing")
+        for name, elapsed in self.imports:
+            print(f"  import {name:<24} {elapsed * 1000:8.2f} ms")
+        for name, elapsed in self.marks:
+            print(f"  {name:<31} {elapsed * 1000:8.2f} ms")
+
+        if setting not in ("1", "true", "yes"):
+            with open(setting, "w") as f:
+                json.dump(self.as_dict(), f, indent=2)
+
+
+STARTUP_TIMER = StartupTimer()
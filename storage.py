@@ -0,0 +1,172 @@
+import os
+import re
+import urllib.request as request
+from uuid import uuid4
+
+import database
+from tracing import TRACER
+from utils import FILE_PATH
+
+# Disk quota for the downloads directory. When it is exceeded, the least recently viewed downloads that
+# can be fetched again from their website_url are deleted; render_item downloads them again on open.
+
+QUOTA_ENV = "PAPERFLUX_STORAGE_QUOTA_MB"
+DEFAULT_QUOTA_MB = 2048
+
+
+def quota_bytes():
+    return int(float(os.environ.get(QUOTA_ENV, DEFAULT_QUOTA_MB)) * 1024 * 1024)
+
+
+def download_url(website_url: str):
+    # arXiv abstract pages are saved for PDFs that carried their arXiv id, fetch the PDF itself
+    return re.sub(r"^(https?://arxiv\.org/)abs/", r"\1pdf/", website_url)
+
+
+def file_size(file_path: str):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return None
+
+
+def download(website_url: str, file_path: str, progress=None):
+    """
+    Download into a temporary file and move it in place, so nobody ever opens a half-written file.
+    progress(done_bytes, total_bytes or None) is called as blocks arrive; raising from it aborts the download.
+    """
+    with TRACER.span("download", "network", {"url": website_url, "file_path": file_path}):
+        if file_path.endswith(".html"):
+            from snapshot import save_snapshot
+
+            # Offline copies of articles are captured again rather than saved as the raw page
+            save_snapshot(website_url, file_path)
+            return
+
+        temporary_path = f"{file_path}.{uuid4().hex}.part"
+        try:
+            reporthook = None if progress is None else \
+                lambda blocks, block_size, total: progress(blocks * block_size, total if total > 0 else None)
+            request.urlretrieve(download_url(website_url), temporary_path, reporthook)
+            os.replace(temporary_path, file_path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+
+def set_aside(papers: list, quota: int, keep=()):
+    """
+    First half of Storage.evict, without the database so that it can run in a background job: rename the
+    least recently viewed, unpinned, re-downloadable files of get_eviction_candidates rows until the rest fit
+    in quota bytes. Returns [(paper_id, file_path, evicting_path, last_view, size)] for finish_eviction.
+    """
+    papers = [(paper, size) for paper in papers if (size := file_size(paper[1])) is not None]
+    total = sum(size for _, size in papers)
+
+    set_aside_files = []
+    for (paper_id, file_path, website_url, last_view, _, pinned), size in papers:
+        if total <= quota:
+            break
+        if pinned or not website_url or paper_id in keep:
+            continue
+
+        # Renaming is atomic: an open that races with eviction either gets the whole file or none and
+        # downloads it again. A reader that already has the file open keeps reading it after the unlink.
+        evicting_path = f"{file_path}.{uuid4().hex}.evicting"
+        try:
+            os.rename(file_path, evicting_path)
+        except OSError:
+            continue
+        total -= size
+        set_aside_files.append((paper_id, file_path, evicting_path, last_view, size))
+    return set_aside_files
+
+
+class Storage:
+
+    @staticmethod
+    def pin(paper_id: int, pinned: bool):
+        query = "INSERT OR IGNORE INTO pinned_papers (paper_id) VALUES (?)" if pinned else \
+            "DELETE FROM pinned_papers WHERE paper_id = ?"
+        database.DATABASE.execute_with_args(query, (paper_id,))
+
+    @staticmethod
+    def is_pinned(paper_id: int):
+        query = """
+        SELECT 1 FROM pinned_papers WHERE paper_id = ?
+        """
+        return database.DATABASE.fetchone(query, (paper_id,)) is not None
+
+    @staticmethod
+    def get_downloaded_papers():
+        """Papers stored under the downloads directory, least recently viewed first."""
+        query = """
+        SELECT p.id, p.file_path, p.website_url, p.last_view, f.folder_name, pp.paper_id IS NOT NULL
+        FROM papers p
+        INNER JOIN folders f ON p.folder_id = f.id
+        LEFT JOIN pinned_papers pp ON pp.paper_id = p.id
+        WHERE substr(p.file_path, 1, length(?)) = ? AND p.is_active = TRUE
+        ORDER BY COALESCE(p.last_view, p.added_at) ASC
+        """
+        # A plain prefix comparison: LIKE would read _ and % in the downloads path as wildcards
+        prefix = os.path.join(FILE_PATH, "")
+        return database.DATABASE.fetchall(query, (prefix, prefix))
+
+    @staticmethod
+    def get_last_view(paper_id: int):
+        query = """
+        SELECT last_view FROM papers WHERE id = ?
+        """
+        last_view = database.DATABASE.fetchone(query, (paper_id,))
+        return last_view[0] if last_view else None
+
+    @staticmethod
+    def usage():
+        """Per folder: downloaded files, bytes on disk and bytes that eviction could free."""
+        folders = {}
+        for _, file_path, website_url, _, folder_name, pinned in Storage.get_downloaded_papers():
+            size = file_size(file_path)
+            if size is None:
+                continue
+            folder = folders.setdefault(folder_name, {"folder_name": folder_name, "files": 0, "bytes": 0,
+                                                      "evictable_bytes": 0})
+            folder["files"] += 1
+            folder["bytes"] += size
+            if website_url and not pinned:
+                folder["evictable_bytes"] += size
+        return sorted(folders.values(), key=lambda folder: folder["bytes"], reverse=True)
+
+    @staticmethod
+    def get_eviction_candidates():
+        """get_downloaded_papers after committing the views still waiting in write-behind."""
+        database.DATABASE.flush()
+        return Storage.get_downloaded_papers()
+
+    @staticmethod
+    def finish_eviction(set_aside_files):
+        """
+        Delete the files set_aside moved out of the way, or put back those whose paper was opened meanwhile.
+        Returns [(paper_id, file_path, size)] of evicted files.
+        """
+        evicted = []
+        for paper_id, file_path, evicting_path, last_view, size in set_aside_files:
+            if Storage.get_last_view(paper_id) != last_view:
+                # Opened since the candidates were listed, put it back unless it was downloaded again meanwhile
+                if os.path.exists(file_path):
+                    os.remove(evicting_path)
+                else:
+                    os.replace(evicting_path, file_path)
+                continue
+            os.remove(evicting_path)
+            evicted.append((paper_id, file_path, size))
+        return evicted
+
+    @staticmethod
+    def evict(quota: int = None, keep=()):
+        """
+        Delete least recently viewed, unpinned, re-downloadable files until the downloads fit in quota bytes.
+        Papers in keep (the one on screen) are skipped. Returns [(paper_id, file_path, size)] of evicted files.
+        """
+        quota = quota_bytes() if quota is None else quota
+        return Storage.finish_eviction(set_aside(Storage.get_eviction_candidates(), quota, keep))
+
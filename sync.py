@@ -0,0 +1,441 @@
+import json
+import os
+import re
+import socket
+import threading
+import urllib.request as request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+from uuid import uuid4
+
+import database
+from database import Folder
+from utils import FILE_PATH
+
+# Incremental sync between machines. Triggers (migration 12) log every paper and folder write with its changed
+# columns and a Lamport clock. A sync pulls the other replicas' changes since the last one applied here and
+# pushes this replica's new ones, through a shared directory or a sync server (serve() below) that stores
+# them the same way. Each column resolves to the value written with the highest (clock, replica), so every
+# machine ends in the same state whatever order the changes arrive in. Values that lost to a later write
+# are compacted out of the log once they have been exchanged.
+
+SYNC_ENV = "PAPERFLUX_SYNC"
+APPLY_BATCH = 1000
+TIMEOUT = 30
+# How long closing the window waits for its last sync to finish
+CLOSE_TIMEOUT_MS = 5000
+DEFAULT_PORT = 8765
+# Files under the downloads directory are synced relative to it, since it moves with the install
+DOWNLOADS = "{downloads}"
+REPLICA = re.compile(r"^[0-9a-f]{32}$")
+
+
+def portable_path(file_path):
+    if file_path and file_path.startswith(FILE_PATH + os.sep):
+        return DOWNLOADS + file_path[len(FILE_PATH):]
+    return file_path
+
+
+def local_path(file_path):
+    if file_path and file_path.startswith(DOWNLOADS):
+        return FILE_PATH + file_path[len(DOWNLOADS):]
+    return file_path
+
+
+def log_file_name(first_seq: int, last_seq: int):
+    return f"{first_seq:012d}-{last_seq:012d}.jsonl"
+
+
+class DirectoryTransport:
+    """One directory per replica, holding its changes as append-only JSON-lines files only it writes to."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def replicas(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if REPLICA.match(name))
+
+    def pull(self, replica: str, after_seq: int):
+        directory = os.path.join(self.root, replica)
+        for file_name in sorted(os.listdir(directory)):
+            if not file_name.endswith(".jsonl") or int(file_name[13:25]) <= after_seq:
+                continue
+            with open(os.path.join(directory, file_name), encoding="utf-8") as f:
+                yield from f
+
+    def push(self, replica: str, first_seq: int, last_seq: int, lines: list):
+        directory = os.path.join(self.root, replica)
+        os.makedirs(directory, exist_ok=True)
+        data = "".join(lines).encode("utf-8")
+        temporary_path = os.path.join(directory, f".{uuid4().hex}.part")
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, os.path.join(directory, log_file_name(first_seq, last_seq)))
+        return len(data)
+
+
+class HttpTransport:
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def replicas(self):
+        with request.urlopen(f"{self.url}/replicas", timeout=TIMEOUT) as response:
+            return json.load(response)
+
+    def pull(self, replica: str, after_seq: int):
+        with request.urlopen(f"{self.url}/changes/{quote(replica)}?after={after_seq}", timeout=TIMEOUT) as response:
+            for line in response:
+                yield line.decode("utf-8")
+
+    def push(self, replica: str, first_seq: int, last_seq: int, lines: list):
+        data = "".join(lines).encode("utf-8")
+        url = f"{self.url}/changes/{quote(replica)}?first={first_seq}&last={last_seq}"
+        with request.urlopen(request.Request(url, data=data, method="POST"), timeout=TIMEOUT):
+            pass
+        return len(data)
+
+
+def transport_for(target: str):
+    return HttpTransport(target) if target.startswith(("http://", "https://")) else DirectoryTransport(target)
+
+
+class Sync:
+
+    @staticmethod
+    def get_state(key: str):
+        row = database.DATABASE.fetchone("SELECT value FROM sync_state WHERE key = ?", (key,))
+        return row[0] if row else None
+
+    @staticmethod
+    def set_state(key: str, value):
+        query = """
+        INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)
+        """
+        database.DATABASE.execute_with_args(query, (key, value))
+
+    @staticmethod
+    def ensure_replica():
+        """
+        The replica id, minted again when the database was copied to another machine or path, so that the two
+        copies do not publish different changes under one id.
+        """
+        db_path = database.DATABASE.fetchone("PRAGMA database_list")[2]
+        home = f"{socket.gethostname()}:{os.path.realpath(db_path)}"
+        replica = Sync.get_state("replica")
+        known_home = Sync.get_state("replica_home")
+        if known_home is not None and known_home != home:
+            pushed_seq = Sync.get_state("pushed_seq")
+            new_replica = uuid4().hex
+            database.DATABASE.execute_in_transaction(
+                ("""
+                UPDATE change_log SET replica = ? WHERE replica = ? AND origin_seq IS NULL AND seq > ?
+                """, (new_replica, replica, pushed_seq)),
+                # What the old id already published is in this copy
+                ("INSERT OR REPLACE INTO sync_peers (replica, pulled_seq) VALUES (?, ?)", (replica, pushed_seq)),
+                ("UPDATE sync_state SET value = ? WHERE key = 'replica'", (new_replica,)),
+            )
+            replica = new_replica
+        if known_home != home:
+            Sync.set_state("replica_home", home)
+        return replica
+
+    @staticmethod
+    def get_pulled_seq(replica: str):
+        row = database.DATABASE.fetchone("SELECT pulled_seq FROM sync_peers WHERE replica = ?", (replica,))
+        return row[0] if row else 0
+
+    @staticmethod
+    def get_local_changes(replica: str, after_seq: int):
+        query = """
+        SELECT seq, entity, entity_key, fields, clock
+        FROM change_log
+        WHERE seq > ? AND replica = ? AND origin_seq IS NULL
+        ORDER BY seq
+        """
+        for seq, entity, entity_key, fields, clock in database.DATABASE.iterate(query, (after_seq, replica)):
+            fields = json.loads(fields)
+            if "file_path" in fields:
+                fields["file_path"] = portable_path(fields["file_path"])
+            yield {"seq": seq, "entity": entity, "key": entity_key, "fields": fields, "clock": clock,
+                   "replica": replica}
+
+    @staticmethod
+    def merged_state(entity: str, entity_key: str):
+        query = """
+        SELECT fields FROM change_log WHERE entity = ? AND entity_key = ? ORDER BY clock, replica, seq
+        """
+        state = {}
+        for (fields,) in database.DATABASE.fetchall(query, (entity, entity_key)):
+            state.update(json.loads(fields))
+        return state
+
+    @staticmethod
+    def compact():
+        """
+        Shrink the history of the entities written since the last compaction to the rows that still win a column.
+        merged_state keeps, per column, the value with the highest (clock, replica), so dropping the values a row
+        has lost gives the same state with every change that can still arrive. Local rows stay whole until they
+        are pushed, when every peer can read them from the shared log.
+        """
+        compacted_seq = Sync.get_state("compacted_seq") or 0
+        unpushed = database.DATABASE.fetchone("""
+        SELECT MIN(seq) FROM change_log WHERE seq > ? AND origin_seq IS NULL
+        """, (Sync.get_state("pushed_seq"),))[0]
+        last_seq = (unpushed or database.DATABASE.fetchone("SELECT MAX(seq) + 1 FROM change_log")[0] or 1) - 1
+        if last_seq <= compacted_seq:
+            return
+
+        query = """
+        SELECT entity, entity_key FROM (
+            SELECT DISTINCT entity, entity_key FROM change_log WHERE seq > ? AND seq <= ?
+        ) t
+        WHERE (SELECT COUNT(*) FROM change_log c WHERE c.entity = t.entity AND c.entity_key = t.entity_key) > 1
+        """
+        statements = []
+        for entity, entity_key in database.DATABASE.fetchall(query, (compacted_seq, last_seq)):
+            rows = [(seq, json.loads(fields)) for seq, fields in database.DATABASE.fetchall("""
+            SELECT seq, fields FROM change_log WHERE entity = ? AND entity_key = ? ORDER BY clock, replica, seq
+            """, (entity, entity_key))]
+            winners = {column: seq for seq, fields in rows for column in fields}
+            for seq, fields in rows:
+                if seq > last_seq:
+                    continue
+                kept = {column: value for column, value in fields.items() if winners[column] == seq}
+                if not kept:
+                    statements.append(("DELETE FROM change_log WHERE seq = ?", (seq,)))
+                elif len(kept) < len(fields):
+                    statements.append(("UPDATE change_log SET fields = ? WHERE seq = ?", (json.dumps(kept), seq)))
+        statements.append(("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('compacted_seq', ?)", (last_seq,)))
+        database.DATABASE.execute_in_transaction(*statements)
+
+    @staticmethod
+    def folder_id(folder_name: str):
+        """Id of folder_name, created at the top level when a paper or subfolder arrives before it."""
+        if folder_name is None:
+            return 0
+        row = database.DATABASE.fetchone("SELECT id FROM folders WHERE folder_name = ?", (folder_name,))
+        if row is None:
+            database.DATABASE.execute("INSERT INTO folders (folder_name, parent_folder_id) VALUES (?, 0)",
+                                      (folder_name,))
+            row = database.DATABASE.fetchone("SELECT id FROM folders WHERE folder_name = ?", (folder_name,))
+        return row[0]
+
+    @staticmethod
+    def apply_folder(folder_name: str, state: dict):
+        row = database.DATABASE.fetchone("SELECT id, parent_folder_id FROM folders WHERE folder_name = ?",
+                                         (folder_name,))
+        if state.get("_deleted"):
+            # The default category is never removed, papers fall back to it
+            if row is None or row[0] == 1:
+                return
+            folder_id = row[0]
+            for (child_id,) in database.DATABASE.fetchall("SELECT id FROM folders WHERE parent_folder_id = ?",
+                                                          (folder_id,)):
+                for query, args in Folder.move_folder_statements(child_id, 0):
+                    database.DATABASE.execute(query, args)
+            database.DATABASE.execute("UPDATE papers SET folder_id = 1 WHERE folder_id = ?", (folder_id,))
+            database.DATABASE.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
+            return
+
+        parent_id = Sync.folder_id(state.get("parent"))
+        if row is None:
+            database.DATABASE.execute("INSERT INTO folders (folder_name, parent_folder_id) VALUES (?, ?)",
+                                      (folder_name, parent_id))
+        elif row[1] != parent_id:
+            if Folder.is_in_subtree(parent_id, row[0]):
+                print(f"Sync: not moving {folder_name} into its own subtree")
+                return
+            for query, args in Folder.move_folder_statements(row[0], parent_id):
+                database.DATABASE.execute(query, args)
+
+    @staticmethod
+    def apply_paper(arxiv_id: str, state: dict):
+        row = database.DATABASE.fetchone("SELECT id FROM papers WHERE arxiv_id = ?", (arxiv_id,))
+        if state.get("_deleted"):
+            if row is not None:
+                database.DATABASE.execute("DELETE FROM papers WHERE id = ?", (row[0],))
+            return
+        if "title" not in state or "file_path" not in state:
+            # Created on a replica not pulled yet
+            return
+
+        file_path = local_path(state["file_path"])
+        # The same paper added on two machines has two keys; the smaller key wins everywhere
+        query = """
+        SELECT id, arxiv_id FROM papers WHERE (title = ? OR file_path = ? OR doi = ?) AND arxiv_id != ?
+        """
+        for clash_id, clash_key in database.DATABASE.fetchall(query, (state["title"], file_path, state.get("doi"),
+                                                                      arxiv_id)):
+            if clash_key < arxiv_id:
+                return
+            database.DATABASE.execute("DELETE FROM papers WHERE id = ?", (clash_id,))
+
+        folder_id = Sync.folder_id(state["folder"]) if state.get("folder") else 1
+        values = (state["title"], state.get("authors"), state.get("abstract"), file_path, state.get("website_url"),
+                  state.get("added_at"), state.get("last_view"), folder_id, state.get("is_active", 1), state.get("doi"))
+        if row is None:
+            query = """
+            INSERT INTO papers (title, authors, abstract, file_path, website_url, added_at, last_view, folder_id,
+                                is_active, doi, arxiv_id)
+            VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?)
+            """
+            database.DATABASE.execute(query, (*values, arxiv_id))
+        else:
+            query = """
+            UPDATE papers SET title = ?, authors = ?, abstract = ?, file_path = ?, website_url = ?,
+                              added_at = COALESCE(?, added_at), last_view = ?, folder_id = ?, is_active = ?, doi = ?
+            WHERE id = ?
+            """
+            database.DATABASE.execute(query, (*values, row[0]))
+
+    @staticmethod
+    def apply(replica: str, entries: list):
+        """Apply one batch of another replica's changes in a single transaction, without logging them again."""
+        with database.DATABASE.transaction():
+            database.DATABASE.execute("UPDATE sync_state SET value = 1 WHERE key = 'applying'")
+            affected = {}
+            for entry in entries:
+                fields = entry["fields"]
+                if "file_path" in fields:
+                    fields["file_path"] = local_path(fields["file_path"])
+                query = """
+                INSERT INTO change_log (entity, entity_key, fields, clock, replica, origin_seq)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """
+                database.DATABASE.execute(query, (entry["entity"], entry["key"], json.dumps(fields), entry["clock"],
+                                                  replica, entry["seq"]))
+                affected[entry["entity"], entry["key"]] = True
+
+            # Lamport clock: later local changes order after everything seen so far
+            database.DATABASE.execute("UPDATE sync_state SET value = MAX(value, ?) WHERE key = 'clock'",
+                                      (max(entry["clock"] for entry in entries),))
+            for entity, entity_key in sorted(affected, key=lambda affected_key: affected_key[0] != "folder"):
+                state = Sync.merged_state(entity, entity_key)
+                if entity == "folder":
+                    Sync.apply_folder(entity_key, state)
+                else:
+                    Sync.apply_paper(entity_key, state)
+
+            database.DATABASE.execute("INSERT OR REPLACE INTO sync_peers VALUES (?, ?)",
+                                      (replica, max(entry["seq"] for entry in entries)))
+            database.DATABASE.execute("UPDATE sync_state SET value = 0 WHERE key = 'applying'")
+
+
+def get_target():
+    return os.environ.get(SYNC_ENV) or Sync.get_state("target")
+
+
+def prepare(target: str = None):
+    """The database half of a sync's start: (transport, replica, pulled seq per known peer, lines to push)."""
+    transport = transport_for(target or get_target())
+    replica = Sync.ensure_replica()
+    pulled_seqs = dict(database.DATABASE.fetchall("SELECT replica, pulled_seq FROM sync_peers"))
+    lines = [json.dumps(change, separators=(",", ":")) + "\n"
+             for change in Sync.get_local_changes(replica, Sync.get_state("pushed_seq"))]
+    return transport, replica, pulled_seqs, lines
+
+
+def exchange(transport, replica: str, pulled_seqs: dict, lines: list, progress=None):
+    """
+    The network half, without the database so that it can run in a background job: pull the other replicas'
+    new changes and push lines. Returns ({peer: (changes as JSON lines, bytes)}, pushed bytes or None).
+    progress() is called between transfers; raising from it aborts the exchange.
+    """
+    pulled = {}
+    for peer in transport.replicas():
+        if peer == replica:
+            continue
+        if progress is not None:
+            progress()
+        after_seq, changes, size = pulled_seqs.get(peer, 0), [], 0
+        for line in transport.pull(peer, after_seq):
+            size += len(line)
+            if line.strip() and json.loads(line)["seq"] > after_seq:
+                changes.append(line)
+        if changes:
+            pulled[peer] = (changes, size)
+
+    pushed = None
+    if lines:
+        if progress is not None:
+            progress()
+        first_seq, last_seq = json.loads(lines[0])["seq"], json.loads(lines[-1])["seq"]
+        pushed = transport.push(replica, first_seq, last_seq, lines)
+    return pulled, pushed
+
+
+def finish(replica: str, pulled: dict, pushed, lines: list):
+    """The database half of a sync's end: apply what exchange pulled and record what it pushed."""
+    for peer, (changes, size) in pulled.items():
+        for start in range(0, len(changes), APPLY_BATCH):
+            Sync.apply(peer, [json.loads(line) for line in changes[start:start + APPLY_BATCH]])
+        yield {"status": "pulled", "replica": peer, "changes": len(changes), "bytes": size}
+
+    if pushed is not None:
+        Sync.set_state("pushed_seq", json.loads(lines[-1])["seq"])
+        yield {"status": "pushed", "replica": replica, "changes": len(lines), "bytes": pushed}
+    Sync.compact()
+
+
+def sync(target: str = None):
+    """Pull, then push. Yields {"status": pulled or pushed, "replica", "changes", "bytes"} per replica."""
+    transport, replica, pulled_seqs, lines = prepare(target)
+    yield from finish(replica, *exchange(transport, replica, pulled_seqs, lines), lines)
+
+
+# ==================================================================================================
+# Stand-in sync server: the directory layout behind HTTP
+
+
+class SyncRequestHandler(BaseHTTPRequestHandler):
+    store: DirectoryTransport = None
+    lock = threading.Lock()
+
+    def replica(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "changes" and REPLICA.match(parts[1]):
+            return parts[1]
+        self.send_error(404)
+        return None
+
+    def query(self, name: str):
+        return int(parse_qs(urlparse(self.path).query).get(name, ["0"])[0])
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/replicas":
+            body = json.dumps(self.store.replicas()).encode("utf-8")
+        elif (replica := self.replica()) is not None:
+            if replica not in self.store.replicas():
+                body = b""
+            else:
+                body = "".join(self.store.pull(replica, self.query("after"))).encode("utf-8")
+        else:
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if (replica := self.replica()) is None:
+            return
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        with self.lock:
+            self.store.push(replica, self.query("first"), self.query("last"), [data])
+        self.send_response(204)
+        self.end_headers()
+
+
+def serve(directory: str, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+    handler = type("Handler", (SyncRequestHandler,), {"store": DirectoryTransport(directory)})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving sync changes from {directory} on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
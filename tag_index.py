@@ -0,0 +1,99 @@
+from database import Tag
+
+# In-memory tag index: one bitmap per tag, stored as a Python int where bit n is set when paper n carries the tag.
+# AND/OR/NOT over hundreds of tags are then a handful of big-integer operations.
+
+
+def bitmap_to_ids(bitmap: int):
+    ids = set()
+    for index, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")):
+        while byte:
+            lowest = byte & -byte
+            ids.add(index * 8 + lowest.bit_length() - 1)
+            byte ^= lowest
+    return ids
+
+
+def parse_filter(text: str):
+    """
+    Parse a tag filter such as "ml vision|nlp -survey" into (all_of, not_of) where all_of is a list of
+    OR groups that must all match and not_of lists tags that must not be present.
+    """
+    all_of, not_of = [], []
+    for term in text.split():
+        if term.startswith("-") and len(term) > 1:
+            not_of.append(term[1:])
+        elif options := [option for option in term.split("|") if option]:
+            all_of.append(options)
+    return all_of, not_of
+
+
+class TagIndex:
+    def __init__(self):
+        self.bitmaps = {}
+        self.loaded = False
+
+    def load(self):
+        self.bitmaps.clear()
+        for tag_name, paper_id in Tag.get_all_paper_tags():
+            self.bitmaps[tag_name] = self.bitmaps.get(tag_name, 0) | (1 << paper_id)
+        self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def tag_names(self):
+        self.ensure_loaded()
+        return sorted(self.bitmaps)
+
+    def set_paper_tags(self, paper_id: int, tag_names):
+        tag_names = sorted({tag_name.strip() for tag_name in tag_names if tag_name.strip()})
+        Tag.set_tags_for_paper(paper_id, tag_names)
+
+        self.ensure_loaded()
+        bit = 1 << paper_id
+        for tag_name in list(self.bitmaps):
+            self.bitmaps[tag_name] &= ~bit
+            if not self.bitmaps[tag_name]:
+                del self.bitmaps[tag_name]
+        for tag_name in tag_names:
+            self.bitmaps[tag_name] = self.bitmaps.get(tag_name, 0) | bit
+
+    def match(self, text: str):
+        """
+        Return (paper_ids, exclude): the papers matching the filter, or with exclude set, the papers to drop
+        because the filter only has NOT terms. Returns None when the filter is empty.
+        """
+        all_of, not_of = parse_filter(text)
+        if not all_of and not not_of:
+            return None
+
+        self.ensure_loaded()
+        bitmap = None
+        for options in all_of:
+            group = 0
+            for tag_name in options:
+                group |= self.bitmaps.get(tag_name, 0)
+            bitmap = group if bitmap is None else bitmap & group
+
+        excluded = 0
+        for tag_name in not_of:
+            excluded |= self.bitmaps.get(tag_name, 0)
+
+        if bitmap is None:
+            return bitmap_to_ids(excluded), True
+        return bitmap_to_ids(bitmap & ~excluded), False
+
+    def filter_papers(self, papers: list, text: str):
+        """Keep the (id, ...) rows of papers that match the tag filter."""
+        matched = self.match(text)
+        if matched is None:
+            return papers
+        ids, exclude = matched
+        if exclude:
+            return [paper for paper in papers if paper[0] not in ids]
+        return [paper for paper in papers if paper[0] in ids]
+
+
+TAG_INDEX = TagIndex()
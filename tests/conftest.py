@@ -0,0 +1,25 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# database opens its library at import time, so point it at a scratch file before any test imports it
+LIBRARY_DIRECTORY = tempfile.mkdtemp(prefix="paperflux-test-")
+atexit.register(shutil.rmtree, LIBRARY_DIRECTORY, True)
+os.environ["PAPERFLUX_DB"] = os.path.join(LIBRARY_DIRECTORY, "research_library.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fresh_library(tmp_path, monkeypatch):
+    """An empty library of its own standing in for database.DATABASE, with the default categories."""
+    import database
+
+    library = database.Database(str(tmp_path / "research_library.db"))
+    monkeypatch.setattr(database, "DATABASE", library)
+    database.Folder.default_entries()
+    yield library
+    library.close()
@@ -0,0 +1,191 @@
+import io
+import json
+import re
+
+import pytest
+
+import database
+from bibliography import READERS, content_key, export_file, import_file
+
+BIBTEX = r"""
+@string{jmlr = "Journal of Machine Learning Research"}
+@comment{exported by Zotero}
+
+@article{vaswani2017,
+  title = {{Attention} Is All You {N}eed},
+  author = {Vaswani, Ashish and Shazeer, Noam and {Barnes and Noble}},
+  journal = jmlr # " 2017",
+  eprint = {1706.03762},
+  archivePrefix = {arXiv},
+  abstract = "Sequence transduction with {M\"uller} \& friends",
+  file = {Full Text PDF:/papers/attention.pdf:application/pdf},
+  groups = {Transformers, NLP}
+}
+
+@misc{nodoi,
+  title = "A web page",
+  url = {https://example.com/page_1}
+}
+"""
+
+RIS = """TY  - JOUR
+TI  - Deep Residual Learning
+AU  - He, Kaiming
+AU  - Zhang, Xiangyu
+DO  - https://doi.org/10.1109/CVPR.2016.90
+L1  - file:///papers/resnet.pdf
+ER  -
+
+TY  - ELEC
+TI  - Untitled arXiv note
+UR  - https://arxiv.org/abs/2101.00001v2
+ER  -
+"""
+
+CSL_JSON = json.dumps([
+    {"id": "1", "type": "article", "title": "Graph Attention Networks",
+     "author": [{"given": "Petar", "family": "Veličković"}, {"literal": "Yoshua Bengio"}],
+     "number": "arXiv:1710.10903", "URL": "https://arxiv.org/abs/1710.10903"},
+    {"id": "2", "type": "article-journal", "title": "Dropout", "DOI": "10.5555/2627435.2670313"},
+])
+
+
+def read(fmt: str, text: str):
+    return list(READERS[fmt](io.StringIO(text)))
+
+
+def test_bibtex_reader_expands_macros_latex_and_attachments():
+    attention, page = read("bibtex", BIBTEX)
+
+    assert attention["title"] == "Attention Is All You Need"
+    assert attention["authors"] == ["Ashish Vaswani", "Noam Shazeer", "Barnes and Noble"]
+    assert attention["abstract"] == "Sequence transduction with Müller & friends"
+    assert attention["arxiv_id"] == "1706.03762"
+    assert attention["file_path"] == "/papers/attention.pdf"
+    assert attention["folder"] == "Transformers"
+    assert page["url"] == "https://example.com/page_1"
+    assert page["arxiv_id"] is None
+
+
+def test_ris_reader():
+    resnet, note = read("ris", RIS)
+
+    assert resnet["title"] == "Deep Residual Learning"
+    assert resnet["authors"] == ["Kaiming He", "Xiangyu Zhang"]
+    assert resnet["doi"] == "10.1109/cvpr.2016.90"
+    assert resnet["file_path"] == "/papers/resnet.pdf"
+    assert note["arxiv_id"] == "2101.00001"
+
+
+def test_csl_json_reader_streams_items_split_across_reads(monkeypatch):
+    import bibliography
+
+    monkeypatch.setattr(bibliography, "READ_SIZE", 7)
+    gat, dropout = read("csl-json", CSL_JSON)
+
+    assert gat["authors"] == ["Petar Veličković", "Yoshua Bengio"]
+    assert gat["arxiv_id"] == "1710.10903"
+    assert dropout["doi"] == "10.5555/2627435.2670313"
+
+
+def test_csl_json_reader_rejects_a_single_object():
+    with pytest.raises(ValueError):
+        read("csl-json", '{"title": "Not a list"}')
+
+
+def test_content_key_ignores_case_accents_punctuation_and_given_names():
+    key = content_key("Graph Attention Networks", ["Petar Veličković"])
+
+    assert content_key("graph attention networks.", "P. Velickovic, Yoshua Bengio") == key
+    assert content_key("Graph Attention Networks", ["Someone Else"]) != key
+    assert content_key("Graph Attention Network", ["Petar Veličković"]) != key
+
+
+def write_file(tmp_path, name: str, text: str):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def library_papers():
+    return database.DATABASE.fetchall("""
+    SELECT p.title, p.authors, p.arxiv_id, p.doi, f.folder_name
+    FROM papers p INNER JOIN folders f ON f.id = p.folder_id
+    WHERE p.title NOT IN ('Medium', 'TowardsDataScience', 'ArXiv', 'Machine Learning Mastery')
+    ORDER BY p.title
+    """)
+
+
+def test_reimporting_a_file_adds_nothing(fresh_library, tmp_path):
+    path = write_file(tmp_path, "refs.bib", BIBTEX)
+
+    assert [status for status, _ in import_file(path)] == ["added", "added"]
+    assert [status for status, _ in import_file(path)] == ["exists", "exists"]
+    assert ("Attention Is All You Need", "Ashish Vaswani, Noam Shazeer, Barnes and Noble", "1706.03762", None,
+            "Transformers") in library_papers()
+
+
+def ris_record(title: str, author: str, url: str):
+    return f"TY  - ELEC\nTI  - {title}\nAU  - {author}\nUR  - {url}\nER  - \n"
+
+
+def test_import_dedupes_on_title_and_first_author(fresh_library, tmp_path):
+    list(import_file(write_file(tmp_path, "first.ris", ris_record("Deep Residual Learning", "He, Kaiming",
+                                                                      "https://example.com/1"))))
+    # Neither the URL nor case and punctuation make it another paper, another first author does
+    again = ris_record("Deep residual learning.", "Kaiming He", "https://example.com/2")
+    other = ris_record("Deep residual learning.", "Else, Someone", "https://example.com/3")
+
+    assert list(import_file(write_file(tmp_path, "again.ris", again))) == [("exists", "Deep residual learning.")]
+    assert list(import_file(write_file(tmp_path, "other.ris", other))) == [("added", "Deep residual learning.")]
+
+
+@pytest.mark.parametrize("fmt, extension", [("bibtex", ".bib"), ("ris", ".ris"), ("csl-json", ".json")])
+def test_export_reads_back_as_the_same_library(fresh_library, tmp_path, fmt, extension):
+    list(import_file(write_file(tmp_path, "refs.bib", BIBTEX)))
+    list(import_file(write_file(tmp_path, "refs.ris", RIS)))
+    list(import_file(write_file(tmp_path, "refs.json", CSL_JSON)))
+    exported = io.StringIO()
+    count = export_file(exported, fmt)
+    records = read(fmt, exported.getvalue())
+
+    assert count == len(records) == len(database.DATABASE.fetchall("SELECT id FROM papers"))
+    by_title = {record["title"]: record for record in records}
+    for title, authors, arxiv_id, doi, folder_name in library_papers():
+        record = by_title[title]
+        assert record["authors"] == ([name.strip() for name in authors.split(",")] if authors else [])
+        # Papers without an arXiv id are keyed by a uuid, which is not exported
+        assert record["arxiv_id"] == (arxiv_id if re.fullmatch(r"\d{4}\.\d{4,5}", arxiv_id) else None)
+        assert record["doi"] == doi
+        if fmt == "bibtex":
+            assert record["folder"] == folder_name
+    # Importing the export again finds every paper already there
+    path = write_file(tmp_path, "again" + extension, exported.getvalue())
+    assert {status for status, _ in import_file(path)} == {"exists"}
+
+
+def test_export_links_only_files_that_exist(fresh_library, tmp_path):
+    downloaded = tmp_path / "downloaded.pdf"
+    downloaded.write_bytes(b"%PDF-1.4")
+    database.Paper.insert_row("1", "Downloaded", None, None, str(downloaded), None, 1)
+    database.Paper.insert_row("2", "Not downloaded yet", None, None, str(tmp_path / "missing.pdf"),
+                              "https://arxiv.org/pdf/2", 1)
+    for fmt in ("bibtex", "ris"):
+        exported = io.StringIO()
+        export_file(exported, fmt)
+        files = {record["title"]: record["file_path"] for record in read(fmt, exported.getvalue())}
+
+        assert files["Downloaded"] == str(downloaded)
+        assert files["Not downloaded yet"] is None
+
+
+def test_export_reads_through_a_second_connection(fresh_library, tmp_path):
+    list(import_file(write_file(tmp_path, "refs.bib", BIBTEX)))
+    connection = fresh_library.open_reader()
+    exported = io.StringIO()
+    try:
+        count = export_file(exported, "csl-json", connection=connection, progress=lambda done: None)
+    finally:
+        connection.close()
+
+    assert count == len(json.loads(exported.getvalue())) == len(database.DATABASE.fetchall("SELECT id FROM papers"))
@@ -0,0 +1,126 @@
+import datetime
+import os
+
+import pytest
+
+import cold_storage
+import database
+from cold_storage import ColdStorage, compress, extract, open_compressed
+from database import Paper
+from smart_collection import TIME_FORMAT
+
+DAYS = 365
+
+
+@pytest.fixture
+def library(fresh_library, tmp_path, monkeypatch):
+    monkeypatch.setenv(cold_storage.COLD_DIR_ENV, str(tmp_path / "cold"))
+    monkeypatch.setattr(cold_storage, "cache_directory", lambda: str(tmp_path / "cache"))
+    (tmp_path / "papers").mkdir()
+    return tmp_path
+
+
+def add_pdf(directory, title: str, content: bytes, days_since_view=None):
+    file_path = str(directory / "papers" / f"{title}.pdf")
+    with open(file_path, "wb") as f:
+        f.write(content)
+    Paper.insert_row(title, title, None, None, file_path, None, 1)
+    paper_id = Paper.get_paper_id_of_title(title)[0]
+    if days_since_view is not None:
+        last_view = datetime.datetime.now() - datetime.timedelta(days=days_since_view)
+        database.DATABASE.execute_with_args("UPDATE papers SET last_view = ? WHERE id = ?",
+                                            (last_view.strftime(TIME_FORMAT), paper_id))
+    return paper_id, file_path
+
+
+def read(file_path: str):
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+def test_archive_and_restore_give_back_the_same_file(library):
+    content = os.urandom(100_000) + b"%%EOF" * 1000
+    paper_id, file_path = add_pdf(library, "old", content, days_since_view=DAYS + 1)
+
+    archived = list(ColdStorage.archive(DAYS))
+    assert [(archived_id, path) for archived_id, path, _, _ in archived] == [(paper_id, file_path)]
+    assert not os.path.exists(file_path)
+    archive_path, sha256, size = ColdStorage.get(paper_id)
+    assert os.path.exists(archive_path) and size == len(content)
+
+    assert ColdStorage.restore(paper_id) == file_path
+    assert read(file_path) == content
+    assert ColdStorage.get(paper_id) is None
+    assert not os.path.exists(archive_path)
+
+
+def test_only_pdfs_unopened_for_long_enough_are_archived(library):
+    add_pdf(library, "recent", b"recent", days_since_view=DAYS - 1)
+    pinned_id, _ = add_pdf(library, "pinned", b"pinned", days_since_view=DAYS + 1)
+    database.DATABASE.execute_with_args("INSERT INTO pinned_papers (paper_id) VALUES (?)", (pinned_id,))
+    never_opened_id, _ = add_pdf(library, "never opened", b"never opened")
+    database.DATABASE.execute_with_args("UPDATE papers SET added_at = datetime('now', '-400 days') WHERE id = ?",
+                                        (never_opened_id,))
+    add_pdf(library, "just added", b"just added")
+
+    assert [paper_id for paper_id, _, _ in ColdStorage.get_candidates(DAYS)] == [never_opened_id]
+
+
+def test_a_damaged_archive_is_not_restored(library):
+    paper_id, file_path = add_pdf(library, "old", b"original contents", days_since_view=DAYS + 1)
+    list(ColdStorage.archive(DAYS))
+    archive_path = ColdStorage.get(paper_id)[0]
+    with open_compressed(archive_path, "wb") as f:
+        f.write(b"other contents!!!")
+
+    with pytest.raises(ValueError):
+        ColdStorage.restore(paper_id)
+    assert not os.path.exists(file_path)
+    assert [name for name in os.listdir(os.path.dirname(file_path)) if name.endswith(".part")] == []
+    assert ColdStorage.get(paper_id) is not None
+
+
+def test_a_file_changed_while_it_was_compressed_is_kept(library):
+    paper_id, file_path = add_pdf(library, "old", b"first version", days_since_view=DAYS + 1)
+    last_view = ColdStorage.get_candidates(DAYS)[0][2]
+    archived = compress(file_path)
+    with open(file_path, "ab") as f:
+        f.write(b" and more")
+
+    assert not ColdStorage.store(paper_id, file_path, last_view, archived)
+    assert read(file_path) == b"first version and more"
+    assert not os.path.exists(archived[0])
+    assert ColdStorage.get(paper_id) is None
+
+
+def test_identical_files_share_one_archive(library):
+    first_id, _ = add_pdf(library, "first", b"same bytes" * 100, days_since_view=DAYS + 1)
+    second_id, _ = add_pdf(library, "second", b"same bytes" * 100, days_since_view=DAYS + 1)
+    list(ColdStorage.archive(DAYS))
+    archive_path = ColdStorage.get(first_id)[0]
+    assert ColdStorage.get(second_id)[0] == archive_path
+
+    [usage] = ColdStorage.usage()
+    assert usage["files"] == 2
+    assert usage["archived_bytes"] == os.path.getsize(archive_path)
+
+    ColdStorage.restore(first_id)
+    assert os.path.exists(archive_path)
+    ColdStorage.restore(second_id)
+    assert not os.path.exists(archive_path)
+
+
+def test_opening_an_archived_file_reads_a_checked_copy_from_the_cache(library):
+    content = b"cached" * 1000
+    paper_id, file_path = add_pdf(library, "old", content, days_since_view=DAYS + 1)
+    list(ColdStorage.archive(DAYS))
+    archive_path, sha256, size = ColdStorage.get(paper_id)
+
+    cache_path = extract(archive_path, sha256, size)
+    assert read(cache_path) == content
+    assert extract(archive_path, sha256, size) == cache_path
+    # A copy that does not match the recorded hash never reaches the cache
+    os.remove(cache_path)
+    with pytest.raises(ValueError):
+        extract(archive_path, "0" * 64, size)
+    assert not os.path.exists(cache_path)
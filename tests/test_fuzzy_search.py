@@ -0,0 +1,63 @@
+import pytest
+
+from database import Paper
+from fuzzy_search import search, search_titles
+
+TRANSFORMERS = 30
+
+
+@pytest.fixture
+def library(fresh_library):
+    Paper.insert_rows([
+        ("1706.03762", "Attention Is All You Need", "Ashish Vaswani, Noam Shazeer", None, "/papers/a.pdf", None, 1),
+        ("file-name", "graph_neural-networks.v2", None, None, "/papers/g.pdf", None, 1),
+        ("unrelated", "Quantum Chromodynamics on the Lattice", None, None, "/papers/q.pdf", None, 1),
+    ] + [(f"t{n}", f"Transformer {n}", None, None, f"/papers/t{n}.pdf", None, 1) for n in range(TRANSFORMERS)])
+    # Near misses sharing most of the trigrams of "transformer"
+    Paper.insert_rows([(f"n{n}", f"Transformed transforms {n}", None, None, f"/papers/n{n}.pdf", None, 1)
+                       for n in range(TRANSFORMERS)])
+    fresh_library.execute_with_args("UPDATE papers SET last_view = '2026-01-01' WHERE arxiv_id = 't7'")
+
+
+def titles(rows):
+    return [row[1] for row in rows]
+
+
+def test_a_misspelt_query_finds_the_paper_first(library):
+    assert titles(search_titles("atention is al you need"))[0] == "Attention Is All You Need"
+
+
+def test_file_name_separators_count_as_spaces(library):
+    assert titles(search_titles("graph neural networks"))[0] == "graph_neural-networks.v2"
+
+
+def test_authors_are_searched_too(library):
+    assert titles(search_titles("vaswany"))[0] == "Attention Is All You Need"
+
+
+def test_papers_sharing_too_little_of_the_query_are_left_out(library):
+    assert "Quantum Chromodynamics on the Lattice" not in titles(search_titles("attention networks"))
+
+
+def test_every_verbatim_match_is_listed_first_however_small_the_fuzzy_limit(library):
+    results = titles(search_titles("transformer", limit=5))
+    verbatim = [title for title in results if title.startswith("Transformer ")]
+
+    assert len(verbatim) == TRANSFORMERS
+    assert results[:TRANSFORMERS] == verbatim
+    # In the order of the plain search, most recently viewed first
+    assert verbatim[0] == "Transformer 7"
+    assert len(results) <= TRANSFORMERS + 5
+
+
+def test_short_queries_use_the_plain_search(library):
+    assert titles(search_titles("ll")) == titles(Paper.search_paper("ll"))
+
+
+def test_saved_article_text_is_searched_after_titles(library):
+    article_id = Paper.get_paper_id_of_title("Quantum Chromodynamics on the Lattice")[0]
+    Paper.set_article_text(article_id, "Gluons bind quarks into hadrons")
+
+    results = titles(search("gluons quarks"))
+    assert results[-1] == "Quantum Chromodynamics on the Lattice"
+    assert titles(search("gluons leptons")) == []
@@ -0,0 +1,78 @@
+import pytest
+
+import database
+from database import Folder, Paper
+
+PAPERS = 57
+
+
+@pytest.fixture
+def library(fresh_library):
+    Folder.insert_row("Physics", 0)
+    physics_id = Folder.get_folder_id_for_title("Physics")[0]
+    Folder.insert_row("Optics", physics_id)
+    optics_id = Folder.get_folder_id_for_title("Optics")[0]
+    folders = (1, physics_id, optics_id)
+    Paper.insert_rows([(f"{n}", f"{'Laser' if n % 4 == 0 else 'Paper'} {n}", None, None, f"/papers/{n}.pdf", None,
+                        folders[n % 3]) for n in range(PAPERS)])
+    # Ties on last_view and added_at across page boundaries, and a third of the papers never viewed
+    fresh_library.execute_with_args("UPDATE papers SET added_at = '2026-01-01 00:00:00'")
+    fresh_library.execute_with_args("UPDATE papers SET last_view = '2026-02-0' || (id % 3 + 1) WHERE id % 3 != 0")
+    return physics_id
+
+
+def all_pages(page_size: int, title=None, folder_id=None):
+    rows, cursor = Paper.get_papers_page(None, page_size, title, folder_id)
+    pages = [rows]
+    while cursor is not None:
+        rows, cursor = Paper.get_papers_page(cursor, page_size, title, folder_id)
+        pages.append(rows)
+    return pages
+
+
+def filtered(title=None, folder_id=None):
+    folder_ids = None if folder_id is None else {descendant_id for (descendant_id,) in database.DATABASE.fetchall(
+        "SELECT descendant_id FROM folder_closure WHERE ancestor_id = ?", (folder_id,))}
+    return [row for row in Paper.get_all_papers()
+            if (title is None or title.lower() in row[1].lower())
+            and (folder_ids is None or database.DATABASE.fetchone(
+                "SELECT folder_id FROM papers WHERE id = ?", (row[0],))[0] in folder_ids)]
+
+
+@pytest.mark.parametrize("page_size", [1, 5, 19, 61, 200])
+def test_pages_list_every_paper_once_in_library_order(library, page_size):
+    pages = all_pages(page_size)
+
+    assert [tuple(row) for page in pages for row in page] == [tuple(row) for row in Paper.get_all_papers()]
+    assert all(len(page) == page_size for page in pages[:-1])
+    assert len(pages[-1]) <= page_size
+
+
+def test_the_page_after_a_full_last_page_is_empty(library):
+    total = len(Paper.get_all_papers())
+    rows, cursor = Paper.get_papers_page(None, total)
+    assert len(rows) == total
+    assert Paper.get_papers_page(cursor, total) == ([], None)
+
+
+@pytest.mark.parametrize("title, folder", [("laser", False), (None, True), ("laser", True)])
+def test_filtered_pages_match_the_filtered_library(library, title, folder):
+    folder_id = library if folder else None
+    expected = [tuple(row) for row in filtered(title, folder_id)]
+
+    assert [tuple(row) for page in all_pages(4, title, folder_id) for row in page] == expected
+    assert [tuple(row) for row in Paper.iter_papers(title, folder_id, page_size=4)] == expected
+    # Subcategories are included
+    assert folder_id is None or len(expected) > len([row for row in expected if row[2] == "Physics"])
+
+
+def test_a_paper_added_between_pages_is_listed_once(library):
+    papers = Paper.iter_papers(page_size=10)
+    first = [next(papers) for _ in range(10)]
+    Paper.insert_row("late", "Late arrival", None, None, "/papers/late.pdf", None, 1)
+    rest = list(papers)
+
+    ids = [row.id for row in first + rest]
+    assert len(ids) == len(set(ids))
+    # Never viewed, so it sorts after the viewed papers the cursor is still in
+    assert "Late arrival" in [row.title for row in rest]
@@ -0,0 +1,47 @@
+import pytest
+
+import database
+from cli import hot_queries
+from database import Folder, Paper
+from query_log import QueryLog, is_full_scan
+
+PAPERS = 2000
+
+
+@pytest.fixture(scope="module", autouse=True)
+def library():
+    Folder.default_entries()
+    Folder.insert_row("Physics", 0)
+    Paper.insert_rows([(f"{n}", f"Paper {n}", "Author", None, f"/papers/{n}.pdf", None, 1 + n % 3)
+                       for n in range(PAPERS)])
+    database.DATABASE.execute_with_args("UPDATE papers SET last_view = datetime('now', -id || ' minutes') "
+                                        "WHERE id % 2 = 0")
+
+
+@pytest.mark.parametrize("name, run_query", hot_queries(), ids=[name for name, _ in hot_queries()])
+def test_hot_query_uses_an_index(name, run_query):
+    database.DATABASE.query_log.reset()
+    run_query()
+    assert database.DATABASE.query_log.statements, f"{name} ran no statement"
+    for statement in database.DATABASE.query_log.statements.values():
+        plan = QueryLog.explain(database.DATABASE.conn, statement.query, [None] * statement.query.count("?"))
+        assert not is_full_scan(plan), f"{name}: {statement.query.strip()}\n" + "\n".join(plan)
+
+
+def test_migrate_backs_up_before_changing_the_schema(tmp_path):
+    path = tmp_path / "library.db"
+    old = database.sqlite3.connect(path)
+    old.executescript("""
+    CREATE TABLE folders (id INTEGER PRIMARY KEY AUTOINCREMENT, folder_name TEXT not null unique,
+                          parent_folder_id integer);
+    INSERT INTO folders (folder_name, parent_folder_id) VALUES ('kept', 0);
+    """)
+    old.close()
+
+    upgraded = database.Database(str(path))
+
+    assert upgraded.schema_version() == database.MIGRATIONS[-1][0]
+    backup = database.sqlite3.connect(tmp_path / "backup_library.db")
+    assert backup.execute("PRAGMA user_version").fetchone()[0] == 0
+    assert backup.execute("SELECT name FROM sqlite_master WHERE name LIKE 'idx_%'").fetchall() == []
+    assert backup.execute("SELECT folder_name FROM folders").fetchall() == [("kept",)]
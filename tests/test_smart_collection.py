@@ -0,0 +1,119 @@
+import datetime
+import os
+import time
+
+import pytest
+
+import database
+from database import Folder, Paper
+from smart_collection import TIME_FORMAT, SmartCollection
+
+
+@pytest.fixture
+def tokyo():
+    """Local time nine hours ahead of UTC, where mixing up last_view and added_at shows."""
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = "Asia/Tokyo"
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = previous
+    time.tzset()
+
+
+def add_paper(title: str, folder_id: int = 1):
+    Paper.insert_row(title, title, None, None, f"/papers/{title}.pdf", None, folder_id)
+    return Paper.get_paper_id_of_title(title)[0]
+
+
+def create(name: str, rules: list):
+    SmartCollection.insert_row(name, rules)
+    return next(collection_id for collection_id, collection_name, _, _ in SmartCollection.get_all_collections()
+                if collection_name == name)
+
+
+def members(collection_id: int):
+    return {title for _, title, _, _ in SmartCollection.get_papers(collection_id)}
+
+
+def days_ago(days: float, utc: bool):
+    now = datetime.datetime.now(datetime.timezone.utc) if utc else datetime.datetime.now()
+    return (now - datetime.timedelta(days=days)).strftime(TIME_FORMAT)
+
+
+def set_column(title: str, column: str, value):
+    database.DATABASE.execute_with_args(f"UPDATE papers SET {column} = ? WHERE title = ?", (value, title))
+
+
+def let_time_pass(collection_id: int, days: float):
+    """Move the last evaluation back, as if it had been days ago, without marking any paper written."""
+    database.DATABASE.execute_with_args("UPDATE collections SET evaluated_at = ? WHERE id = ?",
+                                        (days_ago(days, utc=False), collection_id))
+    database.DATABASE.execute_with_args("DELETE FROM collection_dirty")
+
+
+def test_written_papers_join_and_leave(fresh_library):
+    add_paper("Graph kernels")
+    collection_id = create("Graphs", [["title_contains", "graph"]])
+    assert members(collection_id) == {"Graph kernels"}
+
+    add_paper("Graph attention")
+    set_column("Graph kernels", "title", "Set kernels")
+    assert members(collection_id) == {"Graph attention"}
+    assert database.DATABASE.fetchall("SELECT paper_id FROM collection_dirty") == []
+
+
+def test_removed_papers_leave(fresh_library):
+    paper_id = add_paper("Graph kernels")
+    collection_id = create("Graphs", [["title_contains", "graph"]])
+
+    Paper.soft_delete_row(paper_id)
+    assert members(collection_id) == set()
+
+
+def test_moving_a_folder_in_or_out_of_the_category_updates_in_folder_rules(fresh_library):
+    Folder.insert_row("Physics", 0)
+    Folder.insert_row("Optics", 0)
+    physics_id = Folder.get_folder_id_for_title("Physics")[0]
+    optics_id = Folder.get_folder_id_for_title("Optics")[0]
+    add_paper("Lasers", optics_id)
+    collection_id = create("Physics papers", [["in_folder", physics_id]])
+    assert members(collection_id) == set()
+
+    Folder.move_folder(optics_id, physics_id)
+    assert members(collection_id) == {"Lasers"}
+    Folder.move_folder(optics_id, 0)
+    assert members(collection_id) == set()
+
+
+def test_not_opened_compares_last_view_in_local_time_and_added_at_in_utc(fresh_library, tokyo):
+    for title in ("viewed long ago", "viewed lately", "added long ago", "added lately"):
+        add_paper(title)
+    set_column("viewed long ago", "last_view", days_ago(7.2, utc=False))
+    set_column("viewed lately", "last_view", days_ago(6.8, utc=False))
+    set_column("added long ago", "added_at", days_ago(7.2, utc=True))
+    set_column("added lately", "added_at", days_ago(6.8, utc=True))
+
+    collection_id = create("Stale", [["not_opened_for_days", 7]])
+    assert members(collection_id) == {"viewed long ago", "added long ago"}
+
+
+def test_papers_cross_time_windows_without_being_written(fresh_library, tokyo):
+    add_paper("opened")
+    add_paper("added")
+    set_column("opened", "last_view", days_ago(6.5, utc=False))
+    set_column("added", "added_at", days_ago(6.5, utc=True))
+    stale_id = create("Stale", [["not_opened_for_days", 7]])
+    recent_id = create("Recent", [["added_within_days", 7]])
+    assert members(stale_id) == set()
+    assert "added" in members(recent_id)
+
+    # A day later, as far as the windows can tell: both papers are now 7.5 days old
+    set_column("opened", "last_view", days_ago(7.5, utc=False))
+    set_column("added", "added_at", days_ago(7.5, utc=True))
+    let_time_pass(stale_id, 1)
+    let_time_pass(recent_id, 1)
+    assert members(stale_id) == {"opened", "added"}
+    assert "added" not in members(recent_id)
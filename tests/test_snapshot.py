@@ -0,0 +1,80 @@
+import base64
+
+import pytest
+
+import snapshot
+
+PAGE = """<html><head>
+<link rel="stylesheet" href="/css/site.css">
+<style>h1 { background: url('img/title.png') } p { background: url(javascript:alert(1)) }</style>
+</head><body>
+<article style="background-image: url(&quot;/img/paper.png&quot;)">
+<h1>Title</h1>
+<svg><a href="https://example.com/safe"><animate attributeName="href" to="javascript:alert(1)"/>
+<set attributeName="xlink:href" to="javascript:alert(1)"/><animate attributeName="opacity" to="0"/>
+<rect filter="url(#blur)"/></a></svg>
+<img src="https://cdn.example.com/huge.png">
+</article></body></html>"""
+ASSETS = {
+    "https://example.com/css/site.css": b'@import "print.css"; @font-face { src: url(../fonts/serif.woff2) }',
+    "https://example.com/css/print.css": b"body { color: black }",
+    "https://example.com/fonts/serif.woff2": b"font",
+    "https://example.com/articles/img/title.png": b"title",
+    "https://example.com/img/paper.png": b"paper",
+    "https://cdn.example.com/huge.png": b"x" * 100,
+}
+
+
+class Response:
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.text = content.decode("utf-8")
+        self.headers = {}
+
+
+@pytest.fixture
+def snapshot_html(monkeypatch):
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return Response(PAGE.encode("utf-8") if url == "https://example.com/articles/page" else ASSETS[url])
+
+    monkeypatch.setattr(snapshot, "fetch", fetch)
+    monkeypatch.setattr(snapshot, "MAX_TOTAL_ASSET_BYTES", 99)
+    html, _ = snapshot.capture("https://example.com/articles/page")
+    return html, fetched
+
+
+def embedded(content: bytes):
+    return base64.b64encode(content).decode("ascii")
+
+
+def test_css_urls_are_embedded_relative_to_their_stylesheet(snapshot_html):
+    html, fetched = snapshot_html
+
+    assert set(fetched) == {"https://example.com/articles/page"} | ASSETS.keys()
+    for name in ("print.css", "serif.woff2", "title.png", "paper.png"):
+        assert embedded(next(content for url, content in ASSETS.items() if url.endswith(name))) in html
+    assert 'filter="url(#blur)"' in html
+
+
+def test_css_urls_that_run_script_are_dropped(snapshot_html):
+    html, _ = snapshot_html
+
+    assert "javascript:" not in html
+    assert "background: none" in html
+
+
+def test_only_animations_of_urls_are_removed(snapshot_html):
+    html, _ = snapshot_html
+
+    assert html.count("<animate") == 1 and 'attributename="opacity"' in html
+    assert "<set" not in html
+
+
+def test_assets_over_the_budget_stay_links(snapshot_html):
+    html, _ = snapshot_html
+
+    assert 'src="https://cdn.example.com/huge.png"' in html
@@ -0,0 +1,17 @@
+import os
+
+import storage
+from database import Paper
+from storage import Storage
+
+
+def test_only_files_below_the_downloads_directory_are_listed(fresh_library, tmp_path, monkeypatch):
+    # _ and % are wildcards to LIKE, they must match only themselves here
+    downloads = str(tmp_path / "down_loads%")
+    monkeypatch.setattr(storage, "FILE_PATH", downloads)
+    Paper.insert_row("1", "Downloaded", None, None, os.path.join(downloads, "a.pdf"), None, 1)
+    Paper.insert_row("2", "Lookalike", None, None, str(tmp_path / "downXloads-more" / "b.pdf"), None, 1)
+    Paper.insert_row("3", "Sibling", None, None, downloads + "-old" + os.sep + "c.pdf", None, 1)
+
+    assert [file_path for _, file_path, _, _, _, _ in Storage.get_downloaded_papers()] == \
+        [os.path.join(downloads, "a.pdf")]
@@ -0,0 +1,129 @@
+import pytest
+
+import database
+import sync
+from database import Folder, Paper
+from sync import Sync
+
+ARXIV_ID = "2101.00001"
+
+
+@pytest.fixture
+def replicas(tmp_path, monkeypatch):
+    """Libraries syncing through one shared directory; replicas("a") makes library a the database.DATABASE."""
+    libraries = {}
+
+    def use(name: str):
+        if name not in libraries:
+            libraries[name] = database.Database(str(tmp_path / f"{name}.db"))
+            monkeypatch.setattr(database, "DATABASE", libraries[name])
+            Folder.default_entries()
+        monkeypatch.setattr(database, "DATABASE", libraries[name])
+
+    use.target = str(tmp_path / "shared")
+    yield use
+    for library in libraries.values():
+        library.close()
+
+
+def sync_all(replicas, *names):
+    for name in names:
+        replicas(name)
+        list(sync.sync(replicas.target))
+
+
+def paper_state():
+    return database.DATABASE.fetchone(
+        "SELECT title, abstract, last_view FROM papers WHERE arxiv_id = ?", (ARXIV_ID,))
+
+
+def update_paper(column: str, value):
+    database.DATABASE.execute_with_args(f"UPDATE papers SET {column} = ? WHERE arxiv_id = ?", (value, ARXIV_ID))
+
+
+def change_count():
+    return database.DATABASE.fetchone("SELECT COUNT(*) FROM change_log WHERE entity_key = ?", (ARXIV_ID,))[0]
+
+
+def test_each_column_keeps_its_latest_write_on_every_replica(replicas):
+    replicas("a")
+    Paper.insert_row(ARXIV_ID, "Original", "Ada Lovelace", None, "/papers/1.pdf", None, 1)
+    sync_all(replicas, "a", "b")
+
+    # b writes the title after its abstract, so its title is later than a's by the Lamport clock
+    replicas("a")
+    update_paper("title", "Title from a")
+    update_paper("last_view", "2026-01-02 03:04:05")
+    replicas("b")
+    update_paper("abstract", "Abstract from b")
+    update_paper("title", "Title from b")
+    sync_all(replicas, "a", "b", "a")
+
+    expected = ("Title from b", "Abstract from b", "2026-01-02 03:04:05")
+    for name in ("a", "b"):
+        replicas(name)
+        assert paper_state() == expected
+
+
+def test_simultaneous_writes_converge_on_the_same_value(replicas):
+    replicas("a")
+    Paper.insert_row(ARXIV_ID, "Original", None, None, "/papers/1.pdf", None, 1)
+    sync_all(replicas, "a", "b")
+
+    replicas("a")
+    update_paper("title", "Title from a")
+    replicas("b")
+    update_paper("title", "Title from b")
+    sync_all(replicas, "a", "b", "a")
+
+    replicas("a")
+    title = paper_state()[0]
+    replicas("b")
+    assert paper_state()[0] == title
+    assert title in ("Title from a", "Title from b")
+
+
+def test_a_deleted_paper_is_deleted_everywhere(replicas):
+    replicas("a")
+    Paper.insert_row(ARXIV_ID, "Original", None, None, "/papers/1.pdf", None, 1)
+    sync_all(replicas, "a", "b")
+
+    replicas("b")
+    database.DATABASE.execute_with_args("DELETE FROM papers WHERE arxiv_id = ?", (ARXIV_ID,))
+    sync_all(replicas, "b", "a")
+
+    replicas("a")
+    assert paper_state() is None
+
+
+def test_compaction_drops_overwritten_values_once_pushed(replicas):
+    replicas("a")
+    Paper.insert_row(ARXIV_ID, "Original", "Ada Lovelace", None, "/papers/1.pdf", None, 1)
+    for version in range(5):
+        update_paper("title", f"Title {version}")
+    assert change_count() == 6
+
+    sync_all(replicas, "a")
+    # The insert keeps its other columns, the last title write replaces the rest
+    assert change_count() == 2
+    assert Sync.merged_state("paper", ARXIV_ID)["title"] == "Title 4"
+    assert Sync.merged_state("paper", ARXIV_ID)["authors"] == "Ada Lovelace"
+
+    # Writes not pushed yet stay whole
+    update_paper("title", "Unpushed")
+    Sync.compact()
+    assert change_count() == 3
+
+    sync_all(replicas, "a", "b")
+    assert paper_state()[0] == "Unpushed"
+
+
+def test_a_new_replica_catches_up_from_the_compacted_history(replicas):
+    replicas("a")
+    Paper.insert_row(ARXIV_ID, "Original", None, None, "/papers/1.pdf", None, 1)
+    for version in range(3):
+        update_paper("title", f"Title {version}")
+        sync_all(replicas, "a")
+
+    sync_all(replicas, "b")
+    assert paper_state()[0] == "Title 2"
@@ -0,0 +1,86 @@
+import pytest
+
+from database import Paper
+from tag_index import TagIndex, bitmap_to_ids, parse_filter
+
+TAGS = {
+    "ml vision": {"ml", "vision"},
+    "ml nlp survey": {"ml", "nlp", "survey"},
+    "nlp": {"nlp"},
+    "vision survey": {"vision", "survey"},
+    "untagged": set(),
+}
+
+
+@pytest.fixture
+def index(fresh_library):
+    Paper.insert_rows([(title, title, None, None, f"/papers/{title}.pdf", None, 1) for title in TAGS])
+    index = TagIndex()
+    for title, tag_names in TAGS.items():
+        index.set_paper_tags(paper_id(title), tag_names)
+    return index
+
+
+def paper_id(title: str):
+    return Paper.get_paper_id_of_title(title)[0]
+
+
+def titles(paper_ids):
+    return {title for title in TAGS if paper_id(title) in paper_ids}
+
+
+def test_bitmap_to_ids_reads_every_set_bit():
+    assert bitmap_to_ids(0) == set()
+    assert bitmap_to_ids(1 << 0 | 1 << 7 | 1 << 8 | 1 << 1000) == {0, 7, 8, 1000}
+
+
+def test_parse_filter():
+    assert parse_filter("ml vision|nlp -survey") == ([["ml"], ["vision", "nlp"]], ["survey"])
+    assert parse_filter(" | ") == ([], [])
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("ml", {"ml vision", "ml nlp survey"}),
+    ("ml survey", {"ml nlp survey"}),
+    ("vision|nlp", {"ml vision", "ml nlp survey", "nlp", "vision survey"}),
+    ("vision|nlp -survey", {"ml vision", "nlp"}),
+    ("ml unknown", set()),
+])
+def test_match(index, text, expected):
+    paper_ids, exclude = index.match(text)
+
+    assert not exclude
+    assert titles(paper_ids) == expected
+
+
+def test_a_filter_of_only_not_terms_lists_the_papers_to_drop(index):
+    paper_ids, exclude = index.match("-survey")
+
+    assert exclude
+    assert titles(paper_ids) == {"ml nlp survey", "vision survey"}
+    papers = [(paper_id(title), title) for title in TAGS]
+    assert {title for _, title in index.filter_papers(papers, "-survey")} == {"ml vision", "nlp", "untagged"}
+
+
+def test_an_empty_filter_keeps_every_paper(index):
+    papers = [(paper_id(title), title) for title in TAGS]
+
+    assert index.match("") is None
+    assert index.filter_papers(papers, " ") == papers
+
+
+def test_retagging_moves_the_paper_between_bitmaps_and_drops_empty_tags(index):
+    index.set_paper_tags(paper_id("nlp"), ["vision", " "])
+
+    assert titles(index.match("nlp")[0]) == {"ml nlp survey"}
+    assert titles(index.match("vision")[0]) == {"ml vision", "vision survey", "nlp"}
+    index.set_paper_tags(paper_id("ml nlp survey"), [])
+    assert "nlp" not in index.tag_names()
+
+
+def test_a_reloaded_index_matches_the_updated_one(index):
+    index.set_paper_tags(paper_id("untagged"), ["new"])
+    reloaded = TagIndex()
+
+    assert reloaded.tag_names() == index.tag_names()
+    assert reloaded.bitmaps == index.bitmaps
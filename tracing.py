@@ -0,0 +1,179 @@
+import atexit
+import functools
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+
+# Tracing spans for the slow paths (SQL, filesystem, network, WebEngine loads), kept in a ring buffer and
+# exported as Chrome trace-event JSON for ui.perfetto.dev or chrome://tracing. Set PAPERFLUX_TRACE to a file
+# path to record from startup and write the trace there on exit, or use View -> Record Trace. While tracing
+# is off a span costs one attribute check.
+TRACE_ENV = "PAPERFLUX_TRACE"
+
+RING_SIZE = 200_000
+# inspect.CO_GENERATOR, without importing inspect at startup
+CO_GENERATOR = 0x20
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "category", "args", "started")
+
+    def __init__(self, tracer, name: str, category: str, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.complete(self.name, self.category, self.started, self.args)
+        return False
+
+
+class Tracer:
+    def __init__(self, size: int = RING_SIZE):
+        self.enabled = False
+        # (phase, name, category, start ns, duration ns, thread id, async id, args); deque appends are atomic
+        self.events = deque(maxlen=size)
+        self.thread_names = {}
+
+    def start(self):
+        self.events.clear()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def complete(self, name: str, category: str, started: int, args=None):
+        ended = time.perf_counter_ns()
+        self.events.append(("X", name, category, started, ended - started, threading.get_ident(), None, args))
+
+    def span(self, name: str, category: str, args=None):
+        """Context manager timing its block; args is a dict shown with the span."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def instant(self, name: str, category: str, args=None):
+        if self.enabled:
+            self.events.append(("i", name, category, time.perf_counter_ns(), 0, threading.get_ident(), None, args))
+
+    def begin(self, name: str, category: str, async_id, args=None):
+        """Start a span that ends in another callback, such as a page load."""
+        if self.enabled:
+            self.events.append(("b", name, category, time.perf_counter_ns(), 0, threading.get_ident(), async_id,
+                                args))
+
+    def end(self, name: str, category: str, async_id, args=None):
+        if self.enabled:
+            self.events.append(("e", name, category, time.perf_counter_ns(), 0, threading.get_ident(), async_id,
+                                args))
+
+    def traced(self, category: str, name: str = None):
+        """Decorator recording every call as a span, generators until they are exhausted."""
+
+        def decorate(function):
+            label = name or function.__qualname__
+
+            if function.__code__.co_flags & CO_GENERATOR:
+                @functools.wraps(function)
+                def generator_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return (yield from function(*args, **kwargs))
+                    started = time.perf_counter_ns()
+                    try:
+                        return (yield from function(*args, **kwargs))
+                    finally:
+                        self.complete(label, category, started)
+
+                return generator_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = time.perf_counter_ns()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.complete(label, category, started)
+
+            return wrapper
+
+        return decorate
+
+    def traced_methods(self, category: str):
+        """Class decorator tracing every static method, named Class.method."""
+
+        def decorate(cls):
+            for attribute, value in list(vars(cls).items()):
+                if isinstance(value, staticmethod):
+                    traced = self.traced(category, f"{cls.__name__}.{attribute}")(value.__func__)
+                    setattr(cls, attribute, staticmethod(traced))
+            return cls
+
+        return decorate
+
+    def name_thread(self, name: str):
+        self.thread_names[threading.get_ident()] = name
+
+    def as_dict(self):
+        pid = os.getpid()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        names[threading.main_thread().ident] = "GUI"
+        names.update(self.thread_names)
+
+        events = list(self.events)
+        trace_events = [{"ph": "M", "name": "process_name", "pid": pid, "args": {"name": "PaperFlux"}}]
+        for tid in sorted({event[5] for event in events}):
+            trace_events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid,
+                                 "args": {"name": names.get(tid, f"thread {tid}")}})
+
+        origin = min((event[3] for event in events), default=0)
+        for phase, name, category, started, duration, tid, async_id, args in events:
+            event = {"ph": phase, "name": name, "cat": category, "pid": pid, "tid": tid,
+                     "ts": (started - origin) / 1000}
+            if phase == "X":
+                event["dur"] = duration / 1000
+            elif phase == "i":
+                event["s"] = "t"
+            else:
+                event["id"] = str(async_id)
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def export(self, file_path: str):
+        temporary_path = f"{file_path}.part"
+        with open(temporary_path, "w") as f:
+            json.dump(self.as_dict(), f, default=str)
+        os.replace(temporary_path, file_path)
+        return len(self.events)
+
+
+TRACER = Tracer()
+
+if trace_path := os.environ.get(TRACE_ENV):
+    TRACER.start()
+    # Worker processes import this too and inherit the variable, only the app writes the trace
+    atexit.register(lambda: multiprocessing.parent_process() is None and TRACER.export(trace_path))
@@ -3,10 +3,17 @@ from PyQt6.QtWidgets import QTreeWidget, QTreeWidgetItem, QApplication
 
 from database import Folder
 
+# Category items keep their folder id here, paper items keep the paper id in UserRole
+FOLDER_ROLE = Qt.ItemDataRole.UserRole + 1
+POPULATED_ROLE = Qt.ItemDataRole.UserRole + 2
+COLLECTION_ROLE = Qt.ItemDataRole.UserRole + 3
+
 
 class TreeWidget(QTreeWidget):
 
     ItemChanged = pyqtSignal(int)
+    FolderExpanded = pyqtSignal(QTreeWidgetItem)
+    CollectionExpanded = pyqtSignal(QTreeWidgetItem)
 
     def __init__(self, parent=None):
         super(TreeWidget, self).__init__(parent)
@@ -19,17 +26,40 @@ class TreeWidget(QTreeWidget):
         self.setIndentation(15)
 
         self.itemClicked.connect(self.on_clicked_handler)
+        self.itemExpanded.connect(self.on_expanded_handler)
 
-        for (folder, ) in Folder.get_all_folders():
-            _ = self.get_category(folder)
+        for (folder_id, folder) in Folder.get_child_folders(0):
+            _ = self.get_category(folder, folder_id=folder_id)
 
     def on_clicked_handler(self, item):
         if paper_id := item.data(0, Qt.ItemDataRole.UserRole):
             self.ItemChanged.emit(paper_id)
 
-    def get_category(self, title, expand: bool = False) -> QTreeWidgetItem:
+    def on_expanded_handler(self, item):
+        # Subfolders and papers of a folder are only created the first time it is expanded
+        if item.data(0, FOLDER_ROLE) is not None and not item.data(0, POPULATED_ROLE):
+            item.setData(0, POPULATED_ROLE, True)
+            self.FolderExpanded.emit(item)
+        elif item.data(0, COLLECTION_ROLE) is not None:
+            # Collections are re-read on every expand, their membership is kept up to date in the database
+            item.takeChildren()
+            self.CollectionExpanded.emit(item)
+
+    def get_category(self, title, expand: bool = False, folder_id: int = None,
+                     parent: QTreeWidgetItem = None) -> QTreeWidgetItem:
         style = QApplication.style()
-        category = QTreeWidgetItem(self, [title])
+        category = QTreeWidgetItem(parent if parent is not None else self, [title])
         category.setIcon(0, style.standardIcon(style.StandardPixmap.SP_DirIcon))
+        if folder_id is not None:
+            category.setData(0, FOLDER_ROLE, folder_id)
+            category.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
         category.setExpanded(expand)
-        return category
\ No newline at end of file
+        return category
+
+    def get_collection(self, title, collection_id: int) -> QTreeWidgetItem:
+        style = QApplication.style()
+        collection = QTreeWidgetItem(self, [title])
+        collection.setIcon(0, style.standardIcon(style.StandardPixmap.SP_FileDialogContentsView))
+        collection.setData(0, COLLECTION_ROLE, collection_id)
+        collection.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
+        return collection
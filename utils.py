@@ -1,7 +1,4 @@
 import os
-import urllib.request
-
-from bs4 import BeautifulSoup
 
 from database import Paper
 
@@ -23,6 +20,10 @@ def get_storage_path():
 
 
 def arxiv_scrapper(arxiv_id):
+    import urllib.request
+
+    from bs4 import BeautifulSoup
+
     url = f"https://arxiv.org/abs/{arxiv_id}"
     response = urllib.request.urlopen(url)
     html = response.read().decode("utf-8")
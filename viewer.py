@@ -1,6 +1,7 @@
 from PyQt6.QtWebEngineCore import QWebEngineProfile, QWebEnginePage, QWebEngineSettings
 from PyQt6.QtWebEngineWidgets import QWebEngineView
 
+from tracing import TRACER
 from utils import get_storage_path
 
 
@@ -21,6 +22,10 @@ class Viewer(QWebEngineView):
 
         self.setPage(web_engine_page)
 
+        # One async span per page load, from the request until WebEngine has rendered it
+        self.loadStarted.connect(lambda: TRACER.begin("load", "webengine", id(self), {"url": self.url().toString()}))
+        self.loadFinished.connect(lambda ok: TRACER.end("load", "webengine", id(self), {"ok": ok}))
+
     def get_profile(self):
         storage_path = get_storage_path()
 
@@ -0,0 +1,145 @@
+import collections
+import datetime
+import linecache
+import os
+import sys
+import threading
+import time
+
+from PyQt6.QtCore import QTimer
+
+# GUI stall watchdog. A heartbeat timer on the GUI thread measures event-loop latency. A separate thread
+# samples the GUI thread's Python stack while the heartbeat is late by more than PAPERFLUX_STALL_MS, and
+# appends a report with the most frequent stacks and the duration histograms to PAPERFLUX_STALL_LOG, next to
+# the downloads by default. Off unless PAPERFLUX_STALL_MS is set, like PAPERFLUX_TRACE for the tracer.
+STALL_MS_ENV = "PAPERFLUX_STALL_MS"
+STALL_LOG_ENV = "PAPERFLUX_STALL_LOG"
+DEFAULT_STALL_LOG = os.path.join(os.path.dirname(os.path.realpath(__file__)), "paperflux-stalls.log")
+
+HEARTBEAT_MS = 100
+SAMPLE_MS = 20
+REPORTED_STACKS = 3
+LATENCY_BUCKETS_MS = (5, 20, 50, 100, 250, 500, 1000)
+STALL_BUCKETS_MS = (250, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, value: float):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def total(self):
+        return sum(self.counts)
+
+    def format(self):
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return "  ".join(f"{label} ms: {count}" for label, count in zip(labels, self.counts))
+
+
+def stack_of(frame):
+    """(file, line, function) frames of a stack, outermost first."""
+    stack = []
+    while frame is not None:
+        stack.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def format_stack(stack):
+    lines = []
+    for file_name, line_number, function_name in stack:
+        lines.append(f'    File "{file_name}", line {line_number}, in {function_name}')
+        if source := linecache.getline(file_name, line_number).strip():
+            lines.append(f"      {source}")
+    return lines
+
+
+class Watchdog:
+
+    def __init__(self, stall_ms: float = None, log_path: str = None):
+        stall_ms = float(os.environ.get(STALL_MS_ENV) or 0) if stall_ms is None else stall_ms
+        self.stall = stall_ms / 1000
+        self.log_path = log_path or os.environ.get(STALL_LOG_ENV) or DEFAULT_STALL_LOG
+        self.heartbeat = HEARTBEAT_MS / 1000
+        self.last_beat = time.perf_counter()
+        # (started, duration) of stalls the heartbeat has recovered from, reported by the watchdog thread
+        self.recovered = collections.deque()
+        self.latency = Histogram(LATENCY_BUCKETS_MS)
+        self.stalls = Histogram(STALL_BUCKETS_MS)
+        self.gui_thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.timer = None
+        self.thread = None
+
+    def enabled(self):
+        return self.stall > 0
+
+    def start(self, parent=None):
+        """Call from the GUI thread."""
+        if not self.enabled():
+            return
+        self.gui_thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        self.timer = QTimer(parent)
+        self.timer.setInterval(HEARTBEAT_MS)
+        self.timer.timeout.connect(self.beat)
+        self.timer.start()
+        self.thread = threading.Thread(target=self.watch, name="Watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.timer.stop()
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def beat(self):
+        now = time.perf_counter()
+        late = now - self.last_beat - self.heartbeat
+        self.latency.add(max(late, 0) * 1000)
+        if late >= self.stall:
+            self.recovered.append((self.last_beat, late))
+        self.last_beat = now
+
+    def watch(self):
+        stall_started, samples = None, collections.Counter()
+        while not self.stopped.wait(SAMPLE_MS / 1000):
+            last_beat = self.last_beat
+            if time.perf_counter() - last_beat - self.heartbeat >= self.stall:
+                if stall_started != last_beat:
+                    stall_started = last_beat
+                    samples.clear()
+                if (frame := sys._current_frames().get(self.gui_thread_id)) is not None:
+                    samples[stack_of(frame)] += 1
+                del frame
+
+            while self.recovered:
+                started, duration = self.recovered.popleft()
+                self.stalls.add(duration * 1000)
+                self.report(duration, samples if started == stall_started else collections.Counter())
+                stall_started, samples = None, collections.Counter()
+
+    def report(self, duration: float, samples: collections.Counter):
+        at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        lines = [f"{at} GUI thread stalled for {duration * 1000:.0f} ms ({sum(samples.values())} stack samples)"]
+        for stack, count in samples.most_common(REPORTED_STACKS):
+            lines.append(f"  {count} samples:")
+            lines += format_stack(stack)
+        lines.append(f"  stalls:  {self.stalls.format()}")
+        lines.append(f"  latency: {self.latency.format()}")
+        try:
+            with open(self.log_path, "a") as f:
+                f.write("\n".join(lines) + "\n\n")
+        except OSError as e:
+            print(f"Could not write the stall report: {e}")